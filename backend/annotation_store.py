@@ -0,0 +1,198 @@
+"""Screenshot annotations stored one record per annotation, with a grid index over their position.
+
+A screenshot's annotations start out embedded in its `annotations` array, which
+is how uploads and sync pushes write them. The first edit through the
+annotations API splits that array into records in the `annotations` collection;
+from then on the records are authoritative and an edit writes one record.
+
+Each split starts a new generation: the screenshot's `annotations_split` holds
+its token, which is also on every record written for it, and the grid size the
+records' cells are computed on, so changing ANNOTATION_GRID_SIZE only affects
+later splits. Readers only take records of the screenshot's current generation. Writing the whole array again
+(a sync push) clears `annotations_split`, and the next split replaces the
+records of older generations. An edit that raced with that lands in an old
+generation; `touch_screenshot` reports it, so the edit can be undone or retried.
+
+A split first claims the screenshot with an `annotations_splitting` marker, so
+only one runs at a time, and never deletes records of the generation it writes.
+
+Positions are the relative (0-1) marker coordinates the extension stores as
+relativeX/relativeY. Each record also carries the grid cell its marker falls
+in, so viewport queries read only the cells that overlap the box.
+"""
+import asyncio
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING
+
+import sync_log
+
+
+# Bookkeeping that stays on the server
+INTERNAL_FIELDS = {'_id': 0, 'screenshot_id': 0, 'generation': 0, 'cell': 0}
+
+# A claim older than this is from a split that died and may be taken over
+SPLIT_CLAIM_TIMEOUT = timedelta(seconds=30)
+SPLIT_ATTEMPTS = 100
+SPLIT_RETRY_SECONDS = 0.02
+
+BBox = Tuple[float, float, float, float]
+# A screenshot's `annotations_split`: {'token': str, 'grid_size': int}
+Generation = Dict[str, Any]
+
+
+def grid_position(value: float, grid_size: int) -> int:
+    return min(max(int(value * grid_size), 0), grid_size - 1)
+
+def cell_of(x: float, y: float, grid_size: int) -> int:
+    return grid_position(y, grid_size) * grid_size + grid_position(x, grid_size)
+
+def cells_in(bbox: BBox, grid_size: int) -> Optional[List[int]]:
+    """Grid cells overlapping `bbox`, or None when it covers so much that filtering by cell would not help."""
+    min_x, min_y, max_x, max_y = bbox
+    columns = range(grid_position(min_x, grid_size), grid_position(max_x, grid_size) + 1)
+    rows = range(grid_position(min_y, grid_size), grid_position(max_y, grid_size) + 1)
+    if len(columns) * len(rows) * 2 > grid_size ** 2:
+        return None
+    return [row * grid_size + column for row in rows for column in columns]
+
+def bbox_filter(bbox: BBox, grid_size: int) -> dict:
+    min_x, min_y, max_x, max_y = bbox
+    query = {'relativeX': {'$gte': min_x, '$lte': max_x}, 'relativeY': {'$gte': min_y, '$lte': max_y}}
+    cells = cells_in(bbox, grid_size)
+    if cells is not None:
+        query['cell'] = {'$in': cells}
+    return query
+
+def to_record(screenshot_id: str, generation: Generation, annotation: dict) -> Optional[dict]:
+    """A stored record for an annotation from an embedded array; None if it has no usable position."""
+    x, y = annotation.get('relativeX'), annotation.get('relativeY')
+    if not isinstance(x, (int, float)) or not isinstance(y, (int, float)) or 'id' not in annotation:
+        return None
+    return {**annotation, 'screenshot_id': screenshot_id, 'generation': generation['token'],
+            'cell': cell_of(x, y, generation['grid_size']), 'version': annotation.get('version', 1)}
+
+
+class SplitBusy(Exception):
+    """Another split of the same screenshot kept it claimed for longer than a split should take."""
+
+
+async def ensure_indexes(db):
+    await db.annotations.create_index(
+        [('screenshot_id', ASCENDING), ('generation', ASCENDING), ('id', ASCENDING)], unique=True)
+    await db.annotations.create_index([('screenshot_id', ASCENDING), ('generation', ASCENDING), ('cell', ASCENDING)])
+
+
+async def split(db, screenshot_id: str, grid_size: int) -> Optional[Generation]:
+    """Move a screenshot's embedded annotations into records unless that has been done.
+
+    Returns the screenshot's current generation, or None if it does not exist.
+    A new split indexes its records on a `grid_size` grid; an existing generation
+    keeps the grid it was written with.
+    The final update is matched on the version read when claiming, so a
+    whole-array write that lands in between wins and the split starts over.
+    """
+    for _ in range(SPLIT_ATTEMPTS):
+        doc = await db.screenshots.find_one({'id': screenshot_id}, {'_id': 0, 'annotations_split': 1})
+        if doc is None:
+            return None
+        if doc.get('annotations_split'):
+            return doc['annotations_split']
+
+        token, now = uuid.uuid4().hex, datetime.utcnow()
+        generation = {'token': token, 'grid_size': grid_size}
+        result = await db.screenshots.update_one(
+            {'id': screenshot_id, 'annotations_split': {'$in': [None, False]},
+             '$or': [{'annotations_splitting': None}, {'annotations_splitting.at': {'$lt': now - SPLIT_CLAIM_TIMEOUT}}]},
+            {'$set': {'annotations_splitting': {'token': token, 'at': now}}},
+        )
+        claimed = await db.screenshots.find_one(
+            {'id': screenshot_id, 'annotations_splitting.token': token}, {'_id': 0, 'annotations': 1, 'version': 1},
+        ) if result.matched_count else None
+        if claimed is None:
+            await asyncio.sleep(SPLIT_RETRY_SECONDS)  # another split is running, or the screenshot changed
+            continue
+        try:
+            # Older generations were superseded by the whole-array write that unsplit the screenshot
+            await db.annotations.delete_many({'screenshot_id': screenshot_id, 'generation': {'$ne': token}})
+            records, seen = [], set()
+            for annotation in claimed.get('annotations') or []:
+                record = to_record(screenshot_id, generation, annotation)
+                if record is not None and record['id'] not in seen:
+                    seen.add(record['id'])
+                    records.append(record)
+            if records:
+                await db.annotations.insert_many(records, ordered=False)
+            result = await db.screenshots.update_one(
+                {'id': screenshot_id, 'version': claimed.get('version'), 'annotations_splitting.token': token},
+                {'$set': {'annotations': [], 'annotations_split': generation}, '$unset': {'annotations_splitting': ''}},
+            )
+        except Exception:
+            await abandon_split(db, screenshot_id, token)
+            raise
+        if result.matched_count:
+            return generation
+        await abandon_split(db, screenshot_id, token)
+    raise SplitBusy(screenshot_id)
+
+async def abandon_split(db, screenshot_id: str, token: str):
+    await db.annotations.delete_many({'screenshot_id': screenshot_id, 'generation': token})
+    await db.screenshots.update_one(
+        {'id': screenshot_id, 'annotations_splitting.token': token}, {'$unset': {'annotations_splitting': ''}})
+
+
+async def find(db, screenshot_id: str, generation: Generation, bbox: Optional[BBox] = None) -> List[dict]:
+    """Records of a split screenshot in creation order, optionally only those with a marker inside `bbox`."""
+    query = {'screenshot_id': screenshot_id, 'generation': generation['token'],
+             **(bbox_filter(bbox, generation['grid_size']) if bbox else {})}
+    return await db.annotations.find(query, INTERNAL_FIELDS).sort('_id', ASCENDING).to_list(None)
+
+
+async def hydrate(db, docs: List[dict]):
+    """Put the records of split screenshots back into their `annotations` arrays, for readers of whole documents."""
+    generations = {doc['id']: doc['annotations_split']['token'] for doc in docs if doc.get('annotations_split')}
+    for doc in docs:
+        doc.pop('annotations_split', None)
+        doc.pop('annotations_splitting', None)
+    if not generations:
+        return
+    grouped: Dict[str, List[dict]] = defaultdict(list)
+    query = {'screenshot_id': {'$in': list(generations)}, 'generation': {'$in': list(set(generations.values()))}}
+    async for record in db.annotations.find(query, {'_id': 0, 'cell': 0}).sort('_id', ASCENDING):
+        screenshot_id, generation = record.pop('screenshot_id'), record.pop('generation')
+        if generations[screenshot_id] == generation:
+            grouped[screenshot_id].append(record)
+    for doc in docs:
+        if doc['id'] in generations:
+            doc['annotations'] = grouped.get(doc['id'], [])
+
+
+async def count(db, docs: List[dict]) -> int:
+    """Number of annotations across screenshot documents, embedded or split."""
+    current = [{'screenshot_id': doc['id'], 'generation': doc['annotations_split']['token']}
+               for doc in docs if doc.get('annotations_split')]
+    total = sum(len(doc.get('annotations') or []) for doc in docs if not doc.get('annotations_split'))
+    if current:
+        total += await db.annotations.count_documents({'$or': current})
+    return total
+
+
+async def touch_screenshot(db, screenshot_id: str, generation: Generation) -> bool:
+    """Record an annotation edit as a change to its screenshot, for sync, live updates and ETags.
+
+    False if the screenshot is gone or no longer at `generation`, in which case
+    the edit went to records that are not read any more.
+    """
+    async with sync_log.change(db) as stamp:
+        result = await db.screenshots.update_one(
+            {'id': screenshot_id, 'annotations_split.token': generation['token']},
+            {'$set': stamp, '$inc': {'version': 1}},
+        )
+    return result.matched_count > 0
+
+
+async def delete_all(db, screenshot_id: str):
+    await db.annotations.delete_many({'screenshot_id': screenshot_id})
@@ -0,0 +1,170 @@
+import uuid
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field
+from pymongo.errors import DuplicateKeyError
+
+import annotation_store
+from annotation_store import BBox, Generation
+from conditional import make_etag, not_modified
+from screenshots import get_db, get_settings
+
+
+router = APIRouter(prefix="/screenshots", tags=["annotations"])
+
+# Fields that only the server sets
+RESERVED_FIELDS = {'_id', 'id', 'screenshot_id', 'generation', 'cell', 'version'}
+# Creating an annotation is retried when a whole-array write replaces the records meanwhile
+CREATE_ATTEMPTS = 3
+
+
+class Annotation(BaseModel):
+    """An annotation as the extension stores it; fields beyond these are kept as sent."""
+    model_config = ConfigDict(extra='allow')
+
+    id: str = Field(default_factory=lambda: f'annotation_{uuid.uuid4().hex}')
+    relativeX: float = Field(ge=0, le=1)
+    relativeY: float = Field(ge=0, le=1)
+    text: str = ''
+    markerVisible: bool = True
+    textVisible: bool = True
+    timestamp: Optional[str] = None
+    version: int = 1
+
+
+class AnnotationPatch(BaseModel):
+    """Fields to change; anything left out keeps its value. With `base_version` the edit only
+    applies if the annotation is still at that version."""
+    model_config = ConfigDict(extra='allow')
+
+    relativeX: Optional[float] = Field(None, ge=0, le=1)
+    relativeY: Optional[float] = Field(None, ge=0, le=1)
+    text: Optional[str] = None
+    markerVisible: Optional[bool] = None
+    textVisible: Optional[bool] = None
+    base_version: Optional[int] = None
+
+
+def parse_bbox(bbox: Optional[str]) -> Optional[BBox]:
+    if not bbox:
+        return None
+    try:
+        min_x, min_y, max_x, max_y = (float(v) for v in bbox.split(','))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be minX,minY,maxX,maxY")
+    if min_x > max_x or min_y > max_y:
+        raise HTTPException(status_code=400, detail="bbox minimum exceeds its maximum")
+    return min_x, min_y, max_x, max_y
+
+def in_bbox(annotation: dict, bbox: BBox) -> bool:
+    x, y = annotation.get('relativeX'), annotation.get('relativeY')
+    if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
+        return False
+    return bbox[0] <= x <= bbox[2] and bbox[1] <= y <= bbox[3]
+
+def public(record: dict) -> dict:
+    return {k: v for k, v in record.items() if k not in annotation_store.INTERNAL_FIELDS}
+
+async def split_or_404(db, screenshot_id: str, grid_size: int) -> Generation:
+    """The screenshot's current annotation generation, splitting its embedded array first if needed."""
+    try:
+        generation = await annotation_store.split(db, screenshot_id, grid_size)
+    except annotation_store.SplitBusy:
+        raise HTTPException(status_code=409, detail="Annotations are being reorganised; retry")
+    if generation is None:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    return generation
+
+def replaced() -> HTTPException:
+    return HTTPException(status_code=409, detail="Annotations were replaced by a sync push; reload them")
+
+
+@router.get("/{screenshot_id}/annotations", response_model=List[Annotation])
+async def list_annotations(
+    screenshot_id: str,
+    request: Request,
+    bbox: Optional[str] = Query(None, description="minX,minY,maxX,maxY in relative (0-1) image coordinates"),
+    db=Depends(get_db),
+):
+    """Annotations of a screenshot, or with `bbox` only those whose marker lies in that viewport.
+
+    Labels are drawn beside their marker, so a viewer that wants labels reaching
+    into the viewport should pad the box by the label size.
+    """
+    box = parse_bbox(bbox)
+    doc = await db.screenshots.find_one(
+        {'id': screenshot_id}, {'_id': 0, 'seq': 1, 'annotations': 1, 'annotations_split': 1})
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    etag = make_etag('annotations', screenshot_id, doc.get('seq'), box)
+    headers = {'Cache-Control': 'no-cache'}
+    unchanged = not_modified(request, etag, headers)
+    if unchanged is not None:
+        return unchanged
+
+    if doc.get('annotations_split'):
+        annotations = await annotation_store.find(db, screenshot_id, doc['annotations_split'], box)
+    else:
+        # Not edited through this API yet: filter the embedded array rather than writing on a read
+        annotations = [a for a in doc.get('annotations') or [] if box is None or in_bbox(a, box)]
+    return ORJSONResponse(annotations, headers={'ETag': etag, **headers})
+
+
+@router.post("/{screenshot_id}/annotations", response_model=Annotation, status_code=201)
+async def create_annotation(screenshot_id: str, annotation: Annotation, db=Depends(get_db),
+                            settings=Depends(get_settings)):
+    for _ in range(CREATE_ATTEMPTS):
+        generation = await split_or_404(db, screenshot_id, settings.annotation_grid_size)
+        record = annotation_store.to_record(screenshot_id, generation, {**annotation.model_dump(), 'version': 1})
+        try:
+            await db.annotations.insert_one(dict(record))
+        except DuplicateKeyError:
+            raise HTTPException(status_code=409, detail="Annotation already exists")
+        if await annotation_store.touch_screenshot(db, screenshot_id, generation):
+            return ORJSONResponse(public(record), status_code=201)
+        # The records were replaced while this one was written; add it to the new generation instead
+        await db.annotations.delete_one(
+            {'screenshot_id': screenshot_id, 'generation': generation['token'], 'id': record['id']})
+    raise HTTPException(status_code=409, detail="Annotations kept changing; retry")
+
+
+@router.patch("/{screenshot_id}/annotations/{annotation_id}", response_model=Annotation)
+async def update_annotation(screenshot_id: str, annotation_id: str, patch: AnnotationPatch, db=Depends(get_db),
+                            settings=Depends(get_settings)):
+    """Change some fields of one annotation, writing only that annotation."""
+    generation = await split_or_404(db, screenshot_id, settings.annotation_grid_size)
+    key = {'screenshot_id': screenshot_id, 'generation': generation['token'], 'id': annotation_id}
+    current = await db.annotations.find_one(key, {'_id': 0})
+    if current is None:
+        raise HTTPException(status_code=404, detail="Annotation not found")
+    if patch.base_version is not None and patch.base_version != current['version']:
+        raise HTTPException(status_code=409, detail={"message": "Annotation has changed", "current": public(current)})
+
+    changes = {k: v for k, v in patch.model_dump(exclude_unset=True).items()
+               if k not in RESERVED_FIELDS and k != 'base_version' and not (v is None and k in AnnotationPatch.model_fields)}
+    x = changes.get('relativeX', current['relativeX'])
+    y = changes.get('relativeY', current['relativeY'])
+    update = {**changes, 'cell': annotation_store.cell_of(x, y, generation['grid_size']), 'version': current['version'] + 1}
+    result = await db.annotations.update_one({**key, 'version': current['version']}, {'$set': update})
+    if result.matched_count == 0:
+        current = await db.annotations.find_one(key, {'_id': 0})
+        raise HTTPException(status_code=409, detail={"message": "Annotation has changed",
+                                                     "current": public(current) if current else None})
+    if not await annotation_store.touch_screenshot(db, screenshot_id, generation):
+        raise replaced()
+    return ORJSONResponse(public({**current, **update}))
+
+
+@router.delete("/{screenshot_id}/annotations/{annotation_id}", status_code=204)
+async def delete_annotation(screenshot_id: str, annotation_id: str, db=Depends(get_db),
+                            settings=Depends(get_settings)):
+    generation = await split_or_404(db, screenshot_id, settings.annotation_grid_size)
+    result = await db.annotations.delete_one(
+        {'screenshot_id': screenshot_id, 'generation': generation['token'], 'id': annotation_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Annotation not found")
+    if not await annotation_store.touch_screenshot(db, screenshot_id, generation):
+        raise replaced()
+    return Response(status_code=204)
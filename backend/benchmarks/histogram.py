@@ -0,0 +1,80 @@
+"""Log-linear latency histogram in the style of HdrHistogram.
+
+Values are recorded in microseconds into buckets whose width grows with the
+value, keeping every recorded value within 1% of its bucket's bounds while
+using a few hundred counters per decade at most. Histograms merge exactly, so
+per-worker or per-interval histograms can be combined afterwards.
+"""
+from typing import Dict, Iterable, Optional
+
+SUB_BUCKET_BITS = 8
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF = SUB_BUCKETS // 2
+
+
+def _index(value: int) -> int:
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return shift * HALF + (value >> shift)
+
+def _upper_bound(index: int) -> int:
+    """Highest value that lands in bucket `index`."""
+    if index < SUB_BUCKETS:
+        return index
+    shift = index // HALF - 1
+    return ((index - shift * HALF + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max = 0
+        self.sum = 0
+
+    def record(self, micros: float, count: int = 1):
+        value = max(int(micros), 0)
+        index = _index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.total += count
+        self.sum += value * count
+        self.max = max(self.max, value)
+        self.min = value if self.min is None else min(self.min, value)
+
+    def merge(self, other: 'LatencyHistogram'):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+
+    def percentile(self, p: float) -> int:
+        if not self.total:
+            return 0
+        target = max(1, -(-self.total * p // 100))  # ceil
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(_upper_bound(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.total if self.total else 0.0
+
+    def summary(self, percentiles: Iterable[float] = (50, 90, 95, 99, 99.9)) -> dict:
+        """Count, mean, min, max and percentiles, in milliseconds."""
+        result = {
+            'count': self.total,
+            'mean_ms': round(self.mean / 1000, 3),
+            'min_ms': round((self.min or 0) / 1000, 3),
+            'max_ms': round(self.max / 1000, 3),
+        }
+        for p in percentiles:
+            result[f'p{p:g}_ms'.replace('.', '')] = round(self.percentile(p) / 1000, 3)
+        return result
@@ -0,0 +1,344 @@
+"""Open-loop HTTP load generator for the backend API.
+
+Requests are sent on a schedule fixed in advance by the load profile, whether
+or not earlier ones have completed, so a slow server cannot slow the client
+down and hide its own latency (coordinated omission). Every request records two
+latencies:
+
+    service   from the moment it was actually sent until its response arrived
+    response  from the moment the schedule said it should be sent, which adds
+              any time spent queued behind --max-in-flight; this is the
+              coordinated-omission-corrected figure users would experience
+
+Run the server under test, for example against an in-memory database:
+
+    cd backend && python -m benchmarks.loadtest serve --port 8001 --mock-db
+
+and drive it from another terminal:
+
+    python -m benchmarks.loadtest run --url http://127.0.0.1:8001 \\
+        --profile ramp:50:1000:60 --mix list_status=60,create_status=30,root=10
+
+`run --spawn-server` does both in one command. Profiles are comma-separated
+segments, `constant:RATE:SECONDS` or `ramp:FROM:TO:SECONDS`, in requests per
+second; `--arrivals poisson` spaces requests randomly around the target rate.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.histogram import LatencyHistogram
+
+
+# --- load profiles ---------------------------------------------------------------------------
+
+@dataclass
+class Segment:
+    start_rate: float
+    end_rate: float
+    duration: float
+
+    def rate_at(self, t: float) -> float:
+        return self.start_rate + (self.end_rate - self.start_rate) * (t / self.duration)
+
+
+def parse_profile(spec: str) -> List[Segment]:
+    segments = []
+    for part in spec.split(','):
+        kind, *values = part.strip().split(':')
+        try:
+            numbers = [float(v) for v in values]
+            if kind == 'constant' and len(numbers) == 2:
+                segments.append(Segment(numbers[0], numbers[0], numbers[1]))
+            elif kind == 'ramp' and len(numbers) == 3:
+                segments.append(Segment(*numbers))
+            else:
+                raise ValueError
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                f"Bad profile segment {part!r}; use constant:RATE:SECONDS or ramp:FROM:TO:SECONDS")
+    return segments
+
+def arrival_times(segments: List[Segment], poisson: bool = False, seed: Optional[int] = None) -> Iterator[float]:
+    """Scheduled send times, in seconds from the start of the run."""
+    rng = random.Random(seed)
+    offset = 0.0
+    for segment in segments:
+        t = 0.0
+        while True:
+            rate = max(segment.rate_at(t), 1e-3)
+            t += rng.expovariate(rate) if poisson else 1 / rate
+            if t >= segment.duration:
+                break
+            yield offset + t
+        offset += segment.duration
+
+
+# --- scenarios -------------------------------------------------------------------------------
+
+Scenario = Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]
+
+
+async def root(client: httpx.AsyncClient, n: int) -> httpx.Response:
+    return await client.get('/api/')
+
+async def list_status(client: httpx.AsyncClient, n: int) -> httpx.Response:
+    return await client.get('/api/status', params={'limit': 100, 'order': 'desc'})
+
+async def create_status(client: httpx.AsyncClient, n: int) -> httpx.Response:
+    return await client.post('/api/status', json={'client_name': f'loadtest-{n}'})
+
+async def bulk_status(client: httpx.AsyncClient, n: int) -> httpx.Response:
+    return await client.post('/api/status/bulk', json=[{'client_name': f'loadtest-{n}-{i}'} for i in range(100)])
+
+async def sync_changes(client: httpx.AsyncClient, n: int) -> httpx.Response:
+    return await client.get('/api/sync/changes', params={'since': 0, 'limit': 100})
+
+SCENARIOS: Dict[str, Scenario] = {
+    'root': root,
+    'list_status': list_status,
+    'create_status': create_status,
+    'bulk_status': bulk_status,
+    'sync_changes': sync_changes,
+}
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.strip().partition('=')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# --- running ---------------------------------------------------------------------------------
+
+@dataclass
+class ScenarioStats:
+    service: LatencyHistogram = field(default_factory=LatencyHistogram)
+    response: LatencyHistogram = field(default_factory=LatencyHistogram)
+    errors: Dict[str, int] = field(default_factory=dict)
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+@dataclass
+class Interval:
+    start: float
+    sent: int = 0
+    completed: int = 0
+    response: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+
+class LoadRun:
+    def __init__(self, base_url: str, segments: List[Segment], mix: Dict[str, float], max_in_flight: int = 256,
+                 timeout: float = 30.0, poisson: bool = False, seed: Optional[int] = None,
+                 report_interval: float = 5.0):
+        self.base_url = base_url
+        self.segments = segments
+        self.mix = mix
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.poisson = poisson
+        self.seed = seed
+        self.report_interval = report_interval
+        self.stats: Dict[str, ScenarioStats] = {name: ScenarioStats() for name in mix}
+        self.intervals: List[Interval] = []
+        self.max_schedule_lag = 0.0
+        self.elapsed = 0.0
+        self._start = 0.0
+
+    def _interval(self, offset: float) -> Interval:
+        index = int(offset // self.report_interval)
+        while len(self.intervals) <= index:
+            self.intervals.append(Interval(start=len(self.intervals) * self.report_interval))
+        return self.intervals[index]
+
+    async def run(self) -> 'LoadRun':
+        loop = asyncio.get_running_loop()
+        rng = random.Random(self.seed)
+        names, weights = list(self.mix), list(self.mix.values())
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        limits = httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight)
+        tasks = set()
+
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=self.timeout) as client:
+            start = self._start = loop.time()
+            for n, offset in enumerate(arrival_times(self.segments, self.poisson, self.seed)):
+                delay = start + offset - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    self.max_schedule_lag = max(self.max_schedule_lag, -delay)
+                name = rng.choices(names, weights)[0]
+                task = asyncio.create_task(self._fire(client, in_flight, name, n, start + offset, offset))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                self._interval(offset).sent += 1
+            if tasks:
+                await asyncio.gather(*tasks)
+            self.elapsed = loop.time() - start
+        return self
+
+    async def _fire(self, client: httpx.AsyncClient, in_flight: asyncio.Semaphore, name: str, n: int,
+                    intended: float, offset: float):
+        loop = asyncio.get_running_loop()
+        stats = self.stats[name]
+        async with in_flight:
+            sent = loop.time()
+            try:
+                response = await SCENARIOS[name](client, n)
+                if response.status_code >= 400:
+                    stats.error(f'http_{response.status_code}')
+            except httpx.TimeoutException:
+                stats.error('timeout')
+            except httpx.HTTPError as e:
+                stats.error(type(e).__name__)
+            finished = loop.time()
+        stats.service.record((finished - sent) * 1e6)
+        stats.response.record((finished - intended) * 1e6)
+        self._interval(offset).response.record((finished - intended) * 1e6)
+        self._interval(finished - self._start).completed += 1
+
+    def report(self) -> dict:
+        service, response = LatencyHistogram(), LatencyHistogram()
+        scenarios = {}
+        for name, stats in self.stats.items():
+            service.merge(stats.service)
+            response.merge(stats.response)
+            scenarios[name] = {
+                'service': stats.service.summary(),
+                'response': stats.response.summary(),
+                'errors': stats.errors,
+            }
+        total_errors = sum(sum(s.errors.values()) for s in self.stats.values())
+        return {
+            'url': self.base_url,
+            'duration_s': round(self.elapsed, 3),
+            'requests': response.total,
+            'errors': total_errors,
+            'throughput_rps': round(response.total / self.elapsed, 1) if self.elapsed else 0.0,
+            'max_schedule_lag_ms': round(self.max_schedule_lag * 1000, 3),
+            'service': service.summary(),
+            'response': response.summary(),
+            'scenarios': scenarios,
+            'intervals': [
+                {
+                    'start_s': interval.start,
+                    'target_rps': round(interval.sent / self.report_interval, 1),
+                    'completed_rps': round(interval.completed / self.report_interval, 1),
+                    'response_p99_ms': round(interval.response.percentile(99) / 1000, 3),
+                }
+                for interval in self.intervals
+            ],
+        }
+
+
+def print_report(report: dict):
+    columns = ('count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'p999_ms', 'max_ms')
+    print(f"\n{report['requests']} requests in {report['duration_s']} s "
+          f"({report['throughput_rps']} req/s), {report['errors']} errors, "
+          f"generator lag up to {report['max_schedule_lag_ms']} ms")
+    print(f"\n{'interval':>9} {'target/s':>9} {'done/s':>9} {'p99 ms':>9}")
+    for interval in report['intervals']:
+        print(f"{interval['start_s']:>8.0f}s {interval['target_rps']:>9} {interval['completed_rps']:>9} "
+              f"{interval['response_p99_ms']:>9}")
+    print(f"\n{'scenario':<16}{'latency':<10}" + ''.join(f'{c:>10}' for c in columns))
+    rows: List[Tuple[str, dict]] = [('all', {'service': report['service'], 'response': report['response']})]
+    rows += list(report['scenarios'].items())
+    for name, stats in rows:
+        for kind in ('service', 'response'):
+            print(f"{name if kind == 'service' else '':<16}{kind:<10}" + ''.join(f'{stats[kind][c]:>10}' for c in columns))
+        if stats.get('errors'):
+            print(f"{'':<16}errors    {stats['errors']}")
+
+
+# --- server under test -----------------------------------------------------------------------
+
+def serve(host: str, port: int, mock_db: bool):
+    """Run the API with uvicorn, optionally on an in-memory mongomock database."""
+    import uvicorn
+
+    import server
+    if mock_db:
+        from mongomock_motor import AsyncMongoMockClient
+
+        settings = server.Settings.from_env(mongo_url='mongodb://mock', db_name=os.environ.get('DB_NAME', 'loadtest'))
+        app = server.create_app(settings, mongo_client=AsyncMongoMockClient())
+    else:
+        app = server.create_app()
+    uvicorn.run(app, host=host, port=port, log_level='warning')
+
+def spawn_server(port: int, mock_db: bool) -> subprocess.Popen:
+    args = [sys.executable, '-m', 'benchmarks.loadtest', 'serve', '--port', str(port)]
+    if mock_db:
+        args.append('--mock-db')
+    process = subprocess.Popen(args, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f'http://127.0.0.1:{port}/api/', timeout=1)
+            return process
+        except httpx.HTTPError:
+            if process.poll() is not None:
+                raise RuntimeError("Server under test exited during startup")
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Server under test did not start within 30 s")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Open-loop load generator for the backend API")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help="run the API for load testing")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8001)
+    serve_parser.add_argument('--mock-db', action='store_true', help="use an in-memory mongomock database")
+
+    run_parser = commands.add_parser('run', help="generate load against a running server")
+    run_parser.add_argument('--url', default='http://127.0.0.1:8001')
+    run_parser.add_argument('--profile', type=parse_profile, default=parse_profile('constant:50:10'))
+    run_parser.add_argument('--mix', type=parse_mix, default=parse_mix('list_status=60,create_status=30,root=10'))
+    run_parser.add_argument('--arrivals', choices=('uniform', 'poisson'), default='uniform')
+    run_parser.add_argument('--max-in-flight', type=int, default=256)
+    run_parser.add_argument('--timeout', type=float, default=30.0)
+    run_parser.add_argument('--seed', type=int)
+    run_parser.add_argument('--interval', type=float, default=5.0, help="seconds per row of the time series")
+    run_parser.add_argument('--json', help="also write the report to this file")
+    run_parser.add_argument('--spawn-server', action='store_true', help="start `serve --mock-db` on the --url port")
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        serve(args.host, args.port, args.mock_db)
+        return
+
+    process = spawn_server(httpx.URL(args.url).port or 80, mock_db=True) if args.spawn_server else None
+    try:
+        load = LoadRun(args.url, args.profile, args.mix, max_in_flight=args.max_in_flight, timeout=args.timeout,
+                       poisson=args.arrivals == 'poisson', seed=args.seed, report_interval=args.interval)
+        report = asyncio.run(load.run()).report()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
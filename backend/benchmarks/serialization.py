@@ -0,0 +1,75 @@
+"""Compare the two ways GET /api/status can turn database documents into a response body.
+
+    cd backend && python -m benchmarks.serialization [--items 10000] [--repeat 20]
+
+legacy: build a StatusCheck per document, validate the list against
+        response_model=List[StatusCheckView] and render with the stdlib json encoder,
+        as FastAPI does for a handler that returns models.
+fast:   serialize the projected documents directly with orjson.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+import orjson
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from server import StatusCheck, StatusCheckView
+
+
+def make_docs(n: int) -> List[dict]:
+    start = datetime(2024, 1, 1)
+    return [
+        {'id': str(uuid.uuid4()), 'client_name': f'client-{i % 50}', 'timestamp': start + timedelta(milliseconds=i)}
+        for i in range(n)
+    ]
+
+async def legacy(docs: List[dict], field) -> bytes:
+    content = await serialize_response(
+        field=field, response_content=[StatusCheck(**doc) for doc in docs], exclude_unset=True,
+    )
+    return JSONResponse(content).body
+
+async def fast(docs: List[dict], field) -> bytes:
+    return ORJSONResponse(docs).body
+
+async def measure(fn, docs, field, repeat: int) -> List[float]:
+    await fn(docs, field)  # warm up
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn(docs, field)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=10_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    docs = make_docs(args.items)
+    field = create_response_field(name='response', type_=List[StatusCheckView], mode='serialization')
+    legacy_body, fast_body = await legacy(docs, field), await fast(docs, field)
+    assert orjson.loads(legacy_body) == orjson.loads(fast_body), "fast path changed the response"
+    print(f"{args.items} items, body {len(fast_body)} bytes (legacy {len(legacy_body)} bytes)")
+
+    results = {}
+    for name, fn in (('legacy', legacy), ('fast', fast)):
+        timings = await measure(fn, docs, field, args.repeat)
+        median = statistics.median(timings)
+        results[name] = median
+        print(f"{name:>7}: median {median * 1000:8.2f} ms  p90 {sorted(timings)[int(len(timings) * 0.9) - 1] * 1000:8.2f} ms"
+              f"  {args.items / median:12,.0f} items/s")
+    print(f"speedup: {results['legacy'] / results['fast']:.1f}x")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""Measure how long a fresh worker takes to become ready to serve.
+
+    cd backend && python -m benchmarks.startup [--runs 10] [--features screenshots,journals,sync,live,annotations,search]
+
+Each run starts a new interpreter, so module caches are cold as they are in a
+freshly spawned worker, and reports:
+
+import:     `import server`
+create_app: building the app, including importing the enabled features
+lifespan:   startup hooks (client creation, indexes, background tasks), against mongomock
+total:      interpreter start to ready, as seen from the parent process
+
+With --features "" only the status check API is built, which shows what the
+optional subsystems cost.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+CHILD = """
+import asyncio, json, time
+started = time.perf_counter()
+import server
+imported = time.perf_counter()
+from mongomock_motor import AsyncMongoMockClient
+settings = server.Settings.from_env(mongo_url='mongodb://mock', db_name='startup', features={features!r})
+app = server.create_app(settings, mongo_client=AsyncMongoMockClient())
+built = time.perf_counter()
+
+async def lifespan():
+    async with app.router.lifespan_context(app):
+        return time.perf_counter()
+
+ready = asyncio.run(lifespan())
+print(json.dumps({{'import': imported - started, 'create_app': built - imported, 'lifespan': ready - built}}))
+"""
+
+
+def run_once(features: list) -> dict:
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD.format(features=features)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        check=True, capture_output=True, text=True,
+    ).stdout
+    phases = json.loads(output.strip().splitlines()[-1])
+    phases['total'] = time.perf_counter() - started
+    return phases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--features', default='screenshots,journals,sync,live,annotations,search')
+    args = parser.parse_args()
+
+    features = [f for f in args.features.split(',') if f]
+    runs = [run_once(features) for _ in range(args.runs)]
+    print(f"features: {', '.join(features) or '(none)'}, {args.runs} runs")
+    print(f"{'phase':<12}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+    for phase in ('import', 'create_app', 'lifespan', 'total'):
+        values = [run[phase] * 1000 for run in runs]
+        print(f"{phase:<12}{statistics.median(values):>12.1f}{min(values):>10.1f}{max(values):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+"""Benchmark regression suite for the backend.
+
+Covers in-process ASGI calls to the API routes, Pydantic model construction and
+database operations, all against an in-memory mongomock database so results do
+not depend on a MongoDB server. Each benchmark is warmed up, then timed over
+several repetitions of an auto-calibrated number of iterations.
+
+    cd backend
+    python -m benchmarks.suite --save baseline.json      # on the reference revision
+    python -m benchmarks.suite --compare baseline.json   # on the change under test
+
+With --compare the suite exits with status 1 if any benchmark's median time per
+operation is more than --tolerance slower than the baseline and a Mann-Whitney
+U test on the repetition samples says the difference is not noise. Baselines
+are only comparable on the machine that recorded them.
+"""
+import argparse
+import asyncio
+import fnmatch
+import json
+import logging
+import math
+import platform
+import statistics
+import sys
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+from screenshots import Screenshot
+
+
+Operation = Callable[[], Awaitable[None]]
+
+
+@dataclass
+class Benchmark:
+    name: str
+    setup: Callable[['Context'], Awaitable[Operation]]
+
+
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+def benchmark(name: str):
+    """Register an async setup function that returns the operation to time."""
+    def register(setup):
+        BENCHMARKS[name] = Benchmark(name, setup)
+        return setup
+    return register
+
+
+class Context:
+    """A fresh in-memory database wired into the app, and an in-process client for it."""
+
+    async def __aenter__(self) -> 'Context':
+        settings = server.Settings.from_env(mongo_url='mongodb://mock', db_name='benchmarks')
+        self.app = server.create_app(settings, mongo_client=AsyncMongoMockClient())
+        self.db = self.app.state.db
+        self._lifespan = self.app.router.lifespan_context(self.app)
+        await self._lifespan.__aenter__()
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app), base_url='http://bench')
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+        await self._lifespan.__aexit__(*exc)
+
+    async def seed_status_checks(self, n: int) -> List[dict]:
+        start = datetime(2024, 1, 1)
+        docs = [
+            {'id': str(uuid.uuid4()), 'client_name': f'client-{i % 50}', 'timestamp': start + timedelta(seconds=i)}
+            for i in range(n)
+        ]
+        await self.db.status_checks.insert_many([dict(doc) for doc in docs])
+        return docs
+
+    async def get(self, url: str, **kwargs):
+        response = await self.client.get(url, **kwargs)
+        assert response.status_code < 400, (url, response.status_code, response.text[:200])
+        return response
+
+    async def post(self, url: str, **kwargs):
+        response = await self.client.post(url, **kwargs)
+        assert response.status_code < 400, (url, response.status_code, response.text[:200])
+        return response
+
+
+NO_CACHE = {'cache-control': 'no-cache'}
+
+
+# --- ASGI routes -----------------------------------------------------------------------------
+
+@benchmark('asgi.root')
+async def _(ctx: Context) -> Operation:
+    return lambda: ctx.get('/api/', headers=NO_CACHE)
+
+@benchmark('asgi.list_status_100')
+async def _(ctx: Context) -> Operation:
+    await ctx.seed_status_checks(1000)
+    return lambda: ctx.get('/api/status', params={'limit': 100}, headers=NO_CACHE)
+
+@benchmark('asgi.list_status_100_fields')
+async def _(ctx: Context) -> Operation:
+    await ctx.seed_status_checks(1000)
+    return lambda: ctx.get('/api/status', params={'limit': 100, 'fields': 'client_name'}, headers=NO_CACHE)
+
+@benchmark('asgi.list_status_cached')
+async def _(ctx: Context) -> Operation:
+    await ctx.seed_status_checks(1000)
+    return lambda: ctx.get('/api/status', params={'limit': 100})
+
+@benchmark('asgi.list_status_not_modified')
+async def _(ctx: Context) -> Operation:
+    await ctx.seed_status_checks(1000)
+    etag = (await ctx.get('/api/status', params={'limit': 100}, headers=NO_CACHE)).headers['etag']
+    return lambda: ctx.get('/api/status', params={'limit': 100}, headers={**NO_CACHE, 'if-none-match': etag})
+
+@benchmark('asgi.create_status')
+async def _(ctx: Context) -> Operation:
+    return lambda: ctx.post('/api/status', json={'client_name': 'bench'})
+
+@benchmark('asgi.create_status_bulk_100')
+async def _(ctx: Context) -> Operation:
+    body = [{'client_name': f'bench-{i}'} for i in range(100)]
+    return lambda: ctx.post('/api/status/bulk', json=body)
+
+@benchmark('asgi.export_status_1000')
+async def _(ctx: Context) -> Operation:
+    await ctx.seed_status_checks(1000)
+    return lambda: ctx.get('/api/status/export', headers={'accept-encoding': 'identity'})
+
+@benchmark('asgi.sync_changes_100')
+async def _(ctx: Context) -> Operation:
+    for i in range(200):
+        await ctx.post('/api/sync/push', json={'items': [{'kind': 'session', 'id': f's{i}', 'data': {'name': 'x'}}]})
+    return lambda: ctx.get('/api/sync/changes', params={'since': 0, 'limit': 100})
+
+
+# --- models ----------------------------------------------------------------------------------
+
+@benchmark('model.status_check_1000')
+async def _(ctx: Context) -> Operation:
+    docs = await ctx.seed_status_checks(1000)
+
+    async def op():
+        [server.StatusCheck(**doc) for doc in docs]
+    return op
+
+@benchmark('model.status_check_create_validate_1000')
+async def _(ctx: Context) -> Operation:
+    items = [{'client_name': f'client-{i}'} for i in range(1000)]
+
+    async def op():
+        [server.StatusCheckCreate.model_validate(item) for item in items]
+    return op
+
+@benchmark('model.screenshot_dump_1000')
+async def _(ctx: Context) -> Operation:
+    screenshots = [
+        Screenshot(content_type='image/png', length=1000, sha256='0' * 64, blob_id='0' * 64,
+                   annotations=[{'text': 'note', 'relativeX': 0.5, 'relativeY': 0.5}])
+        for _ in range(1000)
+    ]
+
+    async def op():
+        [s.model_dump() for s in screenshots]
+    return op
+
+
+# --- database --------------------------------------------------------------------------------
+
+@benchmark('db.insert_one')
+async def _(ctx: Context) -> Operation:
+    return lambda: ctx.db.status_checks.insert_one(
+        {'id': str(uuid.uuid4()), 'client_name': 'bench', 'timestamp': datetime.utcnow()})
+
+@benchmark('db.find_page_100')
+async def _(ctx: Context) -> Operation:
+    await ctx.seed_status_checks(1000)
+
+    async def op():
+        await ctx.db.status_checks.find({}, {'_id': 0}).sort([('timestamp', -1), ('id', -1)]).limit(100).to_list(100)
+    return op
+
+@benchmark('db.find_one_by_id')
+async def _(ctx: Context) -> Operation:
+    docs = await ctx.seed_status_checks(1000)
+    return lambda: ctx.db.status_checks.find_one({'id': docs[500]['id']}, {'_id': 0})
+
+
+# --- running and comparing -------------------------------------------------------------------
+
+async def time_operation(op: Operation, repetitions: int, min_time: float, warmup: float) -> List[float]:
+    """Seconds per operation for each repetition, after `warmup` seconds of untimed runs."""
+    start = time.perf_counter()
+    iterations = 0
+    while time.perf_counter() - start < warmup or iterations < 3:
+        await op()
+        iterations += 1
+    per_op = (time.perf_counter() - start) / iterations
+    count = max(1, math.ceil(min_time / per_op))
+
+    samples = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        for _ in range(count):
+            await op()
+        samples.append((time.perf_counter() - start) / count)
+    return samples
+
+def summarize(samples: List[float]) -> dict:
+    median = statistics.median(samples)
+    return {
+        'median_us': round(median * 1e6, 3),
+        'mean_us': round(statistics.fmean(samples) * 1e6, 3),
+        'stdev_us': round(statistics.stdev(samples) * 1e6, 3) if len(samples) > 1 else 0.0,
+        'min_us': round(min(samples) * 1e6, 3),
+        'ops_per_s': round(1 / median, 1),
+        'samples_us': [round(s * 1e6, 3) for s in samples],
+    }
+
+def mann_whitney_p(a: List[float], b: List[float]) -> float:
+    """Two-sided p-value of the Mann-Whitney U test, by normal approximation with tie correction."""
+    n1, n2 = len(a), len(b)
+    if not n1 or not n2:
+        return 1.0
+    ranked = sorted([(v, 0) for v in a] + [(v, 1) for v in b])
+    ranks = [0.0] * len(ranked)
+    ties = 0.0
+    i = 0
+    while i < len(ranked):
+        j = i
+        while j + 1 < len(ranked) and ranked[j + 1][0] == ranked[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        t = j - i + 1
+        ties += t ** 3 - t
+        i = j + 1
+    r1 = sum(rank for rank, (_, group) in zip(ranks, ranked) if group == 0)
+    u = r1 - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / math.sqrt(variance)
+    return math.erfc(max(z, 0) / math.sqrt(2))
+
+def compare(results: dict, baseline: dict, tolerance: float, alpha: float) -> List[dict]:
+    rows = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if before is None:
+            rows.append({'name': name, 'status': 'new', 'change': None, 'p': None})
+            continue
+        change = current['median_us'] / before['median_us'] - 1
+        p = mann_whitney_p(current['samples_us'], before['samples_us'])
+        if change > tolerance and p < alpha:
+            status = 'REGRESSION'
+        elif change < -tolerance and p < alpha:
+            status = 'improved'
+        else:
+            status = 'ok'
+        rows.append({'name': name, 'status': status, 'change': change, 'p': p})
+    return rows
+
+
+async def run_suite(names: List[str], repetitions: int, min_time: float, warmup: float) -> dict:
+    results = {}
+    for name in names:
+        async with Context() as ctx:
+            op = await BENCHMARKS[name].setup(ctx)
+            results[name] = summarize(await time_operation(op, repetitions, min_time, warmup))
+        print(f"{name:<42}{results[name]['median_us']:>12.1f} us{results[name]['ops_per_s']:>12.1f} ops/s",
+              file=sys.stderr)
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Backend benchmark regression suite")
+    parser.add_argument('--filter', default='*', help="glob over benchmark names, e.g. 'asgi.*'")
+    parser.add_argument('--repetitions', type=int, default=10)
+    parser.add_argument('--min-time', type=float, default=0.05, help="seconds per repetition")
+    parser.add_argument('--warmup', type=float, default=0.2, help="seconds of untimed runs first")
+    parser.add_argument('--save', help="write results to this baseline file")
+    parser.add_argument('--compare', help="compare against this baseline file")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="allowed slowdown of the median")
+    parser.add_argument('--alpha', type=float, default=0.05, help="significance level")
+    parser.add_argument('--list', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    names = [name for name in BENCHMARKS if fnmatch.fnmatch(name, args.filter)]
+    if args.list:
+        print('\n'.join(names))
+        return 0
+
+    results = asyncio.run(run_suite(names, args.repetitions, args.min_time, args.warmup))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'machine': platform.node(), 'python': platform.python_version(),
+                       'recorded_at': datetime.utcnow().isoformat(), 'results': results}, f, indent=2)
+
+    if not args.compare:
+        return 0
+    with open(args.compare) as f:
+        baseline = json.load(f)['results']
+    rows = compare(results, baseline, args.tolerance, args.alpha)
+    print(f"\n{'benchmark':<42}{'change':>10}{'p':>10}  status")
+    for row in rows:
+        change = f"{row['change'] * 100:+.1f}%" if row['change'] is not None else '-'
+        p = f"{row['p']:.4f}" if row['p'] is not None else '-'
+        print(f"{row['name']:<42}{change:>10}{p:>10}  {row['status']}")
+    regressions = [row['name'] for row in rows if row['status'] == 'REGRESSION']
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
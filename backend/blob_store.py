@@ -0,0 +1,149 @@
+import hashlib
+import uuid
+from datetime import datetime
+from typing import AsyncIterator, Iterable, List, Optional
+
+from bson import Binary
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+DEFAULT_CHUNK_SIZE = 255 * 1024
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+class ChunkedBlobStore:
+    """Content-addressed, reference-counted blob storage in fixed-size chunk documents.
+
+    A blob's id is the SHA-256 of its content, so storing the same bytes twice only
+    bumps a reference count. Unlike GridFS this needs nothing beyond plain
+    find/insert/update/delete on two collections, so it works against any
+    Motor-compatible database. Blobs are written and read one chunk at a time;
+    neither path holds a whole blob in memory.
+
+    Chunks are written under a per-upload key before the content hash is known; the
+    file document that maps the hash to that key is only inserted once every chunk
+    is in place, so a visible blob is always complete.
+    """
+
+    def __init__(self, db, prefix: str = 'blobs', chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.files = db[f'{prefix}.files']
+        self.chunks = db[f'{prefix}.chunks']
+        self.chunk_size = chunk_size
+
+    async def ensure_indexes(self):
+        await self.chunks.create_index([('blob_id', ASCENDING), ('n', ASCENDING)], unique=True)
+        await self.files.create_index('id', unique=True)
+
+    async def put(self, stream: AsyncIterator[bytes], content_type: str,
+                  max_bytes: Optional[int] = None) -> dict:
+        """Consume `stream` and return the file document for its content, taking a reference.
+
+        If a blob with the same hash already exists the uploaded chunks are discarded
+        and the existing blob is returned with `deduplicated` set.
+        """
+        chunks_id = str(uuid.uuid4())
+        digest = hashlib.sha256()
+        length = 0
+        n = 0
+        pending = bytearray()
+        try:
+            async for data in stream:
+                if not data:
+                    continue
+                length += len(data)
+                if max_bytes is not None and length > max_bytes:
+                    raise BlobTooLarge(f"Blob exceeds {max_bytes} bytes")
+                digest.update(data)
+                pending.extend(data)
+                while len(pending) >= self.chunk_size:
+                    await self._write_chunk(chunks_id, n, bytes(pending[:self.chunk_size]))
+                    del pending[:self.chunk_size]
+                    n += 1
+            if pending:
+                await self._write_chunk(chunks_id, n, bytes(pending))
+        except BaseException:
+            await self.chunks.delete_many({'blob_id': chunks_id})
+            raise
+
+        sha256 = digest.hexdigest()
+        existing = await self.acquire(sha256)
+        if existing is None:
+            doc = {
+                'id': sha256,
+                'chunks_id': chunks_id,
+                'length': length,
+                'chunk_size': self.chunk_size,
+                'content_type': content_type,
+                'sha256': sha256,
+                'refcount': 1,
+                'uploaded_at': datetime.utcnow(),
+            }
+            try:
+                await self.files.insert_one(dict(doc))
+                return {**doc, 'deduplicated': False}
+            except DuplicateKeyError:
+                # Another upload of the same content won the race
+                existing = await self.acquire(sha256)
+        await self.chunks.delete_many({'blob_id': chunks_id})
+        if existing is None:
+            raise RuntimeError(f"Blob {sha256} disappeared while being deduplicated")
+        return {**existing, 'deduplicated': True}
+
+    async def acquire(self, blob_id: str) -> Optional[dict]:
+        """Take another reference to an existing blob; returns None if it is not stored."""
+        return await self.files.find_one_and_update(
+            {'id': blob_id}, {'$inc': {'refcount': 1}}, {'_id': 0}, return_document=ReturnDocument.AFTER,
+        )
+
+    async def release(self, blob_id: str):
+        """Drop a reference, deleting the blob once nothing refers to it."""
+        doc = await self.files.find_one_and_update(
+            {'id': blob_id}, {'$inc': {'refcount': -1}}, {'_id': 0}, return_document=ReturnDocument.AFTER,
+        )
+        if doc is None or doc.get('refcount', 0) > 0:
+            return
+        # Only delete if no acquire slipped in since the decrement
+        result = await self.files.delete_one({'id': blob_id, 'refcount': {'$lte': 0}})
+        if result.deleted_count:
+            await self.chunks.delete_many({'blob_id': self._chunks_id(doc)})
+
+    async def get(self, blob_id: str) -> Optional[dict]:
+        return await self.files.find_one({'id': blob_id}, {'_id': 0})
+
+    async def existing(self, blob_ids: Iterable[str]) -> List[str]:
+        """The subset of `blob_ids` that are already stored."""
+        cursor = self.files.find({'id': {'$in': list(blob_ids)}}, {'_id': 0, 'id': 1})
+        return [doc['id'] async for doc in cursor]
+
+    async def read_range(self, blob: dict, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Yield the bytes in [start, end] (inclusive) of `blob`, fetching only the chunks that overlap."""
+        if end is None:
+            end = blob['length'] - 1
+        if blob['length'] == 0 or start > end:
+            return
+        chunk_size = blob['chunk_size']
+        first, last = start // chunk_size, end // chunk_size
+        cursor = self.chunks.find(
+            {'blob_id': self._chunks_id(blob), 'n': {'$gte': first, '$lte': last}},
+            {'_id': 0, 'n': 1, 'data': 1},
+        ).sort('n', ASCENDING).batch_size(4)
+        async for chunk in cursor:
+            data = bytes(chunk['data'])
+            offset = chunk['n'] * chunk_size
+            lo = max(start - offset, 0)
+            hi = min(end - offset + 1, len(data))
+            yield data[lo:hi]
+
+    async def read_all(self, blob: dict) -> bytes:
+        return b''.join([chunk async for chunk in self.read_range(blob)])
+
+    @staticmethod
+    def _chunks_id(blob: dict) -> str:
+        return blob.get('chunks_id', blob['id'])
+
+    async def _write_chunk(self, chunks_id: str, n: int, data: bytes):
+        await self.chunks.insert_one({'blob_id': chunks_id, 'n': n, 'data': Binary(data)})
@@ -0,0 +1,191 @@
+"""Negotiated response compression (zstd, br, gzip) as streaming ASGI middleware.
+
+gzip is always available. Brotli and Zstandard are used when the `brotli` and
+`zstandard` packages (both in requirements.txt) are installed; without them only
+gzip is offered.
+"""
+import re
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional
+    zstandard = None
+
+
+# Media types whose bodies are already compressed, or that must reach the client unbuffered
+SKIP_MEDIA_TYPES = re.compile(
+    r'^(image/(?!svg\+xml)|video/|audio/|font/woff2?$|text/event-stream$|'
+    r'application/(pdf|gzip|zip|zstd|x-7z-compressed|x-bzip2|x-xz|x-rar-compressed|brotli|octet-stream)$)'
+)
+
+
+class _Gzip:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+class _Zstd:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+def available_encodings() -> Dict[str, Callable[[int], object]]:
+    """Supported content codings, most preferred first."""
+    encodings = {}
+    if zstandard is not None:
+        encodings['zstd'] = _Zstd
+    if brotli is not None:
+        encodings['br'] = _Brotli
+    encodings['gzip'] = _Gzip
+    return encodings
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    accepted = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if not name:
+            continue
+        q = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+def negotiate(header: str, encodings: Iterable[str]) -> Optional[str]:
+    """The best coding the client accepts, preferring higher q and then server order."""
+    accepted = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for name in encodings:
+        q = accepted.get(name, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class CompressionMiddleware:
+    """Compresses responses in the coding negotiated from Accept-Encoding.
+
+    Bodies are compressed chunk by chunk and flushed as they go, so streamed
+    responses (NDJSON exports, journal PDFs) are never buffered whole. Responses
+    below `minimum_size`, partial and bodiless responses, responses that already
+    have a Content-Encoding and media types in SKIP_MEDIA_TYPES pass through
+    untouched. ETags of compressed responses are made weak, since the bytes
+    differ from the identity representation; weak comparison still lets
+    If-None-Match revalidate them.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, levels: Optional[Dict[str, int]] = None,
+                 encodings: Optional[Dict[str, Callable[[int], object]]] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = encodings if encodings is not None else available_encodings()
+        self.levels = {'gzip': 6, 'br': 4, 'zstd': 3, **(levels or {})}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] == 'HEAD':
+            await self.app(scope, receive, send)
+            return
+        accept = next((v.decode('latin-1') for k, v in scope['headers'] if k == b'accept-encoding'), '')
+        encoding = negotiate(accept, self.encodings) if accept else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[dict] = None
+        compressor = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, compressor, passthrough
+            if message['type'] == 'http.response.start':
+                start = message
+                if not self._compressible(message):
+                    passthrough = True
+                    await send(message)
+                return
+            if passthrough or message['type'] != 'http.response.body':
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = self.encodings[encoding](self.levels.get(encoding, 6))
+                await send({**start, 'headers': self._headers(start['headers'], encoding)})
+            data = compressor.chunk(body) if more_body else compressor.finish(body)
+            await send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _compressible(self, start: dict) -> bool:
+        if start['status'] < 200 or start['status'] in (204, 206, 304):
+            return False
+        content_type = ''
+        for name, value in start.get('headers', []):
+            name = name.lower()
+            if name == b'content-encoding':
+                return False
+            if name == b'content-length' and int(value) < self.minimum_size:
+                return False
+            if name == b'content-type':
+                content_type = value.decode('latin-1').split(';')[0].strip().lower()
+        return not SKIP_MEDIA_TYPES.match(content_type)
+
+    @staticmethod
+    def _headers(headers: List[Tuple[bytes, bytes]], encoding: str) -> List[Tuple[bytes, bytes]]:
+        result, vary = [], None
+        for name, value in headers:
+            lower = name.lower()
+            if lower == b'content-length':
+                continue
+            if lower == b'etag' and not value.startswith(b'W/'):
+                value = b'W/' + value
+            if lower == b'vary':
+                vary = value
+                continue
+            result.append((name, value))
+        if vary is None:
+            vary = b'Accept-Encoding'
+        elif b'accept-encoding' not in vary.lower() and vary.strip() != b'*':
+            vary = vary + b', Accept-Encoding'
+        result += [(b'content-encoding', encoding.encode()), (b'vary', vary)]
+        return result
@@ -0,0 +1,49 @@
+"""ETags and conditional GET helpers.
+
+List endpoints derive their ETag from a cheap collection version, the document
+count plus the newest sort key, so a revalidation that ends in 304 costs an
+index lookup and a metadata read rather than a query and serialization.
+"""
+import asyncio
+import hashlib
+from typing import Optional, Sequence, Tuple
+
+from fastapi import Request, Response
+
+
+def make_etag(*parts) -> str:
+    """A strong ETag over the repr of `parts`."""
+    return '"' + hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest() + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches `etag`, using the weak comparison RFC 9110 asks for."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    bare = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith('W/') else candidate) == bare:
+            return True
+    return False
+
+def not_modified(request: Request, etag: str, headers: Optional[dict] = None) -> Optional[Response]:
+    """A 304 response if the request already holds `etag`, else None."""
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={'ETag': etag, **(headers or {})})
+    return None
+
+async def collection_version(collection, sort: Sequence[Tuple[str, int]]) -> tuple:
+    """(document count, newest sort key) of a collection.
+
+    `sort` should be the descending form of an indexed key so the lookup is a
+    single index probe. Any insert or delete changes the count, and an insert
+    at the end of the ordering changes the newest key.
+    """
+    fields = [name for name, _ in sort]
+    count, newest = await asyncio.gather(
+        collection.estimated_document_count(),
+        collection.find_one({}, {'_id': 0, **{name: 1 for name in fields}}, sort=list(sort)),
+    )
+    return count, tuple((newest or {}).get(name) for name in fields)
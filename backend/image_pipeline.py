@@ -0,0 +1,116 @@
+"""CPU-bound image work (decode, resize, encode) run in a process pool so it never
+blocks the event loop."""
+import io
+import logging
+from typing import Dict, Optional, Sequence, Tuple
+
+from process_pool import LazyProcessPool
+
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    'webp': 'image/webp',
+    'avif': 'image/avif',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+}
+
+
+def supported_formats(requested: Sequence[str]) -> Tuple[str, ...]:
+    """Filter `requested` down to the formats this Pillow build can encode."""
+    from PIL import features
+
+    available = []
+    for fmt in requested:
+        if fmt not in CONTENT_TYPES:
+            logger.warning("Ignoring unknown image format %r", fmt)
+        elif fmt in ('webp', 'avif') and not features.check(fmt):
+            logger.warning("Pillow was built without %s support; skipping it", fmt)
+        else:
+            available.append(fmt)
+    return tuple(available)
+
+
+def _encode(image, fmt: str, quality: int) -> bytes:
+    out = io.BytesIO()
+    if fmt == 'jpeg':
+        image.convert('RGB').save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+    elif fmt == 'png':
+        image.save(out, 'PNG', optimize=True)
+    elif fmt == 'webp':
+        image.save(out, 'WEBP', quality=quality, method=4)
+    else:
+        image.save(out, fmt.upper(), quality=quality)
+    return out.getvalue()
+
+
+def render_variants(image, formats: Sequence[str], sizes: Sequence[int],
+                    quality: int) -> Dict[str, Tuple[bytes, str, int, int]]:
+    """Encode `image` as a full-size image plus bounding-box thumbnails.
+
+    Returns {name: (encoded bytes, content type, width, height)} with names like
+    'full.webp' and 'thumb160.webp'.
+    """
+    from PIL import Image
+
+    variants = {}
+    for fmt in formats:
+        variants[f'full.{fmt}'] = (_encode(image, fmt, quality), CONTENT_TYPES[fmt], *image.size)
+    for size in sorted(sizes):
+        thumb = image.copy()
+        thumb.thumbnail((size, size), Image.LANCZOS)
+        for fmt in formats:
+            variants[f'thumb{size}.{fmt}'] = (_encode(thumb, fmt, quality), CONTENT_TYPES[fmt], *thumb.size)
+    return variants
+
+
+def dhash(image, size: int = 8) -> int:
+    """64-bit difference hash: one bit per horizontally adjacent pixel pair of a 9x8 greyscale thumbnail.
+
+    Near-identical captures (a blinking cursor, a scrolled pixel) land within a few
+    bits of each other.
+    """
+    import numpy as np
+    from PIL import Image
+
+    pixels = np.asarray(image.convert('L').resize((size + 1, size), Image.LANCZOS), dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def process_image(data: bytes, formats: Sequence[str], sizes: Sequence[int],
+                  quality: int) -> Tuple[Dict[str, Tuple[bytes, str, int, int]], int]:
+    """Decode `data` once, returning its variants and its perceptual hash. Runs inside a worker process."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as source:
+        source.load()
+        image = source if source.mode in ('RGB', 'RGBA') else source.convert('RGBA')
+        return render_variants(image, formats, sizes, quality), dhash(image)
+
+
+class ImagePipeline:
+    """Owns the process pool used for image work; the pool is created on first use."""
+
+    def __init__(self, workers: Optional[int] = None, formats: Sequence[str] = ('webp',),
+                 sizes: Sequence[int] = (160, 480), quality: int = 80):
+        self.pool = LazyProcessPool(workers)
+        self.requested_formats = tuple(formats)
+        self.sizes = tuple(sizes)
+        self.quality = quality
+        self._formats: Optional[Tuple[str, ...]] = None
+
+    @property
+    def formats(self) -> Tuple[str, ...]:
+        if self._formats is None:
+            self._formats = supported_formats(self.requested_formats)
+        return self._formats
+
+    async def process(self, data: bytes) -> Tuple[Dict[str, Tuple[bytes, str, int, int]], int]:
+        """Variants and perceptual hash of an encoded image; see process_image."""
+        return await self.pool.run(process_image, data, self.formats, self.sizes, self.quality)
+
+    def shutdown(self):
+        self.pool.shutdown()
+
@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from typing import Dict, List, Optional, Set
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from pymongo import ASCENDING
+
+import annotation_store
+from blob_store import ChunkedBlobStore
+from metrics import gauge_lines
+from pdf_render import render_page_chunk, render_title_page, stamp_page
+from pdf_writer import PDFStreamWriter
+from process_pool import LazyProcessPool, cpu_share
+from screenshots import generate_variants, get_blob_store, get_state
+from similarity import cluster_near_duplicates
+
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/journals", tags=["journals"])
+
+RECENT_RENDERS = 20
+
+
+class JournalPdfOptions(BaseModel):
+    title_page: bool = True
+    image_quality: int = Field(90, ge=1, le=100)
+    max_image_dpi: int = Field(300, ge=72, le=1200)
+    # Leave out all but the first capture of each group of near-duplicates
+    skip_near_duplicates: bool = False
+    near_duplicate_distance: int = Field(3, ge=0, le=64)
+
+
+class RedundantCaptures(BaseModel):
+    groups: List[List[str]]
+    redundant: List[str]
+
+
+class WorkerUsage(BaseModel):
+    pid: int
+    chunks: int
+    pages: int
+    peak_rss_bytes: int
+
+
+class RenderStats(BaseModel):
+    journal_id: str
+    pages: int
+    skipped: int
+    seconds: float
+    workers: int
+    worker_usage: List[WorkerUsage]
+
+
+def journal_filter(journal_id: str) -> dict:
+    return {'session_id': journal_id}
+
+SCREENSHOT_PAGE_FIELDS = {'_id': 0, 'id': 1, 'blob_id': 1, 'timestamp': 1, 'annotations': 1, 'annotations_split': 1}
+
+
+async def near_duplicate_groups(state, store: ChunkedBlobStore, journal_id: str, max_distance: int) -> List[List[str]]:
+    """Groups of captures in a journal whose dHashes are within `max_distance`, in capture order."""
+    db = state.db
+    items = []
+    cursor = db.screenshots.find(journal_filter(journal_id), {'_id': 0}) \
+        .sort([('timestamp', ASCENDING), ('id', ASCENDING)])
+    async for doc in cursor:
+        if doc.get('dhash') is None:
+            await generate_variants(state, store, doc)
+            doc = await db.screenshots.find_one({'id': doc['id']}, {'_id': 0, 'id': 1, 'dhash': 1}) or {}
+        if doc.get('dhash') is not None:
+            items.append((doc['id'], doc['dhash']))
+    return cluster_near_duplicates(items, max_distance)
+
+
+async def read_blob(store: ChunkedBlobStore, blob_id: str) -> Optional[bytes]:
+    blob = await store.get(blob_id)
+    if blob is None:
+        return None
+    return await store.read_all(blob)
+
+
+async def run_chunk(render_pool: Optional[LazyProcessPool], items: list, options: JournalPdfOptions):
+    if render_pool is None:
+        loop = asyncio.get_running_loop()
+        # Decoding and JPEG encoding release the GIL, so a thread keeps the loop responsive
+        return await loop.run_in_executor(
+            None, render_page_chunk, items, options.image_quality, options.max_image_dpi,
+        )
+    return await render_pool.run(render_page_chunk, items, options.image_quality, options.max_image_dpi)
+
+
+async def render_pages(state, store: ChunkedBlobStore, journal_id: str, options: JournalPdfOptions,
+                       usage: Dict[int, WorkerUsage], exclude: Set[str]):
+    """Yield rendered screenshot pages in journal order.
+
+    Screenshots are cut into chunks of PDF_CHUNK_PAGES and rendered concurrently, with
+    at most two chunks per worker in flight, so memory stays bounded however long
+    the journal is. Results are consumed in submission order to keep pages in order.
+    """
+    db, render_pool = state.db, state.render_pool
+    chunk_pages = state.settings.pdf_chunk_pages
+    window = max(render_pool.workers if render_pool else 1, 1) * 2
+    in_flight: deque = deque()
+    chunk: list = []
+
+    async def drain(until: int):
+        while len(in_flight) > until:
+            pages, pid, peak = await in_flight.popleft()
+            worker = usage.setdefault(pid, WorkerUsage(pid=pid, chunks=0, pages=0, peak_rss_bytes=0))
+            worker.chunks += 1
+            worker.pages += len(pages)
+            worker.peak_rss_bytes = max(worker.peak_rss_bytes, peak)
+            for page in pages:
+                yield page
+
+    try:
+        cursor = db.screenshots.find(journal_filter(journal_id), SCREENSHOT_PAGE_FIELDS) \
+            .sort([('timestamp', ASCENDING), ('id', ASCENDING)]).batch_size(16)
+        async for doc in cursor:
+            if doc['id'] in exclude:
+                continue
+            data = await read_blob(store, doc['blob_id'])
+            if data is None:
+                logger.warning("Screenshot %s has no stored image; skipping it", doc['id'])
+                yield None
+                continue
+            await annotation_store.hydrate(db, [doc])
+            chunk.append((doc['id'], data, doc['timestamp'], doc.get('annotations') or []))
+            if len(chunk) >= chunk_pages:
+                in_flight.append(asyncio.ensure_future(run_chunk(render_pool, chunk, options)))
+                chunk = []
+                async for page in drain(window - 1):
+                    yield page
+        if chunk:
+            in_flight.append(asyncio.ensure_future(run_chunk(render_pool, chunk, options)))
+        async for page in drain(0):
+            yield page
+    finally:
+        # On a client disconnect the generator is closed early: chunks not yet started need not be rendered
+        for future in in_flight:
+            future.cancel()
+
+
+async def stream_journal_pdf(state, store: ChunkedBlobStore, journal_id: str, total: int, options: JournalPdfOptions,
+                             exclude: Set[str]):
+    """Yield the PDF as pages come back from the renderers, numbering them as they are merged."""
+    db, render_pool = state.db, state.render_pool
+    started = time.perf_counter()
+    writer = PDFStreamWriter(title=f'Snap Journal {journal_id}')
+    yield writer.start()
+
+    if options.title_page:
+        fields = {'_id': 0, 'id': 1, 'annotations': 1, 'annotations_split': 1}
+        docs = [doc async for doc in db.screenshots.find(journal_filter(journal_id), fields) if doc['id'] not in exclude]
+        annotation_count = await annotation_store.count(db, docs)
+        yield writer.add_page(render_title_page(journal_id, total, annotation_count))
+
+    usage: Dict[int, WorkerUsage] = {}
+    page_number = 0
+    skipped = 0
+    async for page in render_pages(state, store, journal_id, options, usage, exclude):
+        if page is None:
+            skipped += 1
+            continue
+        page_number += 1
+        yield writer.add_page(stamp_page(page, page_number))
+
+    yield writer.finish()
+
+    stats = RenderStats(
+        journal_id=journal_id, pages=page_number, skipped=skipped,
+        seconds=round(time.perf_counter() - started, 3),
+        workers=render_pool.workers if render_pool else 1, worker_usage=list(usage.values()),
+    )
+    state.recent_renders.append(stats)
+    logger.info("Rendered journal %s: %d pages in %.2fs, peak worker RSS %s", journal_id, stats.pages,
+                stats.seconds, {w.pid: w.peak_rss_bytes for w in stats.worker_usage})
+
+
+def collect_metrics(state):
+    if not state.recent_renders:
+        return
+    last = state.recent_renders[-1]
+    yield from gauge_lines('pdf_render_last_seconds', 'Duration of the most recent journal PDF render.',
+                           [({}, last.seconds)])
+    yield from gauge_lines('pdf_render_worker_peak_rss_bytes',
+                           'Peak RSS of each PDF render worker during the most recent render.',
+                           (({'pid': str(w.pid)}, w.peak_rss_bytes) for w in last.worker_usage))
+
+
+def startup(state):
+    # Pages are rendered in a pool of PDF_WORKERS processes; with a single worker
+    # they are rendered on a thread in this process instead.
+    settings = state.settings
+    workers = settings.pdf_workers or cpu_share(settings.web_concurrency)
+    state.render_pool = LazyProcessPool(workers) if workers > 1 else None
+    state.recent_renders = deque(maxlen=RECENT_RENDERS)
+
+
+def shutdown(state):
+    if state.render_pool is not None:
+        state.render_pool.shutdown()
+
+
+@router.get("/render-stats", response_model=List[RenderStats])
+async def get_render_stats(state=Depends(get_state)):
+    """Timings and per-worker peak RSS of the most recent journal PDF renders."""
+    return list(state.recent_renders)
+
+
+@router.get("/{journal_id}/redundant", response_model=RedundantCaptures)
+async def get_redundant_captures(
+    journal_id: str,
+    max_distance: int = Query(3, alias="maxDistance", ge=0, le=64),
+    state=Depends(get_state),
+    store: ChunkedBlobStore = Depends(get_blob_store),
+):
+    """Near-duplicate captures in a journal, to review before exporting it.
+
+    Each group lists captures in order; `redundant` is every capture but the first of each group.
+    """
+    if await state.db.screenshots.count_documents(journal_filter(journal_id)) == 0:
+        raise HTTPException(status_code=404, detail="Journal not found")
+    groups = await near_duplicate_groups(state, store, journal_id, max_distance)
+    return RedundantCaptures(groups=groups, redundant=[i for group in groups for i in group[1:]])
+
+
+@router.post("/{journal_id}/pdf")
+async def render_journal_pdf(
+    journal_id: str,
+    options: Optional[JournalPdfOptions] = None,
+    state=Depends(get_state),
+    store: ChunkedBlobStore = Depends(get_blob_store),
+):
+    """Render a journal (the screenshots sharing a session_id) to PDF, streamed as it is produced."""
+    options = options or JournalPdfOptions()
+    total = await state.db.screenshots.count_documents(journal_filter(journal_id))
+    if total == 0:
+        raise HTTPException(status_code=404, detail="Journal not found")
+    exclude: Set[str] = set()
+    if options.skip_near_duplicates:
+        for group in await near_duplicate_groups(state, store, journal_id, options.near_duplicate_distance):
+            exclude.update(group[1:])
+    filename = re.sub(r'[^A-Za-z0-9._-]', '_', journal_id)
+    return StreamingResponse(
+        stream_journal_pdf(state, store, journal_id, total - len(exclude), options, exclude),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="snap-journal-{filename}.pdf"'},
+    )
@@ -0,0 +1,346 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+import annotation_store
+from metrics import gauge_lines
+import sync_log
+
+
+logger = logging.getLogger(__name__)
+
+
+# Changes read per query when the poller catches up after a burst
+POLL_BATCH = 500
+
+router = APIRouter(prefix="/live", tags=["live"])
+
+# topic -> collection it is fed from. Screenshot deletions come from sync tombstones.
+TOPICS = {'status': 'status_checks', 'screenshots': 'screenshots'}
+WATCHED = ['status_checks', 'screenshots', 'sync_tombstones']
+HIDDEN_FIELDS = ('_id', 'dhash_at')
+
+
+def make_event(topic: str, op: str, doc: dict) -> dict:
+    data = None if op == 'delete' else {k: v for k, v in doc.items() if k not in HIDDEN_FIELDS}
+    return jsonable_encoder({'topic': topic, 'op': op, 'id': doc['id'], 'data': data})
+
+def parse_topics(topics: Optional[str]) -> Set[str]:
+    if not topics:
+        return set(TOPICS)
+    names = {t.strip() for t in topics.split(',') if t.strip()}
+    unknown = names - set(TOPICS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown topics: {', '.join(sorted(unknown))}")
+    return names
+
+
+class Subscriber:
+    """One client's bounded event queue.
+
+    A client that stops reading does not hold up the feed or other clients:
+    once its queue is full further events are dropped for it, and the next
+    thing it receives is an `overflow` event telling it how many were lost,
+    so it can catch up through /api/sync/changes.
+    """
+
+    def __init__(self, topics: Set[str], max_queue: int):
+        self.topics = topics
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self.dropped = 0
+
+    def offer(self, event: dict):
+        if event['topic'] not in self.topics:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def next(self, timeout: float) -> Optional[dict]:
+        """The next event, or None if nothing happened within `timeout` seconds."""
+        if self.dropped and self.queue.empty():
+            dropped, self.dropped = self.dropped, 0
+            return {'topic': 'live', 'op': 'overflow', 'dropped': dropped}
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LiveFeed:
+    """Fans database changes out to live subscribers.
+
+    Changes are read once per process, from a MongoDB change stream when the
+    server supports them (replica sets and sharded clusters) or otherwise by
+    tailing the collections every LIVE_POLL_INTERVAL_MS, and then copied to
+    each subscriber's queue. Database load depends on the rate of change, not
+    on the number of connected clients.
+    """
+
+    def __init__(self, mode: str = 'auto', poll_interval_ms: int = 1000,
+                 lookback_ms: int = 5000, max_queue: int = 256):
+        self.mode = mode
+        self.poll_interval = poll_interval_ms / 1000
+        self.lookback_ms = lookback_ms
+        self.max_queue = max_queue
+        self.subscribers: Set[Subscriber] = set()
+        self.source: Optional[str] = None
+        self.published = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, db):
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run(db))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def subscribe(self, topics: Set[str]) -> Subscriber:
+        subscriber = Subscriber(topics, self.max_queue)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event: dict):
+        self.published += 1
+        for subscriber in list(self.subscribers):
+            subscriber.offer(event)
+
+    def stats(self) -> dict:
+        return {
+            'source': self.source,
+            'subscribers': len(self.subscribers),
+            'published': self.published,
+            'queued': sum(s.queue.qsize() for s in self.subscribers),
+            'dropped': sum(s.dropped for s in self.subscribers),
+        }
+
+    async def _run(self, db):
+        if self.mode != 'poll':
+            try:
+                await self._watch(db)
+                return
+            except Exception as e:
+                if self.mode == 'changestream':
+                    logger.exception("Could not open a change stream for live updates")
+                    return
+                logger.info("Change streams unavailable (%s); polling for live updates", e)
+        await self._poll(db)
+
+    async def _watch(self, db):
+        pipeline = [{'$match': {
+            'ns.coll': {'$in': WATCHED},
+            'operationType': {'$in': ['insert', 'update', 'replace']},
+        }}]
+        resume_token = None
+        opened = False
+        while True:
+            try:
+                async with db.watch(pipeline, full_document='updateLookup', resume_after=resume_token) as stream:
+                    opened = True
+                    self.source = 'changestream'
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        event = await self._change_event(db, change)
+                        if event is not None:
+                            self.publish(event)
+            except PyMongoError:
+                if not opened:
+                    raise
+                logger.exception("Change stream interrupted; resuming")
+                await asyncio.sleep(self.poll_interval)
+
+    @staticmethod
+    async def _change_event(db, change: dict) -> Optional[dict]:
+        doc = change.get('fullDocument')
+        if doc is None:
+            return None
+        collection = change['ns']['coll']
+        op = 'insert' if change['operationType'] == 'insert' else 'update'
+        if collection == 'status_checks':
+            return make_event('status', op, doc)
+        if collection == 'sync_tombstones':
+            return make_event('screenshots', 'delete', doc) if doc['kind'] == 'screenshot' else None
+        updated = change.get('updateDescription', {}).get('updatedFields', {})
+        if op == 'update' and 'seq' not in updated:
+            return None  # server-side bookkeeping such as generated variants
+        await annotation_store.hydrate(db, [doc])
+        return make_event('screenshots', op, doc)
+
+    async def _poll(self, db):
+        """Tail status checks by timestamp and screenshots and tombstones by committed sync sequence number.
+
+        Status checks may be written slightly out of timestamp order (by the
+        write-behind buffer, say), so each poll looks LIVE_POLL_LOOKBACK_MS back
+        and skips ids it has already published.
+        """
+        self.source = 'poll'
+        markers = None
+        seen: Dict[str, datetime] = {}
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if not self.subscribers:
+                markers = None
+                continue
+            try:
+                if markers is None:
+                    markers = await self._poll_markers(db)
+                    seen.clear()
+                    continue
+                await self._poll_status(db, markers, seen)
+                await self._poll_screenshots(db, markers)
+            except PyMongoError:
+                logger.exception("Live update poll failed")
+
+    async def _poll_markers(self, db) -> dict:
+        latest = await db.status_checks.find_one({}, {'timestamp': 1}, sort=[('timestamp', -1)])
+        return {'status_checks': latest['timestamp'] if latest else None, 'seq': await sync_log.committed_seq(db)}
+
+    async def _poll_status(self, db, markers: dict, seen: Dict[str, datetime]):
+        since = markers['status_checks']
+        lookback = timedelta(milliseconds=self.lookback_ms)
+        query = {} if since is None else {'timestamp': {'$gte': since - lookback}}
+        cursor = db.status_checks.find(query, {'_id': 0}).sort([('timestamp', ASCENDING), ('id', ASCENDING)])
+        async for doc in cursor:
+            if doc['id'] in seen:
+                continue
+            seen[doc['id']] = doc['timestamp']
+            if since is None or doc['timestamp'] > since:
+                markers['status_checks'] = since = doc['timestamp']
+            self.publish(make_event('status', 'insert', doc))
+        if since is not None:
+            for key in [k for k, ts in seen.items() if ts < since - lookback]:
+                del seen[key]
+
+    async def _poll_screenshots(self, db, markers: dict):
+        """Publish screenshot changes and deletions up to the committed sync sequence, POLL_BATCH at a time.
+
+        Stopping at the committed mark rather than the highest seq seen means a
+        write that took its number earlier but landed later is not skipped.
+        """
+        committed = await sync_log.committed_seq(db)
+        while markers['seq'] < committed:
+            window = {'$gt': markers['seq'], '$lte': committed}
+            docs = await db.screenshots.find({'seq': window}, {'_id': 0}) \
+                .sort('seq', ASCENDING).limit(POLL_BATCH).to_list(POLL_BATCH)
+            tombstones = await db.sync_tombstones.find({'kind': 'screenshot', 'seq': window}, {'_id': 0}) \
+                .sort('seq', ASCENDING).limit(POLL_BATCH).to_list(POLL_BATCH)
+            # A full batch may have more behind it; only publish up to where both are complete
+            upto = min([batch[-1]['seq'] for batch in (docs, tombstones) if len(batch) == POLL_BATCH],
+                       default=committed)
+            docs = [doc for doc in docs if doc['seq'] <= upto]
+            await annotation_store.hydrate(db, docs)
+            events = [(doc['seq'], make_event('screenshots', 'insert' if doc.get('version', 1) == 1 else 'update', doc))
+                      for doc in docs]
+            events += [(doc['seq'], make_event('screenshots', 'delete', doc)) for doc in tombstones if doc['seq'] <= upto]
+            for _, event in sorted(events, key=lambda e: e[0]):
+                self.publish(event)
+            markers['seq'] = upto
+
+
+def get_feed(request: Request) -> LiveFeed:
+    return request.app.state.live_feed
+
+
+def collect_metrics(state):
+    stats = state.live_feed.stats()
+    for field, doc in (
+        ('subscribers', 'Clients connected to the live update feed.'),
+        ('published', 'Events published to the live update feed.'),
+        ('queued', 'Live events waiting to be sent to clients.'),
+        ('dropped', 'Live events dropped for clients that fell behind.'),
+    ):
+        yield from gauge_lines(f'live_{field}', doc, [({}, stats[field])])
+
+
+def startup(state):
+    settings = state.settings
+    state.live_feed = LiveFeed(
+        mode=settings.live_mode, poll_interval_ms=settings.live_poll_interval_ms,
+        lookback_ms=settings.live_poll_lookback_ms, max_queue=settings.live_queue_size,
+    )
+    state.live_feed.start(state.db)
+
+async def shutdown(state):
+    await state.live_feed.close()
+
+
+@router.get("/stats")
+async def get_live_stats(feed: LiveFeed = Depends(get_feed)):
+    return feed.stats()
+
+@router.get("/events")
+async def live_events(request: Request, topics: Optional[str] = None, feed: LiveFeed = Depends(get_feed)):
+    """Server-Sent Events stream of status checks and screenshot changes.
+
+    `topics` is a comma separated subset of `status` and `screenshots`. Each
+    event is a JSON object {topic, op, id, data}; op is insert, update or
+    delete. A comment line is sent every LIVE_HEARTBEAT_SECONDS to keep
+    proxies from closing an idle connection.
+    """
+    subscriber = feed.subscribe(parse_topics(topics))
+    heartbeat = request.app.state.settings.live_heartbeat_seconds
+
+    async def stream():
+        try:
+            yield ': connected\n\n'
+            while not await request.is_disconnected():
+                event = await subscriber.next(heartbeat)
+                if event is None:
+                    yield ': heartbeat\n\n'
+                else:
+                    yield f"event: {event['topic']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            feed.unsubscribe(subscriber)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.websocket("/ws")
+async def live_websocket(websocket: WebSocket, topics: Optional[str] = None):
+    """The same events as /events, one JSON message each, over a WebSocket."""
+    try:
+        names = parse_topics(topics)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+    await websocket.accept()
+    feed = websocket.app.state.live_feed
+    heartbeat = websocket.app.state.settings.live_heartbeat_seconds
+    subscriber = feed.subscribe(names)
+    # Reading in the background notices a client that went away even while no events are flowing
+    receiver = asyncio.create_task(drain(websocket))
+    try:
+        while not receiver.done():
+            event = await subscriber.next(heartbeat)
+            await websocket.send_json(event if event is not None else {'topic': 'live', 'op': 'heartbeat'})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        feed.unsubscribe(subscriber)
+        receiver.cancel()
+
+async def drain(websocket: WebSocket):
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
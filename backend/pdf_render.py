@@ -0,0 +1,145 @@
+"""Page rendering for journal PDFs.
+
+This module runs inside PDF render worker processes, so it deliberately imports
+nothing beyond the PDF writer and Pillow.
+"""
+import io
+import logging
+import os
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from pdf_writer import A4, MM, PageCanvas, PageImage, RenderedPage, text_width
+from process_pool import peak_rss_bytes
+
+
+logger = logging.getLogger(__name__)
+
+# Layout, matching PDFJournalExporter in extension-ready/pdf-export.js
+MARGIN = 10 * MM
+MARKER_COLOR = (0.86, 0.15, 0.15)
+WHITE = (1, 1, 1)
+
+
+def format_capture_time(timestamp: datetime) -> str:
+    return (f"Captured: {timestamp:%A}, {timestamp:%B} {timestamp.day}, {timestamp.year} "
+            f"at {timestamp:%I:%M:%S %p} UTC")
+
+
+def render_title_page(title: str, screenshot_count: int, annotation_count: int) -> RenderedPage:
+    canvas = PageCanvas(A4)
+    center = canvas.width / 2
+    start = 40 * MM
+    canvas.text(center, start, 'SNAP JOURNAL', 'F2', 24, align='center')
+    canvas.text(center, start + 15 * MM, 'Medical Grade Screenshot Documentation', 'F1', 16, align='center')
+    info = start + 40 * MM
+    canvas.text(center, info, f'Journal: {title}', 'F1', 12, align='center')
+    canvas.text(center, info + 8 * MM, f'Export Date: {datetime.utcnow():%Y-%m-%d %H:%M:%S} UTC', 'F1', 12, align='center')
+    canvas.text(center, info + 16 * MM, f'Screenshots: {screenshot_count}', 'F1', 12, align='center')
+    canvas.text(center, info + 24 * MM, f'Total Annotations: {annotation_count}', 'F1', 12, align='center')
+    canvas.text(center, canvas.height - 12 * MM,
+                'Generated by Snap Journal - Medical Grade Screenshot Annotation', 'F3', 10, align='center')
+    return canvas.finish(outline_title='Title')
+
+
+def draw_annotations(canvas: PageCanvas, annotations: List[dict], x: float, y: float, width: float, height: float):
+    """Draw markers, dashed leader lines and labels, positioned by their relative (0-1) coordinates."""
+    for annotation in annotations:
+        rx, ry = annotation.get('relativeX'), annotation.get('relativeY')
+        if rx is None or ry is None:
+            continue
+        mx, my = x + rx * width, y + ry * height
+        text = (annotation.get('text') or '').strip()
+        if text and annotation.get('textVisible', True):
+            size = 9
+            label_width = text_width(text, 'F2', size) + 4
+            lx = min(mx + 12, x + width - label_width)
+            ly = max(my - 14, y)
+            canvas.line(mx, my, lx, ly + size / 2 + 1, MARKER_COLOR, width=0.8, dash=(3, 2))
+            canvas.rect(lx, ly, label_width, size + 3, WHITE)
+            canvas.text(lx + 2, ly + size, text, 'F2', size, color=MARKER_COLOR)
+        if annotation.get('markerVisible', True):
+            canvas.circle(mx, my, 3, MARKER_COLOR, stroke=WHITE, stroke_width=0.8)
+
+
+def encode_page_image(data: bytes, box_width: float, box_height: float, quality: int, max_dpi: int) -> PageImage:
+    """Decode a screenshot, cap its resolution at max_image_dpi for the box it is drawn in,
+    and re-encode it as JPEG for the PDF."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as source:
+        image = source.convert('RGBA') if source.mode in ('P', 'LA') else source
+        if image.mode == 'RGBA':
+            flattened = Image.new('RGB', image.size, (255, 255, 255))
+            flattened.paste(image, mask=image.getchannel('A'))
+            image = flattened
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        max_width = int(box_width / 72 * max_dpi)
+        max_height = int(box_height / 72 * max_dpi)
+        if image.width > max_width or image.height > max_height:
+            image = image.copy()
+            image.thumbnail((max_width, max_height), Image.LANCZOS)
+
+        out = io.BytesIO()
+        image.save(out, 'JPEG', quality=quality, optimize=True)
+        return PageImage(out.getvalue(), image.width, image.height)
+
+
+def render_screenshot_page(data: bytes, timestamp: datetime, annotations: List[dict],
+                           quality: int = 90, max_dpi: int = 300) -> RenderedPage:
+    """The server-side equivalent of PDFJournalExporter.addScreenshotPage.
+
+    The page number is left out so pages can be rendered out of order; `stamp_page`
+    adds it when the pages are merged.
+    """
+    from PIL import Image
+
+    canvas = PageCanvas(A4)
+    content_width = canvas.width - 2 * MARGIN
+    content_height = canvas.height - 2 * MARGIN
+    header = format_capture_time(timestamp)
+    canvas.text(canvas.width / 2, MARGIN + 8 * MM, header, 'F2', 12, align='center')
+
+    with Image.open(io.BytesIO(data)) as probe:
+        aspect = probe.width / probe.height
+    image_width = content_width
+    image_height = image_width / aspect
+    max_image_height = content_height - 28 * MM
+    if image_height > max_image_height:
+        image_height = max_image_height
+        image_width = image_height * aspect
+    image_x = (canvas.width - image_width) / 2
+    image_y = MARGIN + 18 * MM
+
+    canvas.image('Im1', encode_page_image(data, image_width, image_height, quality, max_dpi),
+                 image_x, image_y, image_width, image_height)
+    draw_annotations(canvas, annotations, image_x, image_y, image_width, image_height)
+    return canvas.finish(outline_title=f'{timestamp:%Y-%m-%d %H:%M:%S}')
+
+
+def stamp_page(page: RenderedPage, page_number: int) -> RenderedPage:
+    """Add the page number footer and outline entry once the page's final position is known."""
+    canvas = PageCanvas(page.size)
+    canvas.text(canvas.width / 2, canvas.height - 10 * MM, f'Page {page_number}', 'F1', 10, align='center')
+    page.content += b'\n' + canvas.finish().content
+    page.outline_title = f'Page {page_number} - {page.outline_title}'
+    return page
+
+
+def render_page_chunk(items: List[Tuple[str, bytes, datetime, List[dict]]], quality: int,
+                      max_dpi: int) -> Tuple[List[Optional[RenderedPage]], int, int]:
+    """Render a run of screenshots; a page that cannot be rendered comes back as None.
+
+    Returns the pages with the worker's pid and peak RSS so usage can be reported.
+    Runs in a pool worker process (or a thread when PDF_WORKERS is 1).
+    """
+    pages = []
+    for screenshot_id, data, timestamp, annotations in items:
+        try:
+            pages.append(render_screenshot_page(data, timestamp, annotations, quality, max_dpi))
+        except Exception:
+            logger.exception("Could not render screenshot %s", screenshot_id)
+            pages.append(None)
+    return pages, os.getpid(), peak_rss_bytes()
@@ -0,0 +1,273 @@
+"""A small incremental PDF writer.
+
+Objects are serialised as soon as they are added and handed back as bytes, so a
+document can be streamed page by page while only the byte offsets needed for the
+cross-reference table are kept in memory. Text uses the standard 14 Helvetica
+fonts, so nothing has to be embedded.
+"""
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+
+MM = 72 / 25.4
+A4 = (210 * MM, 297 * MM)
+
+FONTS = {'F1': 'Helvetica', 'F2': 'Helvetica-Bold', 'F3': 'Helvetica-Oblique'}
+
+# Glyph widths (1/1000 em) for printable ASCII 32..126, from the Adobe AFM files.
+_HELVETICA = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+_HELVETICA_BOLD = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+)
+_WIDTHS = {'F1': _HELVETICA, 'F2': _HELVETICA_BOLD, 'F3': _HELVETICA}
+
+
+def encode_text(text: str) -> bytes:
+    """Encode text for a standard-font string, replacing what WinAnsi cannot show."""
+    return text.encode('cp1252', errors='replace')
+
+def text_width(text: str, font: str, size: float) -> float:
+    widths = _WIDTHS[font]
+    total = 0
+    for byte in encode_text(text):
+        total += widths[byte - 32] if 32 <= byte <= 126 else 556
+    return total * size / 1000
+
+def _escape(data: bytes) -> bytes:
+    return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+def _num(value: float) -> str:
+    return f'{value:.2f}'.rstrip('0').rstrip('.')
+
+def pdf_string(text: str) -> bytes:
+    return b'(' + _escape(encode_text(text)) + b')'
+
+
+@dataclass
+class PageImage:
+    data: bytes
+    width: int
+    height: int
+    filter: str = 'DCTDecode'
+
+
+@dataclass
+class RenderedPage:
+    """A page ready to be written: its content stream plus the images it draws."""
+    content: bytes
+    size: Tuple[float, float] = A4
+    images: Dict[str, PageImage] = field(default_factory=dict)
+    outline_title: Optional[str] = None
+
+
+class PageCanvas:
+    """Builds a content stream using top-left origin coordinates in points."""
+
+    def __init__(self, size: Tuple[float, float] = A4):
+        self.width, self.height = size
+        self._ops: List[bytes] = []
+        self.images: Dict[str, PageImage] = {}
+
+    def _y(self, y: float) -> float:
+        return self.height - y
+
+    def _op(self, op: str):
+        self._ops.append(op.encode('ascii'))
+
+    def text(self, x: float, y: float, text: str, font: str = 'F1', size: float = 12,
+             align: str = 'left', color: Tuple[float, float, float] = (0, 0, 0)):
+        if align == 'center':
+            x -= text_width(text, font, size) / 2
+        elif align == 'right':
+            x -= text_width(text, font, size)
+        self._op(f'BT /{font} {_num(size)} Tf {" ".join(_num(c) for c in color)} rg '
+                 f'{_num(x)} {_num(self._y(y))} Td ')
+        self._ops.append(pdf_string(text) + b' Tj ET')
+
+    def image(self, name: str, image: PageImage, x: float, y: float, width: float, height: float):
+        self.images[name] = image
+        self._op(f'q {_num(width)} 0 0 {_num(height)} {_num(x)} {_num(self._y(y + height))} cm /{name} Do Q')
+
+    def rect(self, x: float, y: float, width: float, height: float, fill: Tuple[float, float, float]):
+        self._op(f'{" ".join(_num(c) for c in fill)} rg '
+                 f'{_num(x)} {_num(self._y(y + height))} {_num(width)} {_num(height)} re f')
+
+    def line(self, x1: float, y1: float, x2: float, y2: float, color: Tuple[float, float, float],
+             width: float = 1, dash: Optional[Tuple[float, float]] = None):
+        dash_op = f'[{_num(dash[0])} {_num(dash[1])}] 0 d' if dash else '[] 0 d'
+        self._op(f'q {" ".join(_num(c) for c in color)} RG {_num(width)} w {dash_op} '
+                 f'{_num(x1)} {_num(self._y(y1))} m {_num(x2)} {_num(self._y(y2))} l S Q')
+
+    def circle(self, cx: float, cy: float, r: float, fill: Tuple[float, float, float],
+               stroke: Optional[Tuple[float, float, float]] = None, stroke_width: float = 1):
+        k = 0.5523 * r
+        x, y = cx, self._y(cy)
+        path = (
+            f'{_num(x + r)} {_num(y)} m '
+            f'{_num(x + r)} {_num(y + k)} {_num(x + k)} {_num(y + r)} {_num(x)} {_num(y + r)} c '
+            f'{_num(x - k)} {_num(y + r)} {_num(x - r)} {_num(y + k)} {_num(x - r)} {_num(y)} c '
+            f'{_num(x - r)} {_num(y - k)} {_num(x - k)} {_num(y - r)} {_num(x)} {_num(y - r)} c '
+            f'{_num(x + k)} {_num(y - r)} {_num(x + r)} {_num(y - k)} {_num(x + r)} {_num(y)} c'
+        )
+        paint = 'f'
+        colors = f'{" ".join(_num(c) for c in fill)} rg'
+        if stroke:
+            colors += f' {" ".join(_num(c) for c in stroke)} RG {_num(stroke_width)} w'
+            paint = 'B'
+        self._op(f'q {colors} {path} {paint} Q')
+
+    def finish(self, outline_title: Optional[str] = None) -> RenderedPage:
+        return RenderedPage(
+            content=b'\n'.join(self._ops), size=(self.width, self.height),
+            images=self.images, outline_title=outline_title,
+        )
+
+
+class PDFStreamWriter:
+    """Serialises a PDF incrementally; every method returns the bytes to send next.
+
+    Object numbers 1 (catalog) and 2 (page tree) are reserved up front so pages can
+    point at their parent before it exists; both are written by `finish`, which
+    also emits the outline and the cross-reference table.
+    """
+
+    CATALOG, PAGES = 1, 2
+
+    def __init__(self, title: str = '', compress: bool = True):
+        self.title = title
+        self.compress = compress
+        self._offset = 0
+        self._offsets: Dict[int, int] = {}
+        self._next_id = 3
+        self._fonts: Dict[str, int] = {}
+        self._pages: List[Tuple[int, Optional[str]]] = []
+
+    @property
+    def page_count(self) -> int:
+        return len(self._pages)
+
+    def _reserve(self) -> int:
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _emit(self, data: bytes) -> bytes:
+        self._offset += len(data)
+        return data
+
+    def _object(self, obj_id: int, body: bytes, stream: Optional[bytes] = None) -> bytes:
+        self._offsets[obj_id] = self._offset
+        if stream is None:
+            return self._emit(b'%d 0 obj\n%s\nendobj\n' % (obj_id, body))
+        return self._emit(b'%d 0 obj\n%s\nstream\n%s\nendstream\nendobj\n' % (obj_id, body, stream))
+
+    def start(self) -> bytes:
+        out = [self._emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')]
+        for name, base_font in FONTS.items():
+            obj_id = self._fonts[name] = self._reserve()
+            out.append(self._object(
+                obj_id, b'<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>'
+                % base_font.encode(),
+            ))
+        return b''.join(out)
+
+    def add_page(self, page: RenderedPage) -> bytes:
+        out = []
+        xobjects = []
+        for name, image in page.images.items():
+            obj_id = self._reserve()
+            out.append(self._object(
+                obj_id,
+                b'<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceRGB '
+                b'/BitsPerComponent 8 /Filter /%s /Length %d >>'
+                % (image.width, image.height, image.filter.encode(), len(image.data)),
+                image.data,
+            ))
+            xobjects.append(b'/%s %d 0 R' % (name.encode(), obj_id))
+
+        content_id = self._reserve()
+        if self.compress:
+            data = zlib.compress(page.content)
+            out.append(self._object(content_id, b'<< /Length %d /Filter /FlateDecode >>' % len(data), data))
+        else:
+            out.append(self._object(content_id, b'<< /Length %d >>' % len(page.content), page.content))
+
+        fonts = b' '.join(b'/%s %d 0 R' % (name.encode(), obj_id) for name, obj_id in self._fonts.items())
+        page_id = self._reserve()
+        out.append(self._object(
+            page_id,
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s] '
+            b'/Resources << /Font << %s >> /XObject << %s >> >> /Contents %d 0 R >>'
+            % (self.PAGES, _num(page.size[0]).encode(), _num(page.size[1]).encode(),
+               fonts, b' '.join(xobjects), content_id),
+        ))
+        self._pages.append((page_id, page.outline_title))
+        return b''.join(out)
+
+    def _outline(self) -> Tuple[Optional[int], bytes]:
+        entries = [(page_id, title) for page_id, title in self._pages if title]
+        if not entries:
+            return None, b''
+        root_id = self._reserve()
+        ids = [self._reserve() for _ in entries]
+        out = []
+        for i, ((page_id, title), obj_id) in enumerate(zip(entries, ids)):
+            links = b''
+            if i > 0:
+                links += b' /Prev %d 0 R' % ids[i - 1]
+            if i < len(ids) - 1:
+                links += b' /Next %d 0 R' % ids[i + 1]
+            out.append(self._object(
+                obj_id,
+                b'<< /Title %s /Parent %d 0 R /Dest [%d 0 R /Fit]%s >>'
+                % (pdf_string(title), root_id, page_id, links),
+            ))
+        out.append(self._object(
+            root_id, b'<< /Type /Outlines /First %d 0 R /Last %d 0 R /Count %d >>' % (ids[0], ids[-1], len(ids)),
+        ))
+        return root_id, b''.join(out)
+
+    def finish(self) -> bytes:
+        out = []
+        kids = b' '.join(b'%d 0 R' % page_id for page_id, _ in self._pages)
+        out.append(self._object(self.PAGES, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self._pages))))
+
+        outline_id, outline = self._outline()
+        out.append(outline)
+        catalog = b'<< /Type /Catalog /Pages %d 0 R' % self.PAGES
+        if outline_id:
+            catalog += b' /Outlines %d 0 R /PageMode /UseOutlines' % outline_id
+        out.append(self._object(self.CATALOG, catalog + b' >>'))
+
+        info_id = self._reserve()
+        created = datetime.utcnow().strftime("D:%Y%m%d%H%M%SZ")
+        out.append(self._object(
+            info_id, b'<< /Title %s /Producer (Snap Journal) /CreationDate (%s) >>'
+            % (pdf_string(self.title), created.encode()),
+        ))
+
+        xref_offset = self._offset
+        size = self._next_id
+        xref = [b'xref\n0 %d\n0000000000 65535 f \n' % size]
+        for obj_id in range(1, size):
+            xref.append(b'%010d 00000 n \n' % self._offsets[obj_id])
+        out.append(self._emit(b''.join(xref)))
+        out.append(self._emit(
+            b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+            % (size, self.CATALOG, info_id, xref_offset)
+        ))
+        return b''.join(out)
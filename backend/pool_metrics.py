@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import defaultdict
+
+from pymongo import monitoring
+
+
+class _PoolStats:
+    __slots__ = (
+        "pools", "size", "in_use", "created", "closed", "checkouts", "checkout_failures",
+        "clears", "wait_total_ms", "wait_max_ms",
+    )
+
+    def __init__(self):
+        self.pools = 0
+        self.size = 0
+        self.in_use = 0
+        self.created = 0
+        self.closed = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.clears = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "size": self.size,
+            "in_use": self.in_use,
+            "available": self.size - self.in_use,
+            "connections_created": self.created,
+            "connections_closed": self.closed,
+            "checkouts": self.checkouts,
+            "checkout_failures": self.checkout_failures,
+            "pool_clears": self.clears,
+            "checkout_wait_avg_ms": round(self.wait_total_ms / self.checkouts, 3) if self.checkouts else 0.0,
+            "checkout_wait_max_ms": round(self.wait_max_ms, 3),
+        }
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Tracks connection pool size, in-use connections and checkout wait time per server.
+
+    pymongo publishes these events from whichever thread Motor's executor runs the
+    operation on, so checkout start times are kept thread-locally and the counters
+    are guarded by a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = defaultdict(_PoolStats)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {f"{host}:{port}": stats.as_dict() for (host, port), stats in self._stats.items()}
+
+    def pool_created(self, event):
+        with self._lock:
+            self._stats[event.address].pools += 1
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self._stats[event.address].clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            stats = self._stats[event.address]
+            stats.created += 1
+            stats.size += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            stats = self._stats[event.address]
+            stats.closed += 1
+            stats.size -= 1
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._local.started = None
+        with self._lock:
+            self._stats[event.address].checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        waited = (time.perf_counter() - started) * 1000 if started is not None else 0.0
+        with self._lock:
+            stats = self._stats[event.address]
+            stats.in_use += 1
+            stats.checkouts += 1
+            stats.wait_total_ms += waited
+            stats.wait_max_ms = max(stats.wait_max_ms, waited)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._stats[event.address].in_use -= 1
@@ -0,0 +1,51 @@
+import asyncio
+import multiprocessing
+import os
+import resource
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+
+class LazyProcessPool:
+    """A ProcessPoolExecutor that is created on first use and replaced if a worker dies.
+
+    Workers are started with spawn rather than fork: the parent has a running event
+    loop and driver threads that must not be duplicated into the children.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed on a huge input); start a fresh pool for later calls
+            self._executor = None
+            raise
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+def cpu_share(web_concurrency: int) -> int:
+    """Default pool size for one of `web_concurrency` server processes, so their pools together use each CPU once."""
+    return max(1, (os.cpu_count() or 1) // max(1, web_concurrency))
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of the calling process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
@@ -0,0 +1,214 @@
+"""Response cache for read endpoints: an ASGI middleware in front of selected GET routes
+plus a pluggable storage backend.
+
+Entries are keyed by path and normalised query string and are tagged with the
+collections they were read from. Writers call `invalidate(tag)`, which bumps the
+tag's generation; keys embed the current generations, so stale entries are never
+served again and simply age out of the LRU.
+"""
+import importlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from conditional import etag_matches
+from metrics import gauge_lines, registry
+
+
+cache_requests = registry.counter(
+    'response_cache_requests_total', 'Cacheable requests by outcome.', ('route', 'result'))
+
+# (status, headers, body)
+CachedResponse = Tuple[int, List[Tuple[bytes, bytes]], bytes]
+
+UNCACHED_HEADERS = {b'set-cookie', b'content-length'}
+
+
+class CacheBackend:
+    """Where cached responses and tag generations live.
+
+    The in-process MemoryBackend is private to one worker. A backend over a
+    store shared by all workers on a host makes invalidations visible to every
+    worker instead of only the one that handled the write.
+    """
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: CachedResponse, ttl: float):
+        raise NotImplementedError
+
+    async def generation(self, tag: str) -> int:
+        raise NotImplementedError
+
+    async def bump(self, tag: str):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryBackend(CacheBackend):
+    """Bounded LRU dict with a per-entry expiry time."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[float, CachedResponse]]' = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: CachedResponse, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def generation(self, tag: str) -> int:
+        return self._generations.get(tag, 0)
+
+    async def bump(self, tag: str):
+        self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'bytes': sum(len(value[2]) for _, value in self._entries.values()),
+            'evictions': self.evictions,
+        }
+
+
+def load_backend(spec: str, max_entries: int) -> CacheBackend:
+    """`memory`, or `module:factory` naming a callable that returns a CacheBackend."""
+    if spec == 'memory':
+        return MemoryBackend(max_entries)
+    module_name, _, attr = spec.partition(':')
+    return getattr(importlib.import_module(module_name), attr)()
+
+
+@dataclass
+class CacheRule:
+    ttl: float
+    tags: Sequence[str] = ()
+    route: object = field(default=None, repr=False)
+
+
+class ResponseCache:
+    def __init__(self, backend: CacheBackend, max_body_bytes: int = 1024 * 1024):
+        self.backend = backend
+        self.max_body_bytes = max_body_bytes
+        self.rules: Dict[str, CacheRule] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def cache(self, path: str, ttl: float, tags: Sequence[str] = ()):
+        self.rules[path] = CacheRule(ttl=ttl, tags=tuple(tags))
+
+    async def invalidate(self, tag: str):
+        await self.backend.bump(tag)
+
+    async def key(self, path: str, query_string: bytes, rule: CacheRule) -> str:
+        query = urlencode(sorted(parse_qsl(query_string.decode('latin-1'), keep_blank_values=True)))
+        generations = [f'{tag}={await self.backend.generation(tag)}' for tag in rule.tags]
+        return f"{path}?{query}#{','.join(generations)}"
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            'routes': {path: {'ttl': rule.ttl, 'tags': list(rule.tags)} for path, rule in self.rules.items()},
+            **self.backend.stats(),
+        }
+
+    def collect_metrics(self):
+        stats = self.backend.stats()
+        for name, doc in (('entries', 'Responses held in the cache.'), ('bytes', 'Body bytes held in the cache.')):
+            if name in stats:
+                yield from gauge_lines(f'response_cache_{name}', doc, [({}, stats[name])])
+
+
+class ResponseCacheMiddleware:
+    """Serves repeated GETs of the configured routes from the cache.
+
+    Only complete 200 responses up to `max_body_bytes` are stored. A request
+    with `Cache-Control: no-cache` skips the lookup but refreshes the entry, and
+    a hit whose ETag matches If-None-Match is answered with 304.
+    Responses carry `X-Cache: HIT` or `X-Cache: MISS`.
+    """
+
+    def __init__(self, app, cache: ResponseCache):
+        self.app = app
+        self.cache = cache
+
+    async def __call__(self, scope, receive, send):
+        rule = self.cache.rules.get(scope['path']) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        key = await self.cache.key(scope['path'], scope['query_string'], rule)
+        no_cache = any(name == b'cache-control' and b'no-cache' in value for name, value in scope['headers'])
+        cached = None if no_cache else await self.cache.backend.get(key)
+        if cached is not None:
+            self.cache.hits += 1
+            cache_requests.inc(scope['path'], 'hit')
+            if rule.route is not None:
+                scope['route'] = rule.route  # keeps the request metrics labelled by route
+            status, headers, body = cached
+            etag = next((v.decode('latin-1') for k, v in headers if k.lower() == b'etag'), None)
+            if_none_match = next((v.decode('latin-1') for k, v in scope['headers'] if k == b'if-none-match'), None)
+            if etag is not None and etag_matches(if_none_match, etag):
+                await send({'type': 'http.response.start', 'status': 304, 'headers': [
+                    (k, v) for k, v in headers if k.lower() in (b'etag', b'cache-control')
+                ] + [(b'x-cache', b'HIT')]})
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+            await send({'type': 'http.response.start', 'status': status, 'headers': [
+                *headers, (b'content-length', str(len(body)).encode()), (b'x-cache', b'HIT'),
+            ]})
+            await send({'type': 'http.response.body', 'body': body})
+            return
+
+        self.cache.misses += 1
+        cache_requests.inc(scope['path'], 'miss')
+        start: dict = {}
+        chunks: List[bytes] = []
+        size = 0
+        storable = True
+
+        async def send_wrapper(message):
+            nonlocal size, storable
+            if message['type'] == 'http.response.start':
+                start.update(message)
+                storable = message['status'] == 200
+                message = {**message, 'headers': [*message.get('headers', []), (b'x-cache', b'MISS')]}
+            elif message['type'] == 'http.response.body' and storable:
+                size += len(message.get('body', b''))
+                if size > self.cache.max_body_bytes:
+                    storable = False
+                    chunks.clear()
+                else:
+                    chunks.append(message.get('body', b''))
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+        rule.route = scope.get('route', rule.route)
+        if storable and start:
+            headers = [(k, v) for k, v in start.get('headers', []) if k.lower() not in UNCACHED_HEADERS]
+            await self.cache.backend.set(key, (start['status'], headers, b''.join(chunks)), rule.ttl)
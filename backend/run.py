@@ -0,0 +1,277 @@
+"""Production entry point: runs the API in several uvicorn worker processes.
+
+    cd backend
+    python run.py --workers 4 --port 8001
+
+The supervisor binds the listening socket once and starts the workers with
+spawn; each worker imports server and builds its own app with create_app, so
+the Motor client and its connection pool are created inside the worker.
+
+Signals sent to the supervisor:
+
+SIGTERM, SIGINT  stop accepting connections, let the workers finish in-flight
+                 requests (at most --graceful-timeout seconds) and exit
+SIGHUP           graceful reload: start a fresh set of workers, and once they
+                 are serving, drain and stop the old ones
+
+Every --report-interval seconds the supervisor logs each worker's RSS and
+request rate. Workers that die unexpectedly are replaced.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import typer
+import uvicorn
+from uvicorn.importer import import_from_string
+
+
+logger = logging.getLogger('run')
+
+cli = typer.Typer(add_completion=False)
+
+
+def best_loop() -> str:
+    try:
+        import uvloop  # noqa: F401
+        return 'uvloop'
+    except ImportError:
+        return 'asyncio'
+
+def best_http() -> str:
+    try:
+        import httptools  # noqa: F401
+        return 'httptools'
+    except ImportError:
+        return 'h11'
+
+def rss_bytes(pid: int) -> Optional[int]:
+    """Current resident set size of `pid`, where /proc is available."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class RequestCounter:
+    """Counts HTTP requests into a counter shared with the supervisor."""
+
+    def __init__(self, app, requests):
+        self.app = app
+        self.requests = requests
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            self.requests.value += 1
+        await self.app(scope, receive, send)
+
+
+class WorkerServer(uvicorn.Server):
+    """A uvicorn server that tells the supervisor when it is accepting requests."""
+
+    def __init__(self, config: uvicorn.Config, ready):
+        super().__init__(config)
+        self.ready = ready
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if not self.should_exit:
+            self.ready.value = 1
+
+
+def run_worker(app: str, options: dict, sock: socket.socket, requests, ready):
+    def app_factory():
+        return RequestCounter(import_from_string(app)(), requests)
+
+    config = uvicorn.Config(app_factory, factory=True, **options)
+    WorkerServer(config, ready).run(sockets=[sock])
+
+
+@dataclass
+class Worker:
+    process: multiprocessing.Process
+    requests: object
+    ready: object
+    started_at: float = field(default_factory=time.monotonic)
+    draining: bool = False
+    reported_requests: int = 0
+    reported_at: float = field(default_factory=time.monotonic)
+
+
+class Supervisor:
+    def __init__(self, app: str, sock: socket.socket, workers: int, options: dict, graceful_timeout: int,
+                 report_interval: float):
+        self.app = app
+        self.sock = sock
+        self.count = workers
+        self.options = options
+        self.graceful_timeout = graceful_timeout
+        self.report_interval = report_interval
+        self.context = multiprocessing.get_context('spawn')
+        self.workers: List[Worker] = []
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.reloading = False
+        self.exit_code = 0
+
+    def spawn(self) -> Worker:
+        requests = self.context.RawValue('Q', 0)
+        ready = self.context.RawValue('b', 0)
+        process = self.context.Process(
+            target=run_worker, args=(self.app, self.options, self.sock, requests, ready), name='api-worker',
+        )
+        process.start()
+        logger.info("Started worker %d", process.pid)
+        return Worker(process, requests, ready)
+
+    def drain(self, worker: Worker):
+        worker.draining = True
+        if worker.process.is_alive():
+            os.kill(worker.process.pid, signal.SIGTERM)
+
+    def handle_signal(self, sig, frame):
+        if sig == signal.SIGHUP:
+            self.reloading = True
+        else:
+            self.stopping = True
+        self.wakeup.set()
+
+    def run(self) -> int:
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, self.handle_signal)
+        self.workers = [self.spawn() for _ in range(self.count)]
+        next_report = time.monotonic() + self.report_interval
+
+        while not self.stopping:
+            self.wakeup.wait(0.5)
+            self.wakeup.clear()
+            if self.reloading:
+                self.reloading = False
+                self.reload()
+            self.reap()
+            if time.monotonic() >= next_report:
+                self.report()
+                next_report = time.monotonic() + self.report_interval
+
+        logger.info("Stopping %d worker(s), waiting up to %ds for in-flight requests",
+                    len(self.workers), self.graceful_timeout)
+        for worker in self.workers:
+            self.drain(worker)
+        self.join(self.workers, self.graceful_timeout + 5)
+        self.sock.close()
+        return self.exit_code
+
+    def reload(self):
+        """Start a new generation of workers and retire the current one once it is serving."""
+        old = [w for w in self.workers if not w.draining]
+        new = [self.spawn() for _ in range(self.count)]
+        self.workers += new
+        deadline = time.monotonic() + 60
+        while not all(w.ready.value for w in new):
+            if self.stopping or time.monotonic() > deadline or any(not w.process.is_alive() for w in new):
+                logger.error("New workers failed to start; keeping the current ones")
+                for worker in new:
+                    self.drain(worker)
+                return
+            time.sleep(0.1)
+        logger.info("Reloaded: %d new worker(s) serving, draining %d old one(s)", len(new), len(old))
+        for worker in old:
+            self.drain(worker)
+
+    def reap(self):
+        """Forget exited workers and replace those that were not asked to stop."""
+        for worker in list(self.workers):
+            if worker.process.is_alive():
+                continue
+            worker.process.join()
+            self.workers.remove(worker)
+            if worker.draining or self.stopping:
+                continue
+            if not worker.ready.value:
+                # Like a failed boot under gunicorn: respawning would fail the same way
+                logger.error("Worker %d failed to start (exit code %s); shutting down",
+                             worker.process.pid, worker.process.exitcode)
+                self.stopping = True
+                self.exit_code = 1
+            else:
+                logger.warning("Worker %d exited with code %s; starting a replacement",
+                               worker.process.pid, worker.process.exitcode)
+                self.workers.append(self.spawn())
+
+    def join(self, workers: List[Worker], timeout: float):
+        deadline = time.monotonic() + timeout
+        for worker in workers:
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                logger.warning("Worker %d did not stop in time; killing it", worker.process.pid)
+                worker.process.kill()
+                worker.process.join()
+
+    def report(self):
+        now = time.monotonic()
+        total_rss, total_rate = 0, 0.0
+        for worker in self.workers:
+            requests = worker.requests.value
+            rate = (requests - worker.reported_requests) / max(now - worker.reported_at, 1e-9)
+            worker.reported_requests, worker.reported_at = requests, now
+            rss = rss_bytes(worker.process.pid)
+            total_rss += rss or 0
+            total_rate += rate
+            logger.info("worker %d%s: rss %s, %.1f req/s, %d requests, up %.0fs",
+                        worker.process.pid, ' (draining)' if worker.draining else '',
+                        f'{rss / 2**20:.1f} MiB' if rss is not None else 'n/a',
+                        rate, requests, now - worker.started_at)
+        logger.info("%d worker(s): rss %.1f MiB, %.1f req/s", len(self.workers), total_rss / 2**20, total_rate)
+
+
+@cli.command()
+def serve(
+    app: str = typer.Option('server:create_app', help="module:callable returning the ASGI app, called in each worker"),
+    host: str = typer.Option('0.0.0.0', help="Interface to bind"),
+    port: int = typer.Option(8001, help="Port to bind"),
+    workers: int = typer.Option(os.cpu_count() or 1, help="Worker processes"),
+    loop: str = typer.Option('auto', help="auto (uvloop when installed), uvloop or asyncio"),
+    http: str = typer.Option('auto', help="auto (httptools when installed), httptools or h11"),
+    backlog: int = typer.Option(2048, help="Listen backlog of the shared socket"),
+    keep_alive: int = typer.Option(5, help="Seconds an idle keep-alive connection is held open"),
+    graceful_timeout: int = typer.Option(30, help="Seconds to wait for in-flight requests on shutdown"),
+    limit_concurrency: Optional[int] = typer.Option(None, help="Per-worker connection limit before answering 503"),
+    report_interval: float = typer.Option(30.0, help="Seconds between worker resource reports"),
+    proxy_headers: bool = typer.Option(True, help="Trust X-Forwarded-* headers from --forwarded-allow-ips"),
+    forwarded_allow_ips: str = typer.Option('127.0.0.1'),
+    log_level: str = typer.Option('info'),
+):
+    """Serve the API with a supervised pool of uvicorn workers."""
+    logging.basicConfig(level=log_level.upper(), format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    options = {
+        'loop': best_loop() if loop == 'auto' else loop,
+        'http': best_http() if http == 'auto' else http,
+        'backlog': backlog,
+        'timeout_keep_alive': keep_alive,
+        'timeout_graceful_shutdown': graceful_timeout,
+        'limit_concurrency': limit_concurrency,
+        'proxy_headers': proxy_headers,
+        'forwarded_allow_ips': forwarded_allow_ips,
+        'log_level': log_level,
+        'lifespan': 'on',
+    }
+    # Workers inherit the environment; each sizes its process pools to its share of the CPUs
+    os.environ['WEB_CONCURRENCY'] = str(workers)
+    sock = uvicorn.Config(app, host=host, port=port, backlog=backlog).bind_socket()
+    logger.info("Listening on %s:%d with %d worker(s), loop=%s, http=%s, backlog=%d, keep-alive=%ds",
+                host, port, workers, options['loop'], options['http'], backlog, keep_alive)
+    raise typer.Exit(Supervisor(app, sock, workers, options, graceful_timeout, report_interval).run())
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,428 @@
+import logging
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from pymongo.errors import DuplicateKeyError
+
+import annotation_store
+from blob_store import BlobTooLarge, ChunkedBlobStore
+from conditional import make_etag, not_modified
+from image_pipeline import ImagePipeline
+from process_pool import cpu_share
+from similarity import SimilarityIndex, to_signed
+import sync_log
+
+
+logger = logging.getLogger(__name__)
+
+
+UPLOAD_READ_SIZE = 64 * 1024
+
+router = APIRouter(prefix="/screenshots", tags=["screenshots"])
+
+
+class ImageVariant(BaseModel):
+    blob_id: str
+    content_type: str
+    length: int
+    sha256: str
+    width: int
+    height: int
+
+
+class Screenshot(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    session_id: Optional[str] = None
+    title: Optional[str] = None
+    url: Optional[str] = None
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    content_type: str
+    length: int
+    sha256: str
+    blob_id: str
+    annotations: List[dict] = []
+    variants: Optional[Dict[str, ImageVariant]] = None
+    dhash: Optional[int] = None
+    version: int = 1
+    seq: int = 0
+
+
+class SimilarScreenshot(BaseModel):
+    id: str
+    distance: int
+    session_id: Optional[str] = None
+    title: Optional[str] = None
+    url: Optional[str] = None
+    timestamp: Optional[datetime] = None
+
+
+def get_state(request: Request):
+    return request.app.state
+
+def get_db(request: Request):
+    return request.app.state.db
+
+def get_settings(request: Request):
+    return request.app.state.settings
+
+def get_blob_store(db=Depends(get_db)) -> ChunkedBlobStore:
+    return ChunkedBlobStore(db, prefix='screenshot_blobs')
+
+async def ensure_indexes(db):
+    await db.screenshots.create_index('id', unique=True)
+    await db.screenshots.create_index([('session_id', 1), ('timestamp', 1)])
+    await db.screenshots.create_index('blob_id')
+    await ChunkedBlobStore(db, prefix='screenshot_blobs').ensure_indexes()
+    await sync_log.ensure_indexes(db)
+    await annotation_store.ensure_indexes(db)
+
+def startup(state):
+    settings = state.settings
+    state.image_pipeline = ImagePipeline(
+        workers=settings.image_workers or cpu_share(settings.web_concurrency), formats=settings.image_variant_formats,
+        sizes=settings.image_thumbnail_sizes, quality=settings.image_quality,
+    )
+    state.similarity_index = SimilarityIndex()
+
+def shutdown(state):
+    state.image_pipeline.shutdown()
+
+
+def parse_range(header: Optional[str], length: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range `Range: bytes=...` header into an inclusive (start, end).
+
+    Returns None when the header is absent or not a single byte range, in which case
+    the full body is served. Raises 416 for a range that cannot be satisfied.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start_s, _, end_s = header[len('bytes='):].strip().partition('-')
+    try:
+        if start_s:
+            start = int(start_s)
+            end = int(end_s) if end_s else length - 1
+        else:
+            suffix = int(end_s)
+            if suffix == 0:
+                raise ValueError
+            start, end = max(length - suffix, 0), length - 1
+    except ValueError:
+        return None
+    if start >= length or start > end:
+        raise HTTPException(status_code=416, headers={'Content-Range': f'bytes */{length}'})
+    return start, min(end, length - 1)
+
+def etag_for(blob: dict) -> str:
+    return f'"{blob["sha256"]}"'
+
+def serve_blob(request: Request, store: ChunkedBlobStore, blob: dict, content_type: str):
+    """Stream a stored blob, honouring Range, If-Range and If-None-Match."""
+    etag = etag_for(blob)
+    headers = {'ETag': etag, 'Accept-Ranges': 'bytes', 'Cache-Control': 'private, max-age=86400'}
+    unchanged = not_modified(request, etag, headers)
+    if unchanged is not None:
+        return unchanged
+
+    length = blob['length']
+    byte_range = None
+    if request.headers.get('if-range', etag) == etag:
+        byte_range = parse_range(request.headers.get('range'), length)
+
+    if byte_range is None:
+        headers['Content-Length'] = str(length)
+        return StreamingResponse(store.read_range(blob), media_type=content_type, headers=headers)
+
+    start, end = byte_range
+    headers['Content-Range'] = f'bytes {start}-{end}/{length}'
+    headers['Content-Length'] = str(end - start + 1)
+    return StreamingResponse(
+        store.read_range(blob, start, end), status_code=206, media_type=content_type, headers=headers,
+    )
+
+
+async def _single(data: bytes):
+    yield data
+
+async def generate_variants(state, store: ChunkedBlobStore, screenshot: dict) -> Optional[dict]:
+    """Transcode a screenshot into its compact variants and record them, with its dHash, on the document.
+
+    Returns the variants, or None if the image could not be decoded. If another request
+    recorded variants first, the ones rendered here are discarded.
+    """
+    if screenshot.get('variants'):
+        return screenshot['variants']
+    db = state.db
+
+    # Identical content uploaded before: reuse its variants instead of rendering again
+    twin = await db.screenshots.find_one(
+        {'blob_id': screenshot['blob_id'], 'variants': {'$ne': None}}, {'_id': 0, 'variants': 1, 'dhash': 1},
+    )
+    if twin is not None:
+        variants = {}
+        for name, variant in twin['variants'].items():
+            if await store.acquire(variant['blob_id']) is not None:
+                variants[name] = variant
+        image_hash = twin.get('dhash')
+    else:
+        blob = await store.get(screenshot['blob_id'])
+        data = await store.read_all(blob)
+        try:
+            rendered, image_hash = await state.image_pipeline.process(data)
+            image_hash = to_signed(image_hash)
+        except Exception:
+            logger.exception("Could not render variants for screenshot %s", screenshot['id'])
+            return None
+
+        variants = {}
+        for name, (encoded, content_type, width, height) in rendered.items():
+            variant_blob = await store.put(_single(encoded), content_type)
+            variants[name] = ImageVariant(
+                blob_id=variant_blob['id'], content_type=content_type, length=variant_blob['length'],
+                sha256=variant_blob['sha256'], width=width, height=height,
+            ).model_dump()
+
+    # Stamped with a sync seq so other workers' similarity indexes pick up the hash in commit order
+    async with sync_log.change(db) as stamp:
+        result = await db.screenshots.update_one(
+            {'id': screenshot['id'], 'variants': None},
+            {'$set': {'variants': variants, 'dhash': image_hash, 'dhash_at': datetime.utcnow(), **stamp}},
+        )
+    if result.modified_count == 0:
+        for variant in variants.values():
+            await store.release(variant['blob_id'])
+        doc = await db.screenshots.find_one({'id': screenshot['id']}, {'_id': 0, 'variants': 1})
+        return doc.get('variants') if doc else None
+    if image_hash is not None:
+        state.similarity_index.add(screenshot['id'], image_hash)
+    return variants
+
+
+async def cleanup_deleted_screenshot(state, store: ChunkedBlobStore, doc: dict):
+    """Release what a just-deleted screenshot document referenced and leave a sync tombstone."""
+    db = state.db
+    state.similarity_index.remove(doc['id'])
+    await annotation_store.delete_all(db, doc['id'])
+    await store.release(doc['blob_id'])
+    for variant in (doc.get('variants') or {}).values():
+        await store.release(variant['blob_id'])
+    await sync_log.record_deletion(db, 'screenshot', doc['id'], doc.get('version', 1))
+
+
+async def upload_stream(request: Request):
+    """The image bytes of an upload, from a multipart `file` part or the raw request body."""
+    content_type = request.headers.get('content-type', '')
+    if content_type.startswith('multipart/form-data'):
+        form = await request.form()
+        upload = form.get('file')
+        if upload is None or not hasattr(upload, 'read'):
+            raise HTTPException(status_code=400, detail="Multipart upload needs a 'file' part")
+
+        async def chunks():
+            while data := await upload.read(UPLOAD_READ_SIZE):
+                yield data
+
+        fields = {k: v for k, v in form.items() if isinstance(v, str)}
+        return chunks(), upload.content_type or '', fields
+    return request.stream(), content_type, {}
+
+
+class BlobQuery(BaseModel):
+    hashes: List[str] = Field(..., max_length=10000)
+
+
+class BlobPresence(BaseModel):
+    present: List[str]
+    missing: List[str]
+
+
+@router.post("/blobs/exists", response_model=BlobPresence)
+async def check_blobs(query: BlobQuery, store: ChunkedBlobStore = Depends(get_blob_store)):
+    """Which of the given SHA-256 hashes are already stored.
+
+    Clients hash a capture locally and only upload content reported missing; anything
+    present can be attached with `POST /api/screenshots?sha256=...` and no body.
+    """
+    present = set(await store.existing(set(query.hashes)))
+    return BlobPresence(present=sorted(present), missing=sorted(set(query.hashes) - present))
+
+
+@router.get("/blobs/{sha256}", status_code=204)
+async def check_blob(sha256: str, store: ChunkedBlobStore = Depends(get_blob_store)):
+    if await store.get(sha256) is None:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    return Response(status_code=204)
+
+
+@router.post("", response_model=Screenshot, status_code=201)
+async def upload_screenshot(
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    title: Optional[str] = None,
+    url: Optional[str] = None,
+    timestamp: Optional[datetime] = None,
+    sha256: Optional[str] = None,
+    state=Depends(get_state),
+    store: ChunkedBlobStore = Depends(get_blob_store),
+):
+    """Upload a screenshot as a raw image body or a multipart `file` part.
+
+    Metadata is taken from query parameters, or from form fields of a multipart upload.
+    The image is streamed into content-addressed chunk storage without being buffered
+    whole. If `sha256` names content that is already stored, the body is not read at
+    all and the screenshot references the existing blob; otherwise the upload is
+    checked against it. X-Deduplicated reports whether the content was already stored.
+    """
+    db, settings = state.db, state.settings
+    if id is not None and await db.screenshots.find_one({'id': id}, {'_id': 1}):
+        raise HTTPException(status_code=409, detail="Screenshot already exists")
+    meta = {'id': id, 'session_id': session_id, 'title': title, 'url': url, 'timestamp': timestamp}
+
+    blob = await store.acquire(sha256) if sha256 else None
+    if blob is not None:
+        blob['deduplicated'] = True
+    elif sha256 and request.headers.get('content-length', '0') == '0' and 'transfer-encoding' not in request.headers:
+        raise HTTPException(status_code=404, detail="No stored blob has this sha256; upload the content")
+    else:
+        stream, content_type, fields = await upload_stream(request)
+        content_type = content_type.split(';')[0].strip()
+        if not content_type.startswith('image/'):
+            raise HTTPException(status_code=415, detail="Screenshots must be uploaded with an image/* content type")
+        meta.update({k: v for k, v in fields.items() if k in meta})
+        try:
+            blob = await store.put(stream, content_type, max_bytes=settings.screenshot_max_bytes)
+        except BlobTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        if blob['length'] == 0 or (sha256 and blob['sha256'] != sha256):
+            await store.release(blob['id'])
+            raise HTTPException(status_code=400, detail="Empty upload" if blob['length'] == 0 else
+                                "Uploaded content does not match the sha256 parameter")
+
+    meta = {k: v for k, v in meta.items() if v is not None}
+    screenshot = Screenshot(
+        **meta, content_type=blob['content_type'], length=blob['length'], sha256=blob['sha256'], blob_id=blob['id'],
+    )
+    try:
+        async with sync_log.change(db) as stamp:
+            screenshot.seq = stamp['seq']
+            await db.screenshots.insert_one(screenshot.model_dump())
+    except DuplicateKeyError:
+        await store.release(blob['id'])
+        raise HTTPException(status_code=409, detail="Screenshot already exists")
+    await sync_log.clear_deletion(db, 'screenshot', screenshot.id)
+    response.headers['X-Deduplicated'] = 'true' if blob['deduplicated'] else 'false'
+    if settings.image_variants_on_upload:
+        background_tasks.add_task(generate_variants, state, store, screenshot.model_dump())
+    return screenshot
+
+
+@router.get("/{screenshot_id}", response_model=Screenshot)
+async def get_screenshot(screenshot_id: str, request: Request, response: Response, db=Depends(get_db)):
+    """Screenshot metadata. The ETag changes with every synced edit and when variants are recorded."""
+    stamp = await db.screenshots.find_one({'id': screenshot_id}, {'_id': 0, 'seq': 1, 'dhash_at': 1})
+    if stamp is None:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    etag = make_etag('screenshot', screenshot_id, stamp.get('seq'), stamp.get('dhash_at'))
+    unchanged = not_modified(request, etag, {'Cache-Control': 'no-cache'})
+    if unchanged is not None:
+        return unchanged
+    doc = await db.screenshots.find_one({'id': screenshot_id}, {'_id': 0})
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    await annotation_store.hydrate(db, [doc])
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return doc
+
+
+@router.get("/{screenshot_id}/image")
+async def get_screenshot_image(
+    screenshot_id: str,
+    request: Request,
+    db=Depends(get_db),
+    store: ChunkedBlobStore = Depends(get_blob_store),
+):
+    doc = await db.screenshots.find_one({'id': screenshot_id}, {'_id': 0, 'blob_id': 1})
+    blob = await store.get(doc['blob_id']) if doc else None
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    return serve_blob(request, store, blob, blob['content_type'])
+
+
+@router.get("/{screenshot_id}/variants", response_model=Dict[str, ImageVariant])
+async def list_screenshot_variants(
+    screenshot_id: str,
+    state=Depends(get_state),
+    store: ChunkedBlobStore = Depends(get_blob_store),
+):
+    """Transcoded variants of a screenshot, rendering them first if they are not cached yet."""
+    doc = await state.db.screenshots.find_one({'id': screenshot_id}, {'_id': 0})
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    variants = await generate_variants(state, store, doc)
+    if variants is None:
+        raise HTTPException(status_code=422, detail="Screenshot image could not be decoded")
+    return variants
+
+
+@router.get("/{screenshot_id}/variants/{name}")
+async def get_screenshot_variant(
+    screenshot_id: str,
+    name: str,
+    request: Request,
+    state=Depends(get_state),
+    store: ChunkedBlobStore = Depends(get_blob_store),
+):
+    """Stream one variant, e.g. thumb160.webp, rendering the variants on first access."""
+    doc = await state.db.screenshots.find_one({'id': screenshot_id}, {'_id': 0})
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    variants = await generate_variants(state, store, doc) or {}
+    variant = variants.get(name)
+    blob = await store.get(variant['blob_id']) if variant else None
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Variant not found")
+    return serve_blob(request, store, blob, variant['content_type'])
+
+
+@router.get("/{screenshot_id}/similar", response_model=List[SimilarScreenshot])
+async def get_similar_screenshots(
+    screenshot_id: str,
+    max_distance: Optional[int] = Query(None, alias="maxDistance", ge=0, le=64),
+    limit: int = Query(20, ge=1, le=500),
+    state=Depends(get_state),
+    store: ChunkedBlobStore = Depends(get_blob_store),
+):
+    """Screenshots whose perceptual hash is within `maxDistance` bits of this one, closest first."""
+    db = state.db
+    if max_distance is None:
+        max_distance = state.settings.similar_default_distance
+    doc = await db.screenshots.find_one({'id': screenshot_id}, {'_id': 0})
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    if doc.get('dhash') is None:
+        await generate_variants(state, store, doc)
+        doc = await db.screenshots.find_one({'id': screenshot_id}, {'_id': 0, 'dhash': 1})
+        if doc is None or doc.get('dhash') is None:
+            raise HTTPException(status_code=422, detail="Screenshot image could not be decoded")
+    matches = await state.similarity_index.similar(db, screenshot_id, doc['dhash'], max_distance, limit)
+    return [SimilarScreenshot(**match, distance=distance) for match, distance in matches]
+
+
+@router.delete("/{screenshot_id}", status_code=204)
+async def delete_screenshot(
+    screenshot_id: str,
+    state=Depends(get_state),
+    store: ChunkedBlobStore = Depends(get_blob_store),
+):
+    doc = await state.db.screenshots.find_one_and_delete({'id': screenshot_id}, {'_id': 0})
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    await cleanup_deleted_screenshot(state, store, doc)
+    return Response(status_code=204)
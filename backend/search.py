@@ -0,0 +1,367 @@
+"""Full-text search over screenshot titles, URLs, annotation text and session names.
+
+Each worker keeps an inverted index in memory: term -> screenshot -> weighted
+term frequency, plus a sorted term list for prefix lookups. Session names are
+indexed per session and count for every screenshot in it, so renaming a
+session touches one entry. Results are ranked with BM25 over the weighted
+frequencies; every query term may match as a prefix, scoring below an exact
+match, and all terms must match.
+
+Before each query the index catches up on what changed since it last looked,
+through the sync sequence that every screenshot, session and tombstone write
+is stamped with, up to the committed mark (see sync_log).
+"""
+import asyncio
+import bisect
+import heapq
+import math
+import re
+import time
+import unicodedata
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel
+
+import annotation_store
+from metrics import gauge_lines
+from screenshots import get_state
+import sync_log
+
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+FIELD_WEIGHTS = {'title': 3.0, 'session': 2.0, 'url': 1.5, 'annotations': 1.0}
+# Session documents are free-form; these are the fields taken as their name
+SESSION_NAME_FIELDS = ('name', 'title')
+URL_STOPWORDS = {'http', 'https', 'www'}
+MAX_QUERY_TERMS = 8
+PREFIX_WEIGHT = 0.5
+BM25_K1 = 1.2
+BM25_B = 0.75
+REFRESH_BATCH = 500
+
+SCREENSHOT_FIELDS = {'_id': 0, 'id': 1, 'session_id': 1, 'title': 1, 'url': 1, 'timestamp': 1,
+                     'annotations': 1, 'annotations_split': 1, 'seq': 1}
+SESSION_FIELDS = {'_id': 0, 'id': 1, 'seq': 1, **{f: 1 for f in SESSION_NAME_FIELDS}}
+
+TOKEN = re.compile(r'\w+')
+
+
+def tokenize(text) -> List[str]:
+    """Lower-cased words of `text` with accents removed, so "Résumé" matches "resume"."""
+    if not isinstance(text, str):
+        return []
+    if text.isascii():
+        return TOKEN.findall(text.lower())
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return TOKEN.findall(''.join(c for c in text if not unicodedata.combining(c)))
+
+def weighted_terms(fields: List[Tuple[str, str]]) -> Dict[str, float]:
+    terms: Dict[str, float] = defaultdict(float)
+    for field, text in fields:
+        for token in tokenize(text):
+            if field != 'url' or token not in URL_STOPWORDS:
+                terms[token] += FIELD_WEIGHTS[field]
+    return terms
+
+def screenshot_terms(doc: dict) -> Dict[str, float]:
+    fields = [('title', doc.get('title')), ('url', doc.get('url'))]
+    fields += [('annotations', a.get('text')) for a in doc.get('annotations') or [] if isinstance(a, dict)]
+    return weighted_terms(fields)
+
+def session_terms(doc: dict) -> Dict[str, float]:
+    return weighted_terms([('session', doc.get(field)) for field in SESSION_NAME_FIELDS])
+
+
+class Entry:
+    """What the index holds for one screenshot: its terms, for removal, and the fields a result shows."""
+    __slots__ = ('terms', 'length', 'session_id', 'title', 'url', 'timestamp', 'order')
+
+    def __init__(self, doc: dict, terms: Dict[str, float]):
+        self.terms = terms
+        self.length = sum(terms.values())
+        self.session_id = doc.get('session_id')
+        self.title = doc.get('title')
+        self.url = doc.get('url')
+        self.timestamp = doc.get('timestamp')
+        self.order = self.timestamp.timestamp() if isinstance(self.timestamp, datetime) else 0.0
+
+
+class SearchIndex:
+    def __init__(self, min_prefix_length: int = 2, max_prefix_terms: int = 256):
+        self.min_prefix_length = min_prefix_length
+        self.max_prefix_terms = max_prefix_terms
+        self._lock = asyncio.Lock()
+        self._reset(None)
+
+    def _reset(self, db):
+        self._db = db
+        self.entries: Dict[str, Entry] = {}
+        self.sessions: Dict[str, Dict[str, float]] = {}
+        self.members: Dict[str, Set[str]] = defaultdict(set)
+        self.postings: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self.session_postings: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self.total_length = 0.0
+        self._terms: List[str] = []
+        self._new_terms: List[str] = []
+        self._stale_terms = 0
+        self.seq = 0
+        self.refresh_seconds = 0.0
+
+    # Maintenance
+
+    def _add_postings(self, postings: Dict[str, Dict[str, float]], key: str, terms: Dict[str, float]):
+        for term, weight in terms.items():
+            if term not in self.postings and term not in self.session_postings:
+                self._new_terms.append(term)
+            postings[term][key] = weight
+
+    def _remove_postings(self, postings: Dict[str, Dict[str, float]], key: str, terms: Dict[str, float]):
+        for term in terms:
+            posting = postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(key, None)
+            if not posting:
+                del postings[term]
+                self._stale_terms += 1
+
+    def put_screenshot(self, doc: dict):
+        self.remove_screenshot(doc['id'])
+        entry = Entry(doc, screenshot_terms(doc))
+        self.entries[doc['id']] = entry
+        self.total_length += entry.length
+        self._add_postings(self.postings, doc['id'], entry.terms)
+        if entry.session_id is not None:
+            self.members[entry.session_id].add(doc['id'])
+
+    def remove_screenshot(self, screenshot_id: str):
+        entry = self.entries.pop(screenshot_id, None)
+        if entry is None:
+            return
+        self.total_length -= entry.length
+        self._remove_postings(self.postings, screenshot_id, entry.terms)
+        members = self.members.get(entry.session_id)
+        if members is not None:
+            members.discard(screenshot_id)
+            if not members:
+                del self.members[entry.session_id]
+
+    def put_session(self, doc: dict):
+        self.remove_session(doc['id'])
+        terms = session_terms(doc)
+        self.sessions[doc['id']] = terms
+        self._add_postings(self.session_postings, doc['id'], terms)
+
+    def remove_session(self, session_id: str):
+        terms = self.sessions.pop(session_id, None)
+        if terms is not None:
+            self._remove_postings(self.session_postings, session_id, terms)
+
+    async def refresh(self, db):
+        """Catch up on screenshots, sessions and deletions written since the last refresh."""
+        async with self._lock:
+            if db is not self._db:
+                self._reset(db)
+            committed = await sync_log.committed_seq(db)
+            if committed <= self.seq:
+                return
+            started = time.perf_counter()
+            query = {'seq': {'$gt': self.seq, '$lte': committed}}
+
+            changes: List[Tuple[int, str, dict]] = []
+            batch: List[dict] = []
+            async for doc in db.screenshots.find(query, SCREENSHOT_FIELDS).batch_size(REFRESH_BATCH):
+                batch.append(doc)
+                if len(batch) == REFRESH_BATCH:
+                    await annotation_store.hydrate(db, batch)
+                    changes += [(d['seq'], 'screenshot', d) for d in batch]
+                    batch = []
+            await annotation_store.hydrate(db, batch)
+            changes += [(d['seq'], 'screenshot', d) for d in batch]
+            async for doc in db.sessions.find(query, SESSION_FIELDS):
+                changes.append((doc['seq'], 'session', doc))
+            async for doc in db.sync_tombstones.find(query, {'_id': 0, 'kind': 1, 'id': 1, 'seq': 1}):
+                changes.append((doc['seq'], 'tombstone', doc))
+
+            # Applied in sequence order, so a record deleted and created again ends up in the state written last
+            changes.sort(key=lambda change: change[0])
+            for _, kind, doc in changes:
+                if kind == 'screenshot':
+                    self.put_screenshot(doc)
+                elif kind == 'session':
+                    self.put_session(doc)
+                elif doc['kind'] == 'screenshot':
+                    self.remove_screenshot(doc['id'])
+                else:
+                    self.remove_session(doc['id'])
+
+            self.seq = committed
+            self.refresh_seconds = time.perf_counter() - started
+
+    # Queries
+
+    def _sorted_terms(self) -> List[str]:
+        if self._stale_terms > len(self._terms) // 2:
+            self._terms = sorted(set(self.postings) | set(self.session_postings))
+            self._new_terms, self._stale_terms = [], 0
+        elif len(self._new_terms) > 1000:
+            self._terms = sorted(set(self._terms).union(self._new_terms))
+            self._new_terms = []
+        elif self._new_terms:
+            for term in self._new_terms:
+                i = bisect.bisect_left(self._terms, term)
+                if i == len(self._terms) or self._terms[i] != term:
+                    self._terms.insert(i, term)
+            self._new_terms = []
+        return self._terms
+
+    def _matching_terms(self, token: str) -> List[str]:
+        if len(token) < self.min_prefix_length:
+            return [token]
+        terms = self._sorted_terms()
+        matches = []
+        for i in range(bisect.bisect_left(terms, token), len(terms)):
+            if not terms[i].startswith(token):
+                break
+            matches.append(terms[i])
+        if len(matches) > self.max_prefix_terms:
+            # Keep the exact term and the most common completions
+            matches = heapq.nlargest(self.max_prefix_terms, matches, key=lambda t: (t == token, self._frequency(t)))
+        return matches
+
+    def _frequency(self, term: str) -> int:
+        return len(self.postings.get(term, ())) + sum(
+            len(self.members.get(s, ())) for s in self.session_postings.get(term, ()))
+
+    def _term_postings(self, term: str) -> Dict[str, float]:
+        postings = self.postings.get(term, {})
+        sessions = self.session_postings.get(term)
+        if not sessions:
+            return postings
+        postings = dict(postings)
+        for session_id, weight in sessions.items():
+            for screenshot_id in self.members.get(session_id, ()):
+                postings[screenshot_id] = postings.get(screenshot_id, 0.0) + weight
+        return postings
+
+    def _token_scores(self, token: str) -> Dict[str, float]:
+        """BM25 score of each screenshot for its best term starting with `token`."""
+        count = len(self.entries) or 1
+        average = self.total_length / count or 1.0
+        scores: Dict[str, float] = {}
+        for term in self._matching_terms(token):
+            postings = self._term_postings(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            factor = idf * (BM25_K1 + 1) * (1.0 if term == token else PREFIX_WEIGHT)
+            for screenshot_id, tf in postings.items():
+                entry = self.entries.get(screenshot_id)
+                if entry is None:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * entry.length / average)
+                score = factor * tf / (tf + norm)
+                if score > scores.get(screenshot_id, 0.0):
+                    scores[screenshot_id] = score
+        return scores
+
+    def search(self, query: str, session_id: Optional[str] = None) -> List[Tuple[str, float]]:
+        """(screenshot id, score) of every screenshot matching all words of `query`, best first."""
+        tokens = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        if not tokens:
+            return []
+        total: Optional[Dict[str, float]] = None
+        for token in tokens:
+            scores = self._token_scores(token)
+            if total is None:
+                total = scores
+            else:
+                total = {i: s + scores[i] for i, s in total.items() if i in scores}
+            if not total:
+                return []
+        if session_id is not None:
+            total = {i: s for i, s in total.items() if self.entries[i].session_id == session_id}
+        # Ties, common with single-word queries, go to the newest capture
+        return sorted(total.items(), key=lambda hit: (-hit[1], -self.entries[hit[0]].order, hit[0]))
+
+    def stats(self) -> dict:
+        return {'screenshots': len(self.entries), 'sessions': len(self.sessions),
+                'terms': len(set(self.postings) | set(self.session_postings)), 'seq': self.seq}
+
+
+class SearchHit(BaseModel):
+    id: str
+    score: float
+    session_id: Optional[str] = None
+    title: Optional[str] = None
+    url: Optional[str] = None
+    timestamp: Optional[datetime] = None
+
+
+class SearchResults(BaseModel):
+    total: int
+    results: List[SearchHit]
+    next_offset: Optional[int] = None
+
+
+def collect_metrics(state):
+    index = state.search_index
+    stats = index.stats()
+    for field, doc in (
+        ('screenshots', 'Screenshots in the search index.'),
+        ('terms', 'Distinct terms in the search index.'),
+    ):
+        yield from gauge_lines(f'search_index_{field}', doc, [({}, stats[field])])
+    yield from gauge_lines('search_index_refresh_seconds', 'Duration of the last search index refresh.',
+                           [({}, index.refresh_seconds)])
+
+
+def startup(state):
+    settings = state.settings
+    state.search_index = SearchIndex(settings.search_min_prefix_length, settings.search_max_prefix_terms)
+    # Build the index in the background so the worker starts serving without waiting for it;
+    # a search arriving first waits for the build to finish
+    state.search_warmup = asyncio.get_running_loop().create_task(state.search_index.refresh(state.db))
+
+async def shutdown(state):
+    warmup = state.search_warmup
+    if not warmup.done():
+        warmup.cancel()
+        try:
+            await warmup
+        except asyncio.CancelledError:
+            pass
+
+
+@router.get("", response_model=SearchResults, response_model_exclude_none=True)
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    session_id: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, description="Page size; defaults to SEARCH_DEFAULT_LIMIT, at most SEARCH_MAX_LIMIT"),
+    state=Depends(get_state),
+):
+    """Screenshots whose title, URL, annotation text or session name contain every word of `q`.
+
+    Words match as prefixes, so the query can be sent as the user types.
+    Results are ranked by relevance, then newest first; fetch further pages
+    with `next_offset`.
+    """
+    settings, index = state.settings, state.search_index
+    limit = limit or settings.search_default_limit
+    if limit > settings.search_max_limit:
+        raise HTTPException(status_code=422, detail=f"limit must be at most {settings.search_max_limit}")
+    await index.refresh(state.db)
+    hits = index.search(q, session_id)
+    page = hits[offset:offset + limit]
+    results = []
+    for screenshot_id, score in page:
+        entry = index.entries[screenshot_id]
+        results.append(SearchHit(id=screenshot_id, score=round(score, 4), session_id=entry.session_id,
+                                 title=entry.title, url=entry.url, timestamp=entry.timestamp))
+    next_offset = offset + limit if offset + limit < len(hits) else None
+    return SearchResults(total=len(hits), results=results, next_offset=next_offset)
@@ -1,26 +1,199 @@
-from fastapi import FastAPI, APIRouter
-from dotenv import load_dotenv
-from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-import os
-import logging
-from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List
-import uuid
-from datetime import datetime
+import time
+
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, Request  # noqa: E402
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse  # noqa: E402
+from dotenv import load_dotenv  # noqa: E402
+from starlette.middleware.cors import CORSMiddleware  # noqa: E402
+from pymongo import ASCENDING, DESCENDING  # noqa: E402
+from pymongo.errors import BulkWriteError  # noqa: E402
+import os  # noqa: E402
+import json  # noqa: E402
+import orjson  # noqa: E402
+import base64  # noqa: E402
+import functools  # noqa: E402
+import importlib  # noqa: E402
+import inspect  # noqa: E402
+import typing  # noqa: E402
+import zlib  # noqa: E402
+import logging  # noqa: E402
+from contextlib import asynccontextmanager  # noqa: E402
+from pathlib import Path  # noqa: E402
+from write_buffer import WriteBehindBuffer  # noqa: E402
+from pool_metrics import PoolMetricsListener  # noqa: E402
+from compression import CompressionMiddleware  # noqa: E402
+from conditional import collection_version, make_etag, not_modified  # noqa: E402
+from response_cache import ResponseCache, ResponseCacheMiddleware, load_backend  # noqa: E402
+from metrics import CommandMetricsListener, MetricsMiddleware, gauge_lines, registry  # noqa: E402
+from pydantic import BaseModel, Field, ValidationError  # noqa: E402
+from typing import Any, Dict, List, Optional, Tuple  # noqa: E402
+import uuid  # noqa: E402
+from datetime import datetime  # noqa: E402
 
 
 ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+logger = logging.getLogger(__name__)
+
+# Optional subsystems, imported by create_app only when enabled: feature -> features it needs.
+# Each is a module with a `router` and optionally `ensure_indexes(db)`, `startup(state)`,
+# `shutdown(state)` and `collect_metrics(state)` hooks, where `state` is the app's state
+# holding its settings and database. Anything a feature builds from its settings is
+# kept on the state, so apps in one process can be configured differently.
+FEATURES = {
+    'screenshots': (),
+    'journals': ('screenshots',),
+    'sync': ('screenshots',),
+    'live': (),
+    'annotations': ('screenshots',),
+    'search': ('screenshots',),
+}
+
+
+class Settings(BaseModel):
+    """Server configuration. Field names are the lower-cased environment variables."""
+    mongo_url: str
+    db_name: str
+    cors_origins: List[str] = ['*']
+    features: List[str] = list(FEATURES)
+
+    # Motor connection pool; each worker process gets its own pool
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 0
+    mongo_read_preference: str = 'primary'
+    mongo_wait_queue_timeout_ms: Optional[int] = None
+    # e.g. "zstd,snappy"; requires the zstandard / python-snappy packages respectively
+    mongo_compressors: Optional[str] = None
+
+    # Number of server processes on this host; run.py sets WEB_CONCURRENCY for its workers.
+    # Process pools default to this process's share of the CPUs.
+    web_concurrency: int = 1
+
+    # Paging limits for list endpoints
+    default_page_size: int = 100
+    max_page_size: int = 1000
+    export_batch_size: int = 1000
+
+    # Bulk ingest limits
+    bulk_max_items: int = 10000
+    bulk_max_bytes: int = 16 * 1024 * 1024
+    bulk_chunk_size: int = 1000
+
+    # Opt-in write-behind mode for POST /api/status
+    write_behind_enabled: bool = False
+    write_behind_max_batch: int = 500
+    write_behind_max_latency_ms: int = 50
+    write_behind_max_queue: int = 10000
+
+    # Response cache for read endpoints. Unset, it is on only where invalidations reach every
+    # process: with a shared backend, or with the memory backend in a single server process.
+    response_cache_enabled: Optional[bool] = None
+    response_cache_backend: str = 'memory'
+    response_cache_max_entries: int = 1024
+    response_cache_max_body_bytes: int = 1024 * 1024
+    response_cache_ttl_seconds: float = 5
+    response_cache_root_ttl_seconds: float = 3600
+
+    # Response compression
+    compression_enabled: bool = True
+    compression_min_size: int = 1024
+    compression_gzip_level: int = 6
+    compression_brotli_level: int = 4
+    compression_zstd_level: int = 3
+
+    # Screenshots and their image variants
+    screenshot_max_bytes: int = 50 * 1024 * 1024
+    image_variants_on_upload: bool = True
+    image_variant_formats: List[str] = ['webp']
+    image_thumbnail_sizes: List[int] = [160, 480]
+    image_quality: int = 80
+    image_workers: Optional[int] = None
+    similar_default_distance: int = 5
+    annotation_grid_size: int = 16
+
+    # Journal PDF rendering
+    pdf_workers: Optional[int] = None
+    pdf_chunk_pages: int = 8
+
+    # Delta sync
+    sync_default_limit: int = 200
+    sync_max_limit: int = 1000
+    sync_push_max_items: int = 500
+
+    # Live updates: auto | changestream | poll
+    live_mode: str = 'auto'
+    live_poll_interval_ms: int = 1000
+    live_poll_lookback_ms: int = 5000
+    live_queue_size: int = 256
+    live_heartbeat_seconds: float = 15
+
+    # Search
+    search_default_limit: int = 20
+    search_max_limit: int = 200
+    search_min_prefix_length: int = 2
+    search_max_prefix_terms: int = 256
+
+    @classmethod
+    def from_env(cls, env_file: Optional[Path] = ROOT_DIR / '.env', **overrides) -> 'Settings':
+        """Read settings from the environment after loading `env_file`; list values are comma-separated.
+
+        Keyword arguments take precedence over the environment.
+        """
+        if env_file is not None:
+            load_dotenv(env_file)
+        values = {}
+        for name, field in cls.model_fields.items():
+            raw = os.environ.get(name.upper())
+            if not raw:
+                continue
+            if typing.get_origin(field.annotation) is list:
+                values[name] = [item.strip() for item in raw.split(',') if item.strip()]
+            else:
+                values[name] = raw
+        return cls(**{**values, **overrides})
+
+
+def mongo_client_options(settings: Settings) -> dict:
+    """Pool, compression and read preference settings for the Motor client.
+
+    Each uvicorn worker gets its own pool, so MONGO_MAX_POOL_SIZE is per worker.
+    """
+    options = {
+        'maxPoolSize': settings.mongo_max_pool_size,
+        'minPoolSize': settings.mongo_min_pool_size,
+        'readPreference': settings.mongo_read_preference,
+    }
+    if settings.mongo_wait_queue_timeout_ms:
+        options['waitQueueTimeoutMS'] = settings.mongo_wait_queue_timeout_ms
+    if settings.mongo_compressors:
+        options['compressors'] = settings.mongo_compressors
+    return options
+
+def response_cache_active(settings: Settings) -> bool:
+    if settings.response_cache_enabled is not None:
+        return settings.response_cache_enabled
+    return settings.response_cache_backend != 'memory' or settings.web_concurrency <= 1
+
+def load_features(names: List[str]) -> list:
+    """Import the modules of the enabled features, checking they exist and their dependencies are enabled."""
+    unknown = set(names) - set(FEATURES)
+    if unknown:
+        raise ValueError(f"Unknown features: {', '.join(sorted(unknown))}")
+    for name in names:
+        missing = set(FEATURES[name]) - set(names)
+        if missing:
+            raise ValueError(f"Feature {name!r} requires {', '.join(sorted(missing))}")
+    return [importlib.import_module(name) for name in FEATURES if name in names]
+
+async def run_hook(module, hook: str, *args):
+    fn = getattr(module, hook, None)
+    if fn is None:
+        return
+    result = fn(*args)
+    if inspect.isawaitable(result):
+        await result
 
-# Create the main app without a prefix
-app = FastAPI()
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -35,41 +208,477 @@ class StatusCheck(BaseModel):
 class StatusCheckCreate(BaseModel):
     client_name: str
 
+class StatusCheckView(BaseModel):
+    """A StatusCheck as returned by list endpoints; fields may be projected away."""
+    id: Optional[str] = None
+    client_name: Optional[str] = None
+    timestamp: Optional[datetime] = None
+
+class BulkItemError(BaseModel):
+    index: int
+    error: str
+
+class BulkStatusResult(BaseModel):
+    inserted: int
+    ids: List[str]
+    errors: List[BulkItemError]
+
+
+STATUS_CHECK_FIELDS = set(StatusCheck.model_fields)
+
+
+def get_db(request: Request):
+    return request.app.state.db
+
+def get_settings(request: Request) -> Settings:
+    return request.app.state.settings
+
+def encode_cursor(doc: dict) -> str:
+    """Opaque keyset cursor pointing just past `doc` in (timestamp, id) order."""
+    raw = json.dumps([doc['timestamp'].isoformat(), doc['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, id_ = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(timestamp), str(id_)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_fields(fields: Optional[str]) -> Optional[set]:
+    if not fields:
+        return None
+    requested = {f.strip() for f in fields.split(',') if f.strip()}
+    unknown = requested - STATUS_CHECK_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return requested
+
+def keyset_filter(cursor: Optional[str], descending: bool) -> dict:
+    if not cursor:
+        return {}
+    timestamp, id_ = decode_cursor(cursor)
+    op = '$lt' if descending else '$gt'
+    return {'$or': [
+        {'timestamp': {op: timestamp}},
+        {'timestamp': timestamp, 'id': {op: id_}},
+    ]}
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+async def iter_ndjson(cursor, batch_size: int):
+    """Drain a Motor cursor as NDJSON, yielding one chunk per batch of documents."""
+    lines = []
+    async for doc in cursor:
+        lines.append(orjson.dumps(doc, default=json_default, option=orjson.OPT_APPEND_NEWLINE))
+        if len(lines) >= batch_size:
+            yield b''.join(lines)
+            lines = []
+    if lines:
+        yield b''.join(lines)
+
+async def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+async def read_body(request: Request, max_bytes: int) -> bytes:
+    """The request body, refused with 413 as soon as it is known to exceed `max_bytes`."""
+    too_large = HTTPException(status_code=413, detail=f"Request body exceeds {max_bytes} bytes")
+    declared = request.headers.get('content-length', '')
+    if declared.isdigit() and int(declared) > max_bytes:
+        raise too_large
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise too_large
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+def parse_bulk_body(body: bytes, content_type: str) -> Tuple[List[Any], Dict[int, str]]:
+    """Decode a bulk payload given either as a JSON array or as NDJSON.
+
+    Returns the items and {index: error} for NDJSON lines that are not valid JSON,
+    whose items are None.
+    """
+    if 'ndjson' in content_type or 'jsonlines' in content_type:
+        items, malformed = [], {}
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(orjson.loads(line))
+            except ValueError as e:
+                malformed[len(items)] = f"Malformed JSON: {e}"
+                items.append(None)
+        return items, malformed
+    try:
+        items = orjson.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Malformed body: {e}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array or NDJSON body")
+    return items, {}
+
+async def insert_chunked(collection, docs: List[dict], chunk_size: int) -> dict:
+    """Unordered insert_many in chunks; returns {position in docs: error message} for failures."""
+    failed = {}
+    for start in range(0, len(docs), chunk_size):
+        chunk = docs[start:start + chunk_size]
+        try:
+            await collection.insert_many(chunk, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get('writeErrors', []):
+                failed[start + write_error['index']] = write_error.get('errmsg', 'write error')
+    return failed
+
+# Clients may keep list responses but must revalidate them with If-None-Match
+STATUS_CACHE_HEADERS = {'Cache-Control': 'no-cache'}
+
+async def status_checks_version(db) -> tuple:
+    """Changes whenever a status check is added or removed; status checks are never edited in place."""
+    return await collection_version(db.status_checks, [('timestamp', DESCENDING), ('id', DESCENDING)])
+
 # Add your routes to the router instead of directly to app
 @api_router.get("/")
 async def root():
     return {"message": "Hello World"}
 
 @api_router.post("/status", response_model=StatusCheck)
-async def create_status_check(input: StatusCheckCreate):
-    status_dict = input.dict()
+async def create_status_check(input: StatusCheckCreate, request: Request, db=Depends(get_db)):
+    status_dict = input.model_dump()
     status_obj = StatusCheck(**status_dict)
-    _ = await db.status_checks.insert_one(status_obj.dict())
+    write_buffer = request.app.state.write_buffer
+    if write_buffer is not None and write_buffer.running:
+        await write_buffer.put(status_obj.model_dump())
+    else:
+        _ = await db.status_checks.insert_one(status_obj.model_dump())
+        await request.app.state.response_cache.invalidate('status_checks')
     return status_obj
 
-@api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
-
-# Include the router in the main app
-app.include_router(api_router)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+@api_router.get("/status/write-buffer")
+async def get_write_buffer_stats(request: Request):
+    write_buffer = request.app.state.write_buffer
+    if write_buffer is None:
+        return {"enabled": False}
+    return {"enabled": True, **write_buffer.stats()}
+
+@api_router.post("/status/bulk", response_model=BulkStatusResult)
+async def create_status_checks_bulk(request: Request, db=Depends(get_db), settings: Settings = Depends(get_settings)):
+    """Create many status checks from a JSON array or an NDJSON body.
+
+    Invalid items, and NDJSON lines that are not JSON at all, are reported by index
+    and do not prevent the others from being written.
+    """
+    body = await read_body(request, settings.bulk_max_bytes)
+    items, malformed = parse_bulk_body(body, request.headers.get('content-type', ''))
+    if len(items) > settings.bulk_max_items:
+        raise HTTPException(status_code=413, detail=f"At most {settings.bulk_max_items} items per request")
+
+    errors = []
+    docs, positions = [], []
+    for index, item in enumerate(items):
+        if index in malformed:
+            errors.append(BulkItemError(index=index, error=malformed[index]))
+            continue
+        try:
+            status_obj = StatusCheck(**StatusCheckCreate.model_validate(item).model_dump())
+        except ValidationError as e:
+            errors.append(BulkItemError(index=index, error=str(e.errors()[0]['msg'])))
+            continue
+        docs.append(status_obj.model_dump())
+        positions.append(index)
+
+    failed = await insert_chunked(db.status_checks, docs, settings.bulk_chunk_size) if docs else {}
+    if len(failed) < len(docs):
+        await request.app.state.response_cache.invalidate('status_checks')
+    errors.extend(BulkItemError(index=positions[i], error=msg) for i, msg in failed.items())
+    errors.sort(key=lambda e: e.index)
+
+    ids = [doc['id'] for i, doc in enumerate(docs) if i not in failed]
+    return BulkStatusResult(inserted=len(ids), ids=ids, errors=errors)
+
+@api_router.get("/status", response_model=List[StatusCheckView], response_model_exclude_unset=True)
+async def get_status_checks(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, description="Page size; defaults to DEFAULT_PAGE_SIZE, at most MAX_PAGE_SIZE"),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated list of fields to return"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    db=Depends(get_db),
+    settings: Settings = Depends(get_settings),
+):
+    """Keyset-paginated listing ordered by (timestamp, id).
+
+    The cursor for the next page, if any, is returned in the X-Next-Cursor header.
+    Responses carry an ETag derived from the collection version, and a matching
+    If-None-Match is answered with 304 before any documents are read.
+
+    Documents are projected into their response shape by MongoDB and serialized
+    directly with orjson; they were validated when written, so they are not
+    rebuilt as models or checked against the response model again.
+    """
+    limit = limit or settings.default_page_size
+    if limit > settings.max_page_size:
+        raise HTTPException(status_code=422, detail=f"limit must be at most {settings.max_page_size}")
+
+    etag = make_etag('status_checks', await status_checks_version(db), limit, cursor, fields, order)
+    unchanged = not_modified(request, etag, STATUS_CACHE_HEADERS)
+    if unchanged is not None:
+        return unchanged
+    headers = {'ETag': etag, **STATUS_CACHE_HEADERS}
+
+    requested = parse_fields(fields)
+    descending = order == "desc"
+    direction = DESCENDING if descending else ASCENDING
+
+    returned = STATUS_CHECK_FIELDS if requested is None else requested
+    # The sort key is always fetched so the next cursor can be built from the last row
+    cursor_only = {'timestamp', 'id'} - returned
+    projection = {'_id': 0, **{f: 1 for f in returned | cursor_only}}
+
+    # Fetch one extra row to learn whether another page exists
+    docs = await db.status_checks.find(keyset_filter(cursor, descending), projection) \
+        .sort([('timestamp', direction), ('id', direction)]) \
+        .limit(limit + 1) \
+        .to_list(limit + 1)
+
+    if len(docs) > limit:
+        docs = docs[:limit]
+        headers['X-Next-Cursor'] = encode_cursor(docs[-1])
+
+    for field in cursor_only:
+        for doc in docs:
+            del doc[field]
+    return ORJSONResponse(docs, headers=headers)
+
+@api_router.get("/status/export")
+async def export_status_checks(
+    request: Request,
+    batch_size: Optional[int] = Query(None, ge=1, le=100_000, description="Defaults to EXPORT_BATCH_SIZE"),
+    gzip: bool = False,
+    db=Depends(get_db),
+    settings: Settings = Depends(get_settings),
+):
+    """Stream every status check as NDJSON in (timestamp, id) order.
+
+    Documents are pulled from the cursor `batch_size` at a time, so memory use is
+    independent of collection size. With `gzip=true` the stream is compressed and
+    served as a .ndjson.gz download.
+    """
+    batch_size = batch_size or settings.export_batch_size
+    etag = make_etag('status_checks/export', await status_checks_version(db), gzip)
+    unchanged = not_modified(request, etag, STATUS_CACHE_HEADERS)
+    if unchanged is not None:
+        return unchanged
+    headers = {'ETag': etag, **STATUS_CACHE_HEADERS}
+
+    cursor = db.status_checks.find({}, {'_id': 0}) \
+        .sort([('timestamp', ASCENDING), ('id', ASCENDING)]) \
+        .batch_size(batch_size)
+    body = iter_ndjson(cursor, batch_size)
+
+    if gzip:
+        return StreamingResponse(
+            gzip_stream(body),
+            media_type="application/gzip",
+            headers={"Content-Disposition": 'attachment; filename="status_checks.ndjson.gz"', **headers},
+        )
+    return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
+
+@api_router.get("/db/pool")
+async def get_pool_metrics(request: Request, settings: Settings = Depends(get_settings)):
+    return {"options": mongo_client_options(settings), "servers": request.app.state.pool_metrics.snapshot()}
+
+@api_router.get("/cache/stats")
+async def get_cache_stats(request: Request, settings: Settings = Depends(get_settings)):
+    return {"enabled": response_cache_active(settings), **request.app.state.response_cache.stats()}
+
+@api_router.get("/startup")
+async def get_startup_timings(request: Request):
+    """Seconds spent importing this module, in create_app and in the lifespan startup of this worker."""
+    return request.app.state.startup
+
+metrics_router = APIRouter()
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics(request: Request):
+    return PlainTextResponse(registry.render(request.app.state.collectors), media_type="text/plain; version=0.0.4")
+
+
+def pool_metrics_collector(pool_metrics: PoolMetricsListener):
+    def collect():
+        snapshot = pool_metrics.snapshot()
+        for field, doc in (
+            ('size', 'Open connections in the MongoDB pool.'),
+            ('in_use', 'MongoDB connections currently checked out.'),
+            ('checkout_wait_avg_ms', 'Average time spent waiting to check out a MongoDB connection.'),
+            ('checkout_wait_max_ms', 'Longest time spent waiting to check out a MongoDB connection.'),
+        ):
+            yield from gauge_lines(f'mongodb_pool_{field}', doc, (({'server': server}, stats[field]) for server, stats in snapshot.items()))
+    return collect
+
+def write_buffer_collector(state):
+    def collect():
+        if state.write_buffer is None:
+            return
+        stats = state.write_buffer.stats()
+        for field, doc in (
+            ('queue_depth', 'Status checks waiting in the write-behind queue.'),
+            ('written', 'Status checks written by the write-behind buffer.'),
+            ('failed', 'Status checks the write-behind buffer failed to write.'),
+            ('last_flush_ms', 'Duration of the most recent write-behind flush.'),
+        ):
+            yield from gauge_lines(f'write_buffer_{field}', doc, [({}, stats[field])])
+    return collect
+
+def startup_collector(state):
+    def collect():
+        yield from gauge_lines('app_startup_seconds', 'Seconds spent in each startup phase of this worker.',
+                               (({'phase': phase}, seconds) for phase, seconds in state.startup.items()))
+    return collect
+
+
+async def create_indexes(db, features: list):
+    await db.status_checks.create_index([('timestamp', ASCENDING), ('id', ASCENDING)])
+    await db.status_checks.create_index('id', unique=True)
+    for feature in features:
+        await run_hook(feature, 'ensure_indexes', db)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Connects to MongoDB, prepares indexes and starts background work; undoes it all on shutdown.
+
+    The Motor client is created here rather than at import, so each worker
+    process opens its own connections after it has been forked.
+    """
+    started = time.perf_counter()
+    state = app.state
+    settings: Settings = state.settings
+    owns_client = state.mongo_client is None
+    if owns_client:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        state.mongo_client = AsyncIOMotorClient(
+            settings.mongo_url, event_listeners=[state.pool_metrics, CommandMetricsListener()],
+            **mongo_client_options(settings),
+        )
+        state.db = state.mongo_client[settings.db_name]
+    db = state.db
+
+    try:
+        await create_indexes(db, state.features)
+        if settings.write_behind_enabled:
+            state.write_buffer = WriteBehindBuffer(
+                db.status_checks,
+                max_batch=settings.write_behind_max_batch,
+                max_latency_ms=settings.write_behind_max_latency_ms,
+                max_queue=settings.write_behind_max_queue,
+                on_flush=lambda: state.response_cache.invalidate('status_checks'),
+            )
+            state.write_buffer.start()
+        for feature in state.features:
+            await run_hook(feature, 'startup', state)
+
+        state.startup['lifespan'] = time.perf_counter() - started
+        logger.info("Started in %s", ', '.join(f'{phase} {seconds:.3f}s' for phase, seconds in state.startup.items()))
+        yield
+    finally:
+        if state.write_buffer is not None:
+            await state.write_buffer.close()
+            state.write_buffer = None
+        for feature in reversed(state.features):
+            await run_hook(feature, 'shutdown', state)
+        if owns_client:
+            state.mongo_client.close()
+            state.mongo_client = state.db = None
+
+
+def create_app(settings: Optional[Settings] = None, mongo_client=None) -> FastAPI:
+    """Build the API app. Nothing connects to MongoDB until the app's lifespan starts.
+
+    `settings` defaults to Settings.from_env(). Passing `mongo_client` (for
+    example a mongomock client in tests) uses it instead of creating a Motor
+    client, and leaves closing it to the caller.
+    """
+    started = time.perf_counter()
+    settings = settings or Settings.from_env()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+    state = app.state
+    state.settings = settings
+    state.mongo_client = mongo_client
+    state.db = mongo_client[settings.db_name] if mongo_client is not None else None
+    state.pool_metrics = PoolMetricsListener()
+    state.write_buffer = None
+    state.features = load_features(settings.features)
+    state.startup = {'import': IMPORT_SECONDS}
+
+    state.response_cache = ResponseCache(
+        load_backend(settings.response_cache_backend, settings.response_cache_max_entries),
+        max_body_bytes=settings.response_cache_max_body_bytes,
+    )
+    state.response_cache.cache('/api/', ttl=settings.response_cache_root_ttl_seconds)
+    state.response_cache.cache('/api/status', ttl=settings.response_cache_ttl_seconds, tags=['status_checks'])
+
+    # Include the routers in the main app
+    api = APIRouter()
+    api.include_router(api_router)
+    for feature in state.features:
+        api.include_router(feature.router, prefix="/api")
+    app.include_router(api)
+    app.include_router(metrics_router)
+
+    state.collectors = [
+        pool_metrics_collector(state.pool_metrics),
+        write_buffer_collector(state),
+        state.response_cache.collect_metrics,
+        startup_collector(state),
+        *(functools.partial(feature.collect_metrics, state) for feature in state.features
+          if hasattr(feature, 'collect_metrics')),
+    ]
+
+    if response_cache_active(settings):
+        app.add_middleware(ResponseCacheMiddleware, cache=state.response_cache)
+    app.add_middleware(MetricsMiddleware)
+    if settings.compression_enabled:
+        app.add_middleware(CompressionMiddleware, minimum_size=settings.compression_min_size, levels={
+            'gzip': settings.compression_gzip_level,
+            'br': settings.compression_brotli_level,
+            'zstd': settings.compression_zstd_level,
+        })
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=settings.cors_origins,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "ETag"],
+    )
+
+    state.startup['create_app'] = time.perf_counter() - started
+    return app
+
+
+def __getattr__(name: str):
+    # `uvicorn server:app` keeps working: the default app is built on first access
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+IMPORT_SECONDS = time.perf_counter() - _import_started
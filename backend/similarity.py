@@ -0,0 +1,183 @@
+"""Near-duplicate search over 64-bit perceptual hashes."""
+import asyncio
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import sync_log
+
+
+if hasattr(np, 'bitwise_count'):
+    def popcount(values: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(values)
+else:  # numpy < 2.0
+    _BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(values: np.ndarray) -> np.ndarray:
+        return _BYTE_COUNTS[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def to_signed(value: int) -> int:
+    """Store an unsigned 64-bit hash in a BSON int64."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class HammingIndex:
+    """Multi-index hashing over 64-bit hashes.
+
+    Each hash is split into BLOCKS 16-bit blocks with a lookup table per block. Two
+    hashes within distance d < BLOCKS must agree exactly on at least one block, so
+    such queries only compare against the few rows sharing a block. Wider queries
+    fall back to a vectorised XOR + popcount over every row, which is still well
+    under a millisecond at a few hundred thousand hashes.
+    """
+
+    BLOCKS = 4
+    BLOCK_BITS = 16
+
+    def __init__(self, capacity: int = 1024):
+        self._hashes = np.zeros(capacity, dtype=np.uint64)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._tables = [defaultdict(list) for _ in range(self.BLOCKS)]
+        self._dead = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _blocks(self, value: int):
+        mask = (1 << self.BLOCK_BITS) - 1
+        return [(value >> (i * self.BLOCK_BITS)) & mask for i in range(self.BLOCKS)]
+
+    def add(self, item_id: str, value: int):
+        value = to_unsigned(value)
+        row = self._rows.get(item_id)
+        if row is not None:
+            if int(self._hashes[row]) == value:
+                return
+            self.remove(item_id)
+        row = len(self._ids)
+        if row == len(self._hashes):
+            self._hashes = np.resize(self._hashes, row * 2)
+            self._alive = np.concatenate([self._alive, np.zeros(row, dtype=bool)])
+        self._hashes[row] = value
+        self._alive[row] = True
+        self._ids.append(item_id)
+        self._rows[item_id] = row
+        for table, block in zip(self._tables, self._blocks(value)):
+            table[block].append(row)
+
+    def remove(self, item_id: str):
+        row = self._rows.pop(item_id, None)
+        if row is not None:
+            self._alive[row] = False
+            self._dead += 1
+            if self._dead > 1024 and self._dead > len(self._rows):
+                self._compact()
+
+    def query(self, value: int, max_distance: int, limit: Optional[int] = None) -> List[Tuple[str, int]]:
+        """(id, distance) pairs within `max_distance` of `value`, closest first."""
+        value = to_unsigned(value)
+        if max_distance < self.BLOCKS:
+            buckets = [table.get(block, ()) for table, block in zip(self._tables, self._blocks(value))]
+            rows = np.unique(np.fromiter((r for bucket in buckets for r in bucket), dtype=np.int64))
+            distances = popcount(self._hashes[rows] ^ np.uint64(value))
+            keep = (distances <= max_distance) & self._alive[rows]
+            rows, distances = rows[keep], distances[keep]
+        else:
+            count = len(self._ids)
+            distances = popcount(self._hashes[:count] ^ np.uint64(value))
+            rows = np.flatnonzero((distances <= max_distance) & self._alive[:count])
+            distances = distances[rows]
+        order = np.argsort(distances, kind='stable')
+        if limit is not None:
+            order = order[:limit]
+        return [(self._ids[rows[i]], int(distances[i])) for i in order]
+
+    def _compact(self):
+        live = [(item_id, int(self._hashes[row])) for item_id, row in self._rows.items()]
+        self.__init__(max(len(live) * 2, 1024))
+        for item_id, value in live:
+            self.add(item_id, value)
+
+
+class SimilarityIndex:
+    """A per-process HammingIndex over screenshot dHashes, kept in step with the database.
+
+    Hashes written by this process are added directly; before each query the index
+    catches up on hashes other workers stored since its last sync, through the
+    sync sequence the hash write is stamped with, up to the committed mark (see
+    sync_log). Deletions elsewhere are noticed when a match no longer resolves
+    to a document.
+    """
+
+    def __init__(self):
+        self.index = HammingIndex()
+        self.seq = 0
+        self._lock = asyncio.Lock()
+
+    async def sync(self, db):
+        async with self._lock:
+            committed = await sync_log.committed_seq(db)
+            if committed <= self.seq:
+                return
+            query = {'seq': {'$gt': self.seq, '$lte': committed}, 'dhash': {'$ne': None}}
+            async for doc in db.screenshots.find(query, {'_id': 0, 'id': 1, 'dhash': 1}).batch_size(5000):
+                self.index.add(doc['id'], doc['dhash'])
+            self.seq = committed
+
+    def add(self, screenshot_id: str, value: int):
+        self.index.add(screenshot_id, value)
+
+    def remove(self, screenshot_id: str):
+        self.index.remove(screenshot_id)
+
+    async def similar(self, db, screenshot_id: str, value: int, max_distance: int, limit: int) -> List[Tuple[dict, int]]:
+        await self.sync(db)
+        matches = [(i, d) for i, d in self.index.query(value, max_distance, limit + 1) if i != screenshot_id][:limit]
+        docs = {
+            doc['id']: doc async for doc in db.screenshots.find(
+                {'id': {'$in': [i for i, _ in matches]}},
+                {'_id': 0, 'id': 1, 'session_id': 1, 'title': 1, 'url': 1, 'timestamp': 1},
+            )
+        }
+        results = []
+        for match_id, distance in matches:
+            if match_id in docs:
+                results.append((docs[match_id], distance))
+            else:
+                self.index.remove(match_id)
+        return results
+
+
+def cluster_near_duplicates(items: List[Tuple[str, int]], max_distance: int) -> List[List[str]]:
+    """Group ids whose hashes are within `max_distance` of each other (transitively).
+
+    Meant for small sets such as one journal; compares every pair with NumPy. Groups
+    keep the input order, so the first id of each is the earliest capture.
+    """
+    if not items:
+        return []
+    values = np.array([to_unsigned(v) for _, v in items], dtype=np.uint64)
+    parent = list(range(len(items)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(items) - 1):
+        close = np.nonzero(popcount(values[i + 1:] ^ values[i]) <= max_distance)[0] + i + 1
+        for j in close:
+            parent[find(int(j))] = find(i)
+
+    groups: Dict[int, List[str]] = defaultdict(list)
+    for i, (item_id, _) in enumerate(items):
+        groups[find(i)].append(item_id)
+    return [group for group in groups.values() if len(group) > 1]
@@ -0,0 +1,256 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Literal, Optional
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
+
+import annotation_store
+from blob_store import ChunkedBlobStore
+import screenshots
+from screenshots import Screenshot, get_blob_store, get_state
+import sync_log
+
+
+logger = logging.getLogger(__name__)
+
+
+# Screenshot fields a client may change through sync. The image itself is
+# immutable: it is uploaded once and referenced by sha256.
+SCREENSHOT_SYNC_FIELDS = {'session_id', 'title', 'url', 'timestamp', 'annotations'}
+# Server-side bookkeeping that is never sent to clients.
+HIDDEN_FIELDS = {'_id': 0, 'dhash_at': 0}
+
+router = APIRouter(prefix="/sync", tags=["sync"])
+
+Kind = Literal['screenshot', 'session']
+COLLECTIONS = {'screenshot': 'screenshots', 'session': 'sessions'}
+
+
+class Change(BaseModel):
+    kind: Kind
+    id: str
+    seq: int
+    version: int
+    deleted: bool = False
+    data: Optional[Dict[str, Any]] = None
+
+
+class ChangeSet(BaseModel):
+    changes: List[Change]
+    checkpoint: int
+    has_more: bool
+
+
+class PushItem(BaseModel):
+    kind: Kind
+    id: str
+    base_version: int = 0
+    deleted: bool = False
+    data: Dict[str, Any] = {}
+
+
+class PushRequest(BaseModel):
+    items: List[PushItem]
+
+
+class PushResult(BaseModel):
+    kind: Kind
+    id: str
+    status: Literal['applied', 'conflict', 'missing_blob', 'error']
+    version: Optional[int] = None
+    seq: Optional[int] = None
+    detail: Optional[str] = None
+    current: Optional[Change] = None
+
+
+class PushResponse(BaseModel):
+    results: List[PushResult]
+
+
+def parse_kinds(kinds: Optional[str]) -> List[str]:
+    if not kinds:
+        return list(COLLECTIONS)
+    names = [k.strip() for k in kinds.split(',') if k.strip()]
+    unknown = [k for k in names if k not in COLLECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown kinds: {', '.join(unknown)}")
+    return names
+
+def parse_timestamp(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def record_change(kind: str, doc: dict) -> Change:
+    data = {k: v for k, v in doc.items() if k not in ('seq', 'version', 'updated_at')}
+    return Change(kind=kind, id=doc['id'], seq=doc['seq'], version=doc.get('version', 1), data=data)
+
+def tombstone_change(doc: dict) -> Change:
+    return Change(kind=doc['kind'], id=doc['id'], seq=doc['seq'], version=doc['version'], deleted=True)
+
+async def current_change(db, kind: str, record_id: str) -> Optional[Change]:
+    """The server's state of a record, for reporting conflicts."""
+    doc = await db[COLLECTIONS[kind]].find_one({'id': record_id}, HIDDEN_FIELDS)
+    if doc is not None:
+        if kind == 'screenshot':
+            await annotation_store.hydrate(db, [doc])
+        return record_change(kind, doc)
+    tombstone = await db.sync_tombstones.find_one({'kind': kind, 'id': record_id}, {'_id': 0})
+    return tombstone_change(tombstone) if tombstone else None
+
+
+@router.get("/changes", response_model=ChangeSet, response_model_exclude_none=True)
+async def get_changes(
+    since: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, description="Page size; defaults to SYNC_DEFAULT_LIMIT, at most SYNC_MAX_LIMIT"),
+    kinds: Optional[str] = None,
+    state=Depends(get_state),
+):
+    """Records created, changed or deleted after checkpoint `since`, oldest first.
+
+    Screenshots carry their metadata, annotations and blob sha256 but never the
+    image bytes; a client fetches /api/screenshots/{id}/image only for content
+    it does not already hold. Pass the returned `checkpoint` as `since` on the
+    next call, repeating while `has_more` is true. Changes whose write is still
+    in flight, and everything numbered after them, are held back until it lands,
+    so a checkpoint never moves past a change the client has not been sent.
+    """
+    db, settings = state.db, state.settings
+    limit = limit or settings.sync_default_limit
+    if limit > settings.sync_max_limit:
+        raise HTTPException(status_code=422, detail=f"limit must be at most {settings.sync_max_limit}")
+    names = parse_kinds(kinds)
+    committed = await sync_log.committed_seq(db)
+    window = {'$gt': since, '$lte': committed}
+    changes = []
+    for kind in names:
+        cursor = db[COLLECTIONS[kind]].find({'seq': window}, HIDDEN_FIELDS).sort('seq', 1).limit(limit + 1)
+        docs = await cursor.to_list(limit + 1)
+        if kind == 'screenshot':
+            await annotation_store.hydrate(db, docs)
+        changes += [record_change(kind, doc) for doc in docs]
+    cursor = db.sync_tombstones.find({'kind': {'$in': names}, 'seq': window}, {'_id': 0})
+    changes += [tombstone_change(doc) async for doc in cursor.sort('seq', 1).limit(limit + 1)]
+
+    changes.sort(key=lambda c: c.seq)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    if has_more:
+        checkpoint = changes[-1].seq
+    else:
+        # Everything up to the committed mark has been sent
+        checkpoint = max(since, committed)
+    return ChangeSet(changes=changes, checkpoint=checkpoint, has_more=has_more)
+
+
+async def delete_record(state, store: ChunkedBlobStore, item: PushItem) -> PushResult:
+    db = state.db
+    collection = db[COLLECTIONS[item.kind]]
+    doc = await collection.find_one_and_delete({'id': item.id, 'version': item.base_version}, {'_id': 0})
+    if doc is None:
+        current = await current_change(db, item.kind, item.id)
+        if current is None or current.deleted:
+            return PushResult(kind=item.kind, id=item.id, status='applied', version=current and current.version,
+                              seq=current and current.seq)
+        return PushResult(kind=item.kind, id=item.id, status='conflict', current=current)
+    if item.kind == 'screenshot':
+        await screenshots.cleanup_deleted_screenshot(state, store, doc)
+    else:
+        await sync_log.record_deletion(db, item.kind, item.id, doc['version'])
+    tombstone = await db.sync_tombstones.find_one({'kind': item.kind, 'id': item.id}, {'_id': 0})
+    return PushResult(kind=item.kind, id=item.id, status='applied', version=tombstone['version'], seq=tombstone['seq'])
+
+
+async def create_record(state, store: ChunkedBlobStore, item: PushItem, background_tasks: BackgroundTasks) -> PushResult:
+    db = state.db
+    blob = None
+    if item.kind == 'screenshot':
+        sha256 = item.data.get('sha256')
+        blob = await store.acquire(sha256) if sha256 else None
+        if blob is None:
+            return PushResult(kind=item.kind, id=item.id, status='missing_blob',
+                              detail="Upload the image to /api/screenshots first, then push its sha256")
+    try:
+        async with sync_log.change(db) as stamp:
+            if blob is not None:
+                fields = {k: v for k, v in item.data.items() if k in SCREENSHOT_SYNC_FIELDS and v is not None}
+                doc = Screenshot(
+                    **fields, id=item.id, content_type=blob['content_type'], length=blob['length'],
+                    sha256=blob['sha256'], blob_id=blob['id'], seq=stamp['seq'],
+                ).model_dump()
+            else:
+                doc = {**item.data, 'id': item.id, 'version': 1, **stamp}
+            await db[COLLECTIONS[item.kind]].insert_one(doc)
+    except DuplicateKeyError:
+        if blob is not None:
+            await store.release(blob['id'])
+        return PushResult(kind=item.kind, id=item.id, status='conflict',
+                          current=await current_change(db, item.kind, item.id))
+    except Exception:
+        if blob is not None:
+            await store.release(blob['id'])
+        raise
+    await sync_log.clear_deletion(db, item.kind, item.id)
+    if blob is not None and state.settings.image_variants_on_upload:
+        background_tasks.add_task(screenshots.generate_variants, state, store, doc)
+    return PushResult(kind=item.kind, id=item.id, status='applied', version=1, seq=stamp['seq'])
+
+
+async def update_record(db, item: PushItem) -> PushResult:
+    if item.kind == 'screenshot':
+        fields = {k: v for k, v in item.data.items() if k in SCREENSHOT_SYNC_FIELDS}
+        if isinstance(fields.get('timestamp'), str):
+            fields['timestamp'] = parse_timestamp(fields['timestamp'])
+        if 'annotations' in fields:
+            # A whole array replaces any per-annotation records
+            fields['annotations_split'] = False
+    else:
+        fields = {k: v for k, v in item.data.items() if k not in ('_id', 'id', 'seq', 'version', 'updated_at')}
+    async with sync_log.change(db) as stamp:
+        result = await db[COLLECTIONS[item.kind]].update_one(
+            {'id': item.id, 'version': item.base_version},
+            {'$set': {**fields, **stamp, 'version': item.base_version + 1}},
+        )
+    if result.matched_count == 0:
+        return PushResult(kind=item.kind, id=item.id, status='conflict',
+                          current=await current_change(db, item.kind, item.id))
+    return PushResult(kind=item.kind, id=item.id, status='applied', version=item.base_version + 1, seq=stamp['seq'])
+
+
+@router.post("/push", response_model=PushResponse, response_model_exclude_none=True)
+async def push_changes(
+    body: PushRequest,
+    background_tasks: BackgroundTasks,
+    state=Depends(get_state),
+    store: ChunkedBlobStore = Depends(get_blob_store),
+):
+    """Apply a batch of client changes with optimistic concurrency.
+
+    Each item names the version it was based on (0 to create). An item whose
+    base version is no longer current is rejected as a conflict together with
+    the server's copy, for the client to merge and push again. Screenshots are
+    created by sha256 of an already uploaded image, so only metadata and
+    annotations travel through sync.
+
+    A push does not move the client's pull checkpoint: changes other clients
+    made since its last pull are still to be fetched from /changes. Each
+    applied item reports the `seq` and `version` it was given, so the client
+    can recognise its own changes when they come back in the next pull.
+    """
+    db, max_items = state.db, state.settings.sync_push_max_items
+    if len(body.items) > max_items:
+        raise HTTPException(status_code=413, detail=f"At most {max_items} items per push")
+    results = []
+    for item in body.items:
+        try:
+            if item.deleted:
+                result = await delete_record(state, store, item)
+            elif item.base_version == 0:
+                result = await create_record(state, store, item, background_tasks)
+            else:
+                result = await update_record(db, item)
+        except Exception as e:
+            logger.exception("Sync push failed for %s %s", item.kind, item.id)
+            result = PushResult(kind=item.kind, id=item.id, status='error', detail=str(e))
+        results.append(result)
+    return PushResponse(results=results)
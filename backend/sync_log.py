@@ -0,0 +1,102 @@
+"""Change sequence numbers for records that clients sync incrementally.
+
+Every write to a synced record stamps it with the next value of a global counter
+(`seq`); deletions leave a tombstone carrying their own `seq`. A client that
+remembers the highest `seq` it has seen can ask for exactly what changed since.
+
+A number is taken before the write carrying it lands, so writes can become
+visible out of sequence order. Writes therefore take their number through
+`change()`, which keeps it in `sync_pending` until the write is done, and
+readers that tail the sequence stop at `committed_seq()`: below it every
+number is either written or will never be.
+"""
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, ReturnDocument
+
+
+SEQ_COUNTER = 'sync_seq'
+# A write still pending after this long is taken to have died with its process
+PENDING_TIMEOUT = timedelta(seconds=60)
+# How long committed_seq waits for a writer to record the number it took
+PENDING_SEQ_WAIT = timedelta(seconds=1)
+
+
+async def next_seq(db) -> int:
+    doc = await db.counters.find_one_and_update(
+        {'_id': SEQ_COUNTER}, {'$inc': {'value': 1}}, upsert=True, return_document=ReturnDocument.AFTER,
+    )
+    return doc['value']
+
+async def current_seq(db) -> int:
+    doc = await db.counters.find_one({'_id': SEQ_COUNTER})
+    return doc['value'] if doc else 0
+
+@asynccontextmanager
+async def change(db):
+    """Fields to $set on a synced record whenever it changes; make the write inside the block.
+
+    The pending marker is written before the number is taken, so a reader that
+    sees the counter at N also sees every number up to N that is not written yet.
+    It records the counter as it was before, which the number taken will exceed.
+    """
+    token = uuid.uuid4().hex
+    after = await current_seq(db)
+    await db.sync_pending.insert_one({'_id': token, 'at': datetime.utcnow(), 'after': after})
+    try:
+        seq = await next_seq(db)
+        await db.sync_pending.update_one({'_id': token}, {'$set': {'seq': seq}})
+        yield {'seq': seq, 'updated_at': datetime.utcnow()}
+    finally:
+        await db.sync_pending.delete_one({'_id': token})
+
+async def committed_seq(db) -> int:
+    """The highest seq such that every change numbered up to it is visible.
+
+    A writer that has not recorded its number yet normally does so within a round
+    trip. If it has not after PENDING_SEQ_WAIT (it may have died in between) its
+    number is only known to exceed the counter it saw, and the mark stops there.
+    """
+    deadline = datetime.utcnow() + PENDING_SEQ_WAIT
+    while True:
+        head = await current_seq(db)
+        cutoff = datetime.utcnow() - PENDING_TIMEOUT
+        pending = await db.sync_pending.find({'at': {'$gt': cutoff}}, {'_id': 0, 'seq': 1, 'after': 1}).to_list(None)
+        if all('seq' in p for p in pending) or datetime.utcnow() >= deadline:
+            return min([head] + [p['seq'] - 1 if 'seq' in p else p.get('after', 0) for p in pending])
+        await asyncio.sleep(0.005)
+
+async def record_deletion(db, kind: str, record_id: str, version: int):
+    async with change(db) as stamp:
+        await db.sync_tombstones.update_one(
+            {'kind': kind, 'id': record_id},
+            {'$set': {'version': version + 1, 'deleted_at': datetime.utcnow(), **stamp}},
+            upsert=True,
+        )
+
+async def clear_deletion(db, kind: str, record_id: str):
+    """Forget a tombstone when a record with the same id is created again."""
+    await db.sync_tombstones.delete_one({'kind': kind, 'id': record_id})
+
+async def backfill(collection):
+    """Give records written before sync existed a place in the change sequence."""
+    async for doc in collection.find({'seq': {'$exists': False}}, {'_id': 1}):
+        async with change(collection.database) as stamp:
+            await collection.update_one(
+                {'_id': doc['_id'], 'seq': {'$exists': False}},
+                {'$set': {'seq': stamp['seq'], 'version': 1}},
+            )
+
+async def ensure_indexes(db):
+    await db.screenshots.create_index('seq', sparse=True)
+    await db.sessions.create_index('id', unique=True)
+    await db.sessions.create_index('seq')
+    await db.sync_tombstones.create_index([('kind', ASCENDING), ('id', ASCENDING)], unique=True)
+    await db.sync_tombstones.create_index('seq')
+    # Markers left behind by a crashed writer are ignored after PENDING_TIMEOUT and removed later
+    await db.sync_pending.create_index('at', expireAfterSeconds=int(PENDING_TIMEOUT.total_seconds()) * 10)
+    await backfill(db.screenshots)
+    await backfill(db.sessions)
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from pymongo.errors import BulkWriteError
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteBehindBuffer:
+    """Queues documents in memory and writes them with insert_many in the background.
+
+    A batch is flushed once it holds `max_batch` documents or `max_latency_ms` has
+    passed since its first document arrived, whichever comes first. `put` blocks
+    when `max_queue` documents are waiting, which pushes back on writers instead of
+    growing without bound. `on_flush`, if given, is awaited after each batch is written.
+    """
+
+    def __init__(self, collection, max_batch: int = 500, max_latency_ms: int = 50, max_queue: int = 10000,
+                 on_flush: Optional[Callable[[], Awaitable]] = None):
+        self.collection = collection
+        self.on_flush = on_flush
+        self.max_batch = max_batch
+        self.max_latency = max_latency_ms / 1000
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        self.flushes = 0
+        self.written = 0
+        self.failed = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done() and not self._closing
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def put(self, doc: dict):
+        if not self.running:
+            raise RuntimeError("Write-behind buffer is not running")
+        await self._queue.put(doc)
+
+    async def close(self):
+        """Stop accepting documents and flush everything still queued."""
+        if self._task is None or self._closing:
+            return
+        self._closing = True
+        await self._queue.put(_STOP)
+        await self._task
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "max_batch": self.max_batch,
+            "max_latency_ms": self.max_latency * 1000,
+            "flushes": self.flushes,
+            "written": self.written,
+            "failed": self.failed,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list):
+        start = time.perf_counter()
+        try:
+            await self.collection.insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except BulkWriteError as e:
+            errors = len(e.details.get('writeErrors', []))
+            self.written += len(batch) - errors
+            self.failed += errors
+            logger.error("Write-behind flush dropped %d of %d documents", errors, len(batch))
+        except Exception:
+            # Anything else (a serialization error, say) loses this batch but must not stop the buffer
+            self.failed += len(batch)
+            logger.exception("Write-behind flush of %d documents failed", len(batch))
+        elapsed = (time.perf_counter() - start) * 1000
+        self.flushes += 1
+        self.last_flush_ms = elapsed
+        self.max_flush_ms = max(self.max_flush_ms, elapsed)
+        self.total_flush_ms += elapsed
+        if self.on_flush is not None:
+            try:
+                await self.on_flush()
+            except Exception:
+                logger.exception("Write-behind flush callback failed")
@@ -1,18 +1,256 @@
 #!/usr/bin/env python3
+"""Static file server for loading the extension's test pages during QA.
+
+    python3 test-server.py [--root DIR] [--port 8080] [--precompress]
+
+Requests are handled on a thread each over keep-alive connections. File bodies
+go out with sendfile(), and responses carry an ETag and Last-Modified so that
+reloads are answered with 304 Not Modified. Single byte ranges are supported.
+If a `.br` or `.gz` copy of a file sits next to it and is at least as new, that
+copy is served to clients that accept the encoding. --precompress creates those
+copies for the text assets (`.br` only when the brotli package is installed).
+
+The root defaults to the directory containing this script.
+"""
+import argparse
+import email.utils
+import gzip
 import http.server
-import socketserver
 import os
+import re
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('.html', '.htm', '.js', '.css', '.json', '.svg', '.md', '.txt', '.map')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def etag_matches(header, etag):
+    """Weak comparison of an If-None-Match / If-Range value against `etag`."""
+    if header.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    return any((tag[2:] if tag.startswith('W/') else tag) == opaque for tag in (t.strip() for t in header.split(',')))
+
+def parse_range(header, length):
+    """(start, end) for a single `bytes=` range, None to ignore the header, or False if unsatisfiable."""
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', header)
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        start, end = max(length - int(last), 0), length - 1
+    else:
+        start = int(first)
+        end = min(int(last), length - 1) if last else length - 1
+    if start >= length or start > end:
+        return False
+    return start, end
+
+
+class StaticHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    cache_control = 'no-cache'
 
-class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     def end_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', '*')
         super().end_headers()
 
-if __name__ == "__main__":
-    os.chdir('/app/extension-ready')
-    PORT = 8080
-    with socketserver.TCPServer(("", PORT), MyHTTPRequestHandler) as httpd:
-        print(f"Serving at port {PORT}")
-        httpd.serve_forever()
\ No newline at end of file
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self.serve(head=False)
+
+    def do_HEAD(self):
+        self.serve(head=True)
+
+    def serve(self, head):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            index = next((os.path.join(path, name) for name in ('index.html', 'index.htm')
+                          if os.path.isfile(os.path.join(path, name))), None)
+            if index is None or not self.path.split('?', 1)[0].endswith('/'):
+                # Redirects to the trailing slash and directory listings are left to the base class
+                f = super().send_head()
+                if f:
+                    try:
+                        if not head:
+                            self.copyfile(f, self.wfile)
+                    finally:
+                        f.close()
+                return
+            path = index
+
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(404, 'File not found')
+            return
+        original = os.fstat(f.fileno())
+        encoding, f = self.pick_encoding(path, original, f)
+        with f:
+            content_type = self.guess_type(path)
+            st = os.fstat(f.fileno())
+            etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}{"-" + encoding if encoding else ""}"'
+            last_modified = email.utils.formatdate(original.st_mtime, usegmt=True)
+
+            if self.not_modified(etag, original.st_mtime):
+                self.send_response(304)
+                self.send_validators(etag, last_modified)
+                self.end_headers()
+                return
+
+            start, end = 0, st.st_size - 1
+            status = 200
+            requested = self.headers.get('Range')
+            if requested and self.range_applies(etag, last_modified):
+                byte_range = parse_range(requested, st.st_size)
+                if byte_range is False:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{st.st_size}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if byte_range is not None:
+                    start, end = byte_range
+                    status = 206
+
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            if status == 206:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{st.st_size}')
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            if self.has_variants(path):
+                self.send_header('Vary', 'Accept-Encoding')
+            self.send_validators(etag, last_modified)
+            self.end_headers()
+            if not head and end >= start:
+                self.wfile.flush()
+                self.connection.sendfile(f, start, end - start + 1)
+
+    def pick_encoding(self, path, original, f):
+        """The best precompressed variant the client accepts, as (encoding, open file)."""
+        accepted = {part.split(';')[0].strip().lower() for part in self.headers.get('Accept-Encoding', '').split(',')
+                    if not re.search(r';\s*q=0(\.0*)?\s*$', part)}
+        for encoding, suffix in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            try:
+                variant = open(path + suffix, 'rb')
+            except OSError:
+                continue
+            if os.fstat(variant.fileno()).st_mtime_ns >= original.st_mtime_ns:
+                f.close()
+                return encoding, variant
+            variant.close()
+        return None, f
+
+    @staticmethod
+    def has_variants(path):
+        return any(os.path.exists(path + suffix) for _, suffix in ENCODINGS)
+
+    def send_validators(self, etag, last_modified):
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.send_header('Cache-Control', self.cache_control)
+
+    def not_modified(self, etag, mtime):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag_matches(if_none_match, etag)
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since
+        return False
+
+    def range_applies(self, etag, last_modified):
+        if_range = self.headers.get('If-Range')
+        if if_range is None:
+            return True
+        if if_range.startswith(('"', 'W/')):
+            return not if_range.startswith('W/') and if_range.strip() == etag
+        return if_range.strip() == last_modified
+
+
+class StaticServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def precompress(root):
+    """Write .gz (and .br) copies of text assets that are missing or older than the original."""
+    written = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            path = os.path.join(directory, name)
+            original = os.stat(path)
+            if original.st_size < 1024:
+                continue
+            codecs = [('.gz', lambda data: gzip.compress(data, 9, mtime=0))]
+            if brotli is not None:
+                codecs.append(('.br', lambda data: brotli.compress(data, quality=11)))
+            data = None
+            for suffix, compress in codecs:
+                target = path + suffix
+                if os.path.exists(target) and os.stat(target).st_mtime_ns >= original.st_mtime_ns:
+                    continue
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                with open(target, 'wb') as f:
+                    f.write(compress(data))
+                written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the extension files for QA.')
+    parser.add_argument('--root', default=os.path.dirname(os.path.abspath(__file__)),
+                        help='directory to serve (default: the directory of this script)')
+    parser.add_argument('--bind', default='', help='address to bind (default: all interfaces)')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-age', type=int, default=0,
+                        help='seconds browsers may reuse a file without revalidating (default: always revalidate)')
+    parser.add_argument('--precompress', action='store_true', help='create .gz/.br copies of text assets first')
+    args = parser.parse_args()
+
+    root = os.path.abspath(args.root)
+    if not os.path.isdir(root):
+        sys.exit(f'{root} is not a directory')
+    if args.precompress:
+        print(f'Precompressed {precompress(root)} file(s)')
+
+    class Handler(StaticHandler):
+        cache_control = f'max-age={args.max_age}' if args.max_age else 'no-cache'
+
+        def __init__(self, *a, **kw):
+            super().__init__(*a, directory=root, **kw)
+
+    with StaticServer((args.bind, args.port), Handler) as httpd:
+        print(f'Serving {root} at port {args.port}')
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
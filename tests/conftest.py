@@ -0,0 +1,46 @@
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()['test']
+
+
+def make_app(**overrides):
+    settings = server.Settings(**{
+        'mongo_url': 'mongodb://mock', 'db_name': 'test', 'image_variants_on_upload': False, **overrides,
+    })
+    return server.create_app(settings, mongo_client=AsyncMongoMockClient())
+
+
+@pytest.fixture
+def settings_overrides():
+    """Settings for the `app` fixture; override in a module to configure it."""
+    return {}
+
+
+@pytest.fixture
+async def app(settings_overrides):
+    app = make_app(**settings_overrides)
+    async with app.router.lifespan_context(app):
+        yield app
+
+
+@pytest.fixture
+async def client(app):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        yield client
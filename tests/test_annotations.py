@@ -0,0 +1,124 @@
+import asyncio
+import random
+
+import pytest
+
+import annotation_store
+
+pytestmark = pytest.mark.anyio
+
+IMAGE = b'\x89PNG' + bytes(range(100))
+
+
+def embedded(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    return [{'id': f'e{n}', 'relativeX': rng.random(), 'relativeY': rng.random(), 'text': f'note {n}'}
+            for n in range(count)]
+
+
+async def screenshot_with(client, annotations: list, screenshot_id: str = 'shot') -> str:
+    assert (await client.post(f'/api/screenshots?id={screenshot_id}', content=IMAGE,
+                              headers={'Content-Type': 'image/png'})).status_code == 201
+    response = await client.post('/api/sync/push', json={'items': [
+        {'kind': 'screenshot', 'id': screenshot_id, 'base_version': 1, 'data': {'annotations': annotations}},
+    ]})
+    assert response.json()['results'][0]['status'] == 'applied'
+    return screenshot_id
+
+
+async def listed(client, screenshot_id: str, bbox: str = None) -> list:
+    params = {'bbox': bbox} if bbox else {}
+    response = await client.get(f'/api/screenshots/{screenshot_id}/annotations', params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+async def test_concurrent_creates_on_unsplit_screenshot(client):
+    sid = await screenshot_with(client, embedded(10))
+    responses = await asyncio.gather(*(
+        client.post(f'/api/screenshots/{sid}/annotations', json={'id': f'n{n}', 'relativeX': 0.5, 'relativeY': 0.5})
+        for n in range(20)
+    ))
+    assert {r.status_code for r in responses} == {201}
+    ids = {a['id'] for a in await listed(client, sid)}
+    assert ids == {f'e{n}' for n in range(10)} | {f'n{n}' for n in range(20)}
+
+
+async def test_concurrent_splits_agree(app, client):
+    sid = await screenshot_with(client, embedded(10))
+    db, grid = app.state.db, app.state.settings.annotation_grid_size
+    generations = await asyncio.gather(*(annotation_store.split(db, sid, grid) for _ in range(5)))
+    assert len({generation['token'] for generation in generations}) == 1
+    assert await db.annotations.count_documents({'screenshot_id': sid}) == 10
+
+
+async def test_whole_array_push_replaces_records(client):
+    sid = await screenshot_with(client, embedded(3))
+    assert (await client.post(f'/api/screenshots/{sid}/annotations',
+                              json={'id': 'added', 'relativeX': 0.1, 'relativeY': 0.1})).status_code == 201
+    version = (await client.get(f'/api/screenshots/{sid}')).json()['version']
+    response = await client.post('/api/sync/push', json={'items': [
+        {'kind': 'screenshot', 'id': sid, 'base_version': version, 'data': {'annotations': embedded(2, seed=1)}},
+    ]})
+    assert response.json()['results'][0]['status'] == 'applied'
+
+    assert {a['id'] for a in await listed(client, sid)} == {'e0', 'e1'}
+    assert (await client.patch(f'/api/screenshots/{sid}/annotations/added', json={'text': 'x'})).status_code == 404
+    assert (await client.post(f'/api/screenshots/{sid}/annotations',
+                              json={'id': 'next', 'relativeX': 0.2, 'relativeY': 0.2})).status_code == 201
+    assert {a['id'] for a in await listed(client, sid)} == {'e0', 'e1', 'next'}
+
+
+@pytest.mark.parametrize('bbox', [(0, 0, 1, 1), (0.1, 0.2, 0.3, 0.35), (0.5, 0.5, 0.5, 0.5), (0.0, 0.9, 1.0, 1.0)])
+async def test_bbox_matches_a_scan(client, bbox):
+    annotations = embedded(200)
+    annotations.append({'id': 'edge', 'relativeX': bbox[2], 'relativeY': bbox[3]})
+    sid = await screenshot_with(client, annotations)
+    expected = {a['id'] for a in annotations
+                if bbox[0] <= a['relativeX'] <= bbox[2] and bbox[1] <= a['relativeY'] <= bbox[3]}
+    query = ','.join(map(str, bbox))
+
+    # Filtered from the embedded array before the first edit, then from the grid index after it
+    assert {a['id'] for a in await listed(client, sid, query)} == expected
+    assert (await client.patch(f'/api/screenshots/{sid}/annotations/e0', json={'text': 'edited'})).status_code == 200
+    assert {a['id'] for a in await listed(client, sid, query)} == expected
+
+
+async def test_grid_size_change_after_split(app, client):
+    annotations = embedded(200)
+    sid = await screenshot_with(client, annotations)
+    assert (await client.patch(f'/api/screenshots/{sid}/annotations/e0', json={'text': 'split'})).status_code == 200
+
+    # Records keep the grid they were split on until the array is written again
+    app.state.settings.annotation_grid_size = 4
+    bbox = (0.1, 0.2, 0.3, 0.35)
+    moved = {'relativeX': 0.2, 'relativeY': 0.3}
+    assert (await client.patch(f'/api/screenshots/{sid}/annotations/e1', json=moved)).status_code == 200
+    annotations[1].update(moved)
+    expected = {a['id'] for a in annotations
+                if bbox[0] <= a['relativeX'] <= bbox[2] and bbox[1] <= a['relativeY'] <= bbox[3]}
+    assert 'e1' in expected
+    assert {a['id'] for a in await listed(client, sid, ','.join(map(str, bbox)))} == expected
+
+    record = await app.state.db.annotations.find_one({'screenshot_id': sid, 'id': 'e1'})
+    assert record['cell'] == annotation_store.cell_of(0.2, 0.3, 16)
+
+
+def test_cells_in_covers_the_box():
+    rng = random.Random(2)
+    for _ in range(200):
+        x0, x1 = sorted((rng.random(), rng.random()))
+        y0, y1 = sorted((rng.random(), rng.random()))
+        cells = annotation_store.cells_in((x0, y0, x1, y1), 16)
+        if cells is None:
+            continue
+        for _ in range(20):
+            x, y = rng.uniform(x0, x1), rng.uniform(y0, y1)
+            assert annotation_store.cell_of(x, y, 16) in cells
+
+
+async def test_invalid_bbox(client):
+    sid = await screenshot_with(client, [])
+    for bbox in ('1,2,3', 'a,b,c,d', '0.5,0,0.4,1'):
+        response = await client.get(f'/api/screenshots/{sid}/annotations', params={'bbox': bbox})
+        assert response.status_code == 400
@@ -0,0 +1,109 @@
+import hashlib
+
+import pytest
+
+from blob_store import BlobTooLarge, ChunkedBlobStore
+
+pytestmark = pytest.mark.anyio
+
+DATA = bytes(range(256)) * 4
+
+
+async def stream(data: bytes, size: int = 100):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def test_put_deduplicates_and_counts_references(db):
+    store = ChunkedBlobStore(db, chunk_size=64)
+    first = await store.put(stream(DATA), 'image/png')
+    second = await store.put(stream(DATA), 'image/png')
+
+    assert first['id'] == second['id'] == hashlib.sha256(DATA).hexdigest()
+    assert (first['deduplicated'], second['deduplicated']) == (False, True)
+    assert (await store.get(first['id']))['refcount'] == 2
+    # The second upload's chunks were discarded
+    assert await db['blobs.chunks'].count_documents({}) == len(DATA) // 64
+
+    await store.release(first['id'])
+    assert (await store.get(first['id']))['refcount'] == 1
+    await store.release(first['id'])
+    assert await store.get(first['id']) is None
+    assert await db['blobs.chunks'].count_documents({}) == 0
+
+
+async def test_acquire_unknown_blob(db):
+    store = ChunkedBlobStore(db)
+    assert await store.acquire('0' * 64) is None
+
+
+async def test_put_over_limit_leaves_nothing_behind(db):
+    store = ChunkedBlobStore(db, chunk_size=64)
+    with pytest.raises(BlobTooLarge):
+        await store.put(stream(DATA), 'image/png', max_bytes=500)
+    assert await db['blobs.chunks'].count_documents({}) == 0
+    assert await db['blobs.files'].count_documents({}) == 0
+
+
+@pytest.mark.parametrize('start,end', [(0, None), (0, 0), (10, 63), (63, 64), (50, 700), (1023, 1023)])
+async def test_read_range_across_chunks(db, start, end):
+    store = ChunkedBlobStore(db, chunk_size=64)
+    blob = await store.put(stream(DATA), 'image/png')
+    data = b''.join([chunk async for chunk in store.read_range(blob, start, end)])
+    assert data == DATA[start:None if end is None else end + 1]
+
+
+async def upload(client) -> str:
+    response = await client.post('/api/screenshots?id=shot', content=DATA, headers={'Content-Type': 'image/png'})
+    assert response.status_code == 201
+    return response.json()['id']
+
+
+async def test_serve_blob_full_and_partial(client):
+    await upload(client)
+    full = await client.get('/api/screenshots/shot/image')
+    assert full.status_code == 200
+    assert full.content == DATA
+    assert full.headers['accept-ranges'] == 'bytes'
+
+    partial = await client.get('/api/screenshots/shot/image', headers={'Range': 'bytes=100-199'})
+    assert partial.status_code == 206
+    assert partial.content == DATA[100:200]
+    assert partial.headers['content-range'] == f'bytes 100-199/{len(DATA)}'
+
+    suffix = await client.get('/api/screenshots/shot/image', headers={'Range': 'bytes=-24'})
+    assert suffix.status_code == 206
+    assert suffix.content == DATA[-24:]
+
+
+async def test_serve_blob_unsatisfiable_range(client):
+    await upload(client)
+    response = await client.get('/api/screenshots/shot/image', headers={'Range': f'bytes={len(DATA)}-'})
+    assert response.status_code == 416
+    assert response.headers['content-range'] == f'bytes */{len(DATA)}'
+
+
+async def test_serve_blob_if_range(client):
+    await upload(client)
+    etag = (await client.get('/api/screenshots/shot/image')).headers['etag']
+
+    current = await client.get('/api/screenshots/shot/image', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert current.status_code == 206
+    assert current.content == DATA[:10]
+
+    # A stale validator gets the whole current content instead of a fragment
+    stale = await client.get('/api/screenshots/shot/image', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert stale.status_code == 200
+    assert stale.content == DATA
+
+    unchanged = await client.get('/api/screenshots/shot/image', headers={'If-None-Match': etag})
+    assert unchanged.status_code == 304
+
+
+async def test_upload_with_known_sha256_skips_the_body(client):
+    await upload(client)
+    sha256 = hashlib.sha256(DATA).hexdigest()
+    response = await client.post(f'/api/screenshots?id=again&sha256={sha256}')
+    assert response.status_code == 201
+    assert response.headers['x-deduplicated'] == 'true'
+    assert response.json()['blob_id'] == sha256
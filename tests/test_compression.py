@@ -0,0 +1,100 @@
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from compression import CompressionMiddleware, _Gzip, available_encodings, negotiate
+
+pytestmark = pytest.mark.anyio
+
+ROWS = [{'id': n, 'client_name': f'client {n}'} for n in range(200)]
+
+
+async def rows(request):
+    return JSONResponse(ROWS, headers={'ETag': '"v1"'})
+
+async def small(request):
+    return JSONResponse({'ok': True})
+
+async def media(request):
+    return Response(b'\0' * 4096, media_type=request.path_params['type'].replace('-', '/'))
+
+async def stream(request):
+    async def lines():
+        for row in ROWS:
+            yield f'{row}\n'.encode()
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+
+def client(**options) -> httpx.AsyncClient:
+    app = Starlette(routes=[Route('/rows', rows), Route('/small', small), Route('/media/{type}', media),
+                            Route('/stream', stream)])
+    app.add_middleware(CompressionMiddleware, **options)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test')
+
+
+@pytest.mark.parametrize('header,expected', [
+    ('gzip', 'gzip'),
+    ('gzip, zstd', 'zstd'),
+    ('br;q=0.5, gzip;q=0.8', 'gzip'),
+    ('zstd;q=0, *', 'br'),
+    ('identity', None),
+    ('gzip;q=0', None),
+    ('', None),
+])
+def test_negotiate(header, expected):
+    assert negotiate(header, ['zstd', 'br', 'gzip']) == expected
+
+
+async def test_gzip_response():
+    async with client() as c:
+        response = await c.get('/rows', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.headers['vary'] == 'Accept-Encoding'
+    assert response.headers['etag'] == 'W/"v1"'
+    assert response.num_bytes_downloaded < len(response.content)
+    assert response.json() == ROWS
+
+
+@pytest.mark.parametrize('encoding', list(available_encodings()))
+async def test_each_available_encoding_round_trips(encoding):
+    async with client() as c:
+        response = await c.get('/rows', headers={'Accept-Encoding': encoding})
+    assert response.headers['content-encoding'] == encoding
+    assert response.json() == ROWS
+
+
+async def test_streamed_response_is_compressed_incrementally():
+    async with client(encodings={'gzip': _Gzip}) as c:
+        response = await c.get('/stream', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.text == ''.join(f'{row}\n' for row in ROWS)
+
+
+async def test_identity_only_client_gets_the_original():
+    async with client() as c:
+        response = await c.get('/rows', headers={'Accept-Encoding': 'identity'})
+    assert 'content-encoding' not in response.headers
+    assert response.headers['etag'] == '"v1"'
+
+
+async def test_small_responses_pass_through():
+    async with client(minimum_size=1024) as c:
+        response = await c.get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'content-encoding' not in response.headers
+
+
+@pytest.mark.parametrize('media_type', ['application-pdf', 'image-png', 'image-webp', 'application-zip'])
+async def test_compressed_media_types_are_skipped(media_type):
+    async with client() as c:
+        response = await c.get(f'/media/{media_type}', headers={'Accept-Encoding': 'gzip'})
+    assert 'content-encoding' not in response.headers
+    assert response.content == b'\0' * 4096
+
+
+async def test_svg_is_compressed():
+    async with client() as c:
+        response = await c.get('/media/image-svg+xml', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+
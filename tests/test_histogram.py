@@ -0,0 +1,66 @@
+import math
+import random
+
+import pytest
+
+from benchmarks.histogram import LatencyHistogram
+
+PERCENTILES = (0.1, 1, 50, 90, 95, 99, 99.9, 100)
+
+
+def exact(values, p: float) -> int:
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(len(ordered) * p / 100)) - 1]
+
+
+def sample(seed: int, count: int = 20000):
+    rng = random.Random(seed)
+    return [int(rng.lognormvariate(8, 1.5)) for _ in range(count)]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_percentiles_within_one_percent(seed):
+    values = sample(seed)
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    for p in PERCENTILES:
+        expected = exact(values, p)
+        assert abs(histogram.percentile(p) - expected) <= max(1, expected * 0.01), p
+    assert histogram.percentile(100) == max(values)
+    assert (histogram.total, histogram.min, histogram.max) == (len(values), min(values), max(values))
+    assert histogram.mean == pytest.approx(sum(values) / len(values))
+
+
+def test_small_values_are_exact():
+    values = list(range(256)) * 3
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    for p in PERCENTILES:
+        assert histogram.percentile(p) == exact(values, p)
+
+
+def test_merge_matches_a_single_histogram():
+    values = sample(7)
+    whole, parts = LatencyHistogram(), [LatencyHistogram() for _ in range(4)]
+    for i, value in enumerate(values):
+        whole.record(value)
+        parts[i % 4].record(value)
+    merged = LatencyHistogram()
+    for part in parts:
+        merged.merge(part)
+    assert merged.counts == whole.counts
+    assert merged.summary() == whole.summary()
+
+
+def test_empty_and_weighted_records():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(99) == 0
+    assert histogram.summary()['count'] == 0
+    histogram.record(1000, count=99)
+    histogram.record(50000)
+    # A percentile reports the upper bound of its bucket, capped at the maximum
+    assert histogram.percentile(99) == pytest.approx(1000, rel=0.01)
+    assert histogram.percentile(99.5) == 50000
@@ -0,0 +1,50 @@
+import pytest
+
+import server
+from .conftest import make_app
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_writes_invalidate_by_tag(client):
+    first = await client.get('/api/status')
+    assert first.headers['x-cache'] == 'MISS'
+    cached = await client.get('/api/status')
+    assert cached.headers['x-cache'] == 'HIT'
+    assert cached.json() == first.json()
+
+    assert (await client.post('/api/status', json={'client_name': 'probe'})).status_code == 200
+    fresh = await client.get('/api/status')
+    assert fresh.headers['x-cache'] == 'MISS'
+    assert [s['client_name'] for s in fresh.json()] == ['probe']
+
+    # Routes without the tag keep their entries
+    assert (await client.get('/api/')).headers['x-cache'] == 'MISS'
+    await client.post('/api/status', json={'client_name': 'again'})
+    assert (await client.get('/api/')).headers['x-cache'] == 'HIT'
+
+
+async def test_query_strings_are_cached_separately(client):
+    await client.post('/api/status', json={'client_name': 'a'})
+    await client.post('/api/status', json={'client_name': 'b'})
+    one = await client.get('/api/status', params={'limit': 1})
+    two = await client.get('/api/status', params={'limit': 2})
+    assert (one.headers['x-cache'], two.headers['x-cache']) == ('MISS', 'MISS')
+    assert (len(one.json()), len(two.json())) == (1, 2)
+
+
+@pytest.mark.parametrize('overrides,active', [
+    ({}, True),
+    ({'web_concurrency': 4}, False),
+    ({'web_concurrency': 4, 'response_cache_backend': 'cache_backends:shared'}, True),
+    ({'web_concurrency': 4, 'response_cache_enabled': True}, True),
+    ({'response_cache_enabled': False}, False),
+])
+def test_enabled_by_default_only_where_invalidations_reach_every_worker(overrides, active):
+    settings = server.Settings(mongo_url='mongodb://mock', db_name='test', **overrides)
+    assert server.response_cache_active(settings) is active
+
+
+async def test_root_ttl_is_configurable():
+    app = make_app(response_cache_root_ttl_seconds=60)
+    assert app.state.response_cache.stats()['routes']['/api/']['ttl'] == 60
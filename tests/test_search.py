@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import sync_log
+
+pytestmark = pytest.mark.anyio
+
+IMAGE = b'\x89PNG' + bytes(range(150))
+
+
+async def upload(client, screenshot_id: str, **meta) -> str:
+    response = await client.post('/api/screenshots', params={'id': screenshot_id, **meta}, content=IMAGE,
+                                 headers={'Content-Type': 'image/png'})
+    assert response.status_code == 201
+    return screenshot_id
+
+
+async def search(client, q: str, **params):
+    response = await client.get('/api/search', params={'q': q, **params})
+    assert response.status_code == 200
+    return response.json()
+
+
+async def found(client, q: str, **params) -> list:
+    return [hit['id'] for hit in (await search(client, q, **params))['results']]
+
+
+async def test_refresh_waits_for_earlier_writes(app, client):
+    db = app.state.db
+    async with sync_log.change(db) as stamp:
+        # A later upload commits while an earlier write is still in progress
+        await upload(client, 'late', title='Harbour at dusk')
+        assert await found(client, 'harbour') == []
+        assert app.state.search_index.seq < stamp['seq']
+        await db.screenshots.insert_one({'id': 'early', 'title': 'Harbour at dawn', 'version': 1, **stamp})
+
+    assert set(await found(client, 'harbour')) == {'early', 'late'}
+    assert app.state.search_index.seq == await sync_log.committed_seq(db)
+
+
+async def test_deleted_screenshots_and_annotations_drop_out(client):
+    await upload(client, 'kept', title='Lighthouse')
+    await upload(client, 'gone', title='Lighthouse keeper')
+    assert set(await found(client, 'lighthouse')) == {'kept', 'gone'}
+    assert (await client.delete('/api/screenshots/gone')).status_code == 204
+    assert await found(client, 'lighthouse') == ['kept']
+
+    assert (await client.post('/api/screenshots/kept/annotations',
+                              json={'id': 'n1', 'relativeX': 0.5, 'relativeY': 0.5, 'text': 'seagulls'})).status_code == 201
+    assert await found(client, 'seagulls') == ['kept']
+    assert (await client.delete('/api/screenshots/kept/annotations/n1')).status_code == 204
+    assert await found(client, 'seagulls') == []
+    assert await found(client, 'lighthouse') == ['kept']
+
+
+async def test_field_weights_and_prefixes(client):
+    # Titles of one word each, so only the field the match is in tells the three apart
+    await upload(client, 'in-title', title='Market')
+    await upload(client, 'in-url', title='Evening', url='https://example.com/market')
+    await upload(client, 'in-session', title='Morning', session_id='s1')
+    response = await client.post('/api/sync/push', json={'items': [
+        {'kind': 'session', 'id': 's1', 'data': {'name': 'Market day'}},
+    ]})
+    assert response.json()['results'][0]['status'] == 'applied'
+
+    assert await found(client, 'market') == ['in-title', 'in-session', 'in-url']
+    # Every word has to match, each as a prefix
+    assert await found(client, 'mark eve') == ['in-url']
+    assert await found(client, 'market morn') == ['in-session']
+    # URL scheme words are not indexed
+    assert await found(client, 'https') == []
+
+    await upload(client, 'exact', title='Mar')
+    await upload(client, 'longer', title='Marina')
+    hits = (await search(client, 'mar'))['results']
+    assert hits[0]['id'] == 'exact'
+    assert {hit['id'] for hit in hits} >= {'exact', 'longer', 'in-title'}
+    # Below the minimum prefix length a word only matches itself
+    assert await found(client, 'm') == []
+
+
+async def test_renaming_a_session_reindexes_its_screenshots(client):
+    await upload(client, 'a', session_id='s1')
+    await upload(client, 'b', session_id='s1')
+    await client.post('/api/sync/push', json={'items': [{'kind': 'session', 'id': 's1', 'data': {'name': 'Alps'}}]})
+    assert set(await found(client, 'alps')) == {'a', 'b'}
+    await client.post('/api/sync/push', json={'items': [
+        {'kind': 'session', 'id': 's1', 'base_version': 1, 'data': {'name': 'Pyrenees'}},
+    ]})
+    assert await found(client, 'alps') == []
+    assert set(await found(client, 'pyrenees', session_id='s1')) == {'a', 'b'}
+    assert await found(client, 'pyrenees', session_id='other') == []
+
+
+async def test_pagination(client):
+    start = datetime(2024, 1, 1)
+    for n in range(5):
+        await upload(client, f'p{n}', title='Postcard', timestamp=(start + timedelta(minutes=n)).isoformat())
+
+    offset, seen = 0, []
+    while offset is not None:
+        page = await search(client, 'postcard', offset=offset, limit=2)
+        assert page['total'] == 5
+        assert len(page['results']) <= 2
+        seen += [hit['id'] for hit in page['results']]
+        offset = page.get('next_offset')
+    # Equal scores go to the newest capture first
+    assert seen == ['p4', 'p3', 'p2', 'p1', 'p0']
+    assert (await client.get('/api/search', params={'q': 'postcard', 'limit': 10 ** 6})).status_code == 422
@@ -0,0 +1,87 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import sync_log
+from similarity import HammingIndex, SimilarityIndex, cluster_near_duplicates, to_signed
+
+
+def brute_force(items: dict, value: int, max_distance: int):
+    distances = {item_id: bin(hash_ ^ value).count('1') for item_id, hash_ in items.items()}
+    return {(item_id, d) for item_id, d in distances.items() if d <= max_distance}
+
+
+def near(value: int, bits: int, rng: random.Random) -> int:
+    for position in rng.sample(range(64), bits):
+        value ^= 1 << position
+    return value
+
+
+@pytest.mark.parametrize('max_distance', [0, 1, 3, 4, 10, 64])
+def test_query_matches_brute_force(max_distance):
+    rng = random.Random(max_distance)
+    bases = [rng.getrandbits(64) for _ in range(20)]
+    items = {f'i{n}': near(rng.choice(bases), rng.randint(0, 12), rng) for n in range(500)}
+    index = HammingIndex(capacity=16)
+    for item_id, value in items.items():
+        index.add(item_id, to_signed(value))
+
+    for value in bases + [rng.getrandbits(64)]:
+        found = index.query(to_signed(value), max_distance)
+        assert set(found) == brute_force(items, value, max_distance)
+        assert [d for _, d in found] == sorted(d for _, d in found)
+
+
+def test_remove_and_replace():
+    rng = random.Random(1)
+    items = {f'i{n}': rng.getrandbits(64) for n in range(2000)}
+    index = HammingIndex()
+    for item_id, value in items.items():
+        index.add(item_id, value)
+    # Enough removals to trigger a compaction
+    for n in range(0, 2000, 2):
+        index.remove(f'i{n}')
+        del items[f'i{n}']
+    index.add('i1', items['i3'])
+    items['i1'] = items['i3']
+
+    assert len(index) == len(items)
+    for value in list(items.values())[:50]:
+        assert set(index.query(value, 2)) == brute_force(items, value, 2)
+
+
+def test_query_limit_keeps_the_closest():
+    index = HammingIndex()
+    for distance in range(6):
+        index.add(f'd{distance}', (1 << distance) - 1)
+    assert index.query(0, 5, limit=3) == [('d0', 0), ('d1', 1), ('d2', 2)]
+
+
+def test_cluster_near_duplicates():
+    items = [('a', 0b0000), ('b', 0b0001), ('c', 0b1111_0000), ('d', 0b0011), ('e', 0b1111_0001)]
+    assert cluster_near_duplicates(items, 1) == [['a', 'b', 'd'], ['c', 'e']]
+
+
+async def write_hash(db, screenshot_id: str, value: int, stamped_at: datetime):
+    async with sync_log.change(db) as stamp:
+        await db.screenshots.update_one(
+            {'id': screenshot_id}, {'$set': {'dhash': to_signed(value), 'dhash_at': stamped_at, **stamp}})
+
+
+@pytest.mark.anyio
+async def test_index_catches_up_on_hashes_written_out_of_order(db):
+    now = datetime.utcnow()
+    await db.screenshots.insert_many([{'id': i} for i in ('query', 'slow', 'fast')])
+    reader = SimilarityIndex()
+    await write_hash(db, 'query', 0, now)
+
+    # One worker takes its seq first but commits last, with a clock running behind the other's
+    async with sync_log.change(db) as slow:
+        await write_hash(db, 'fast', 0b1, now + timedelta(seconds=5))
+        assert await reader.similar(db, 'query', 0, 4, 10) == []
+        await db.screenshots.update_one(
+            {'id': 'slow'}, {'$set': {'dhash': 0b11, 'dhash_at': now - timedelta(seconds=5), **slow}})
+
+    matches = await reader.similar(db, 'query', 0, 4, 10)
+    assert [(doc['id'], distance) for doc, distance in matches] == [('fast', 1), ('slow', 2)]
@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+
+import orjson
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+NDJSON = {'Content-Type': 'application/x-ndjson'}
+
+
+async def bulk(client, content: bytes, headers: dict = NDJSON):
+    response = await client.post('/api/status/bulk', content=content, headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+async def listed(client, **params) -> list:
+    response = await client.get('/api/status', params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+async def test_bulk_json_reports_invalid_items(client):
+    items = [{'client_name': 'a'}, {'name': 'no client'}, {'client_name': 'b'}, 'text', {'client_name': ['c']}]
+    result = await bulk(client, orjson.dumps(items), {'Content-Type': 'application/json'})
+    assert result['inserted'] == 2
+    assert [e['index'] for e in result['errors']] == [1, 3, 4]
+    assert sorted(s['client_name'] for s in await listed(client)) == ['a', 'b']
+    assert {s['id'] for s in await listed(client)} == set(result['ids'])
+
+
+async def test_bulk_ndjson_reports_malformed_lines(client):
+    body = b'{"client_name": "a"}\n{"client_name": \n\n{"client_name": 1}\nnot json\n{"client_name": "b"}\n'
+    result = await bulk(client, body)
+    # Blank lines are skipped, so indexes count items rather than lines
+    assert result['inserted'] == 2
+    assert [e['index'] for e in result['errors']] == [1, 2, 3]
+    assert result['errors'][0]['error'].startswith('Malformed JSON')
+    assert sorted(s['client_name'] for s in await listed(client)) == ['a', 'b']
+
+
+async def test_bulk_rejects_a_body_that_is_not_an_array(client):
+    response = await client.post('/api/status/bulk', content=b'{"client_name": "a"}',
+                                 headers={'Content-Type': 'application/json'})
+    assert response.status_code == 400
+    response = await client.post('/api/status/bulk', content=b'[{"client_name": ',
+                                 headers={'Content-Type': 'application/json'})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('settings_overrides', [{'bulk_max_bytes': 64, 'bulk_max_items': 3}])
+async def test_bulk_limits(client):
+    line = b'{"client_name": "a"}\n'
+    assert (await bulk(client, line * 3))['inserted'] == 3
+    assert (await client.post('/api/status/bulk', content=line * 4, headers=NDJSON)).status_code == 413
+
+    async def chunks():
+        for _ in range(5):
+            yield line
+    # Streamed without a Content-Length, the limit is enforced while reading
+    response = await client.post('/api/status/bulk', content=chunks(), headers=NDJSON)
+    assert response.status_code == 413
+    assert 'exceeds 64 bytes' in response.json()['detail']
+    assert len(await listed(client)) == 3
+
+
+async def test_cursor_pages_through_equal_timestamps(app, client):
+    timestamp = datetime(2024, 1, 1)
+    # Several rows share each timestamp, so only the id breaks ties between them
+    rows = [{'id': f'{n:02d}', 'client_name': f'c{n}', 'timestamp': timestamp + timedelta(seconds=n // 3)}
+            for n in range(10)]
+    await app.state.db.status_checks.insert_many([dict(row) for row in reversed(rows)])
+
+    for order, expected in (('asc', rows), ('desc', rows[::-1])):
+        cursor, seen = None, []
+        while True:
+            params = {'limit': 4, 'order': order, 'fields': 'client_name', **({'cursor': cursor} if cursor else {})}
+            response = await client.get('/api/status', params=params)
+            assert response.status_code == 200
+            page = response.json()
+            assert all(set(row) == {'client_name'} for row in page)
+            seen += [row['client_name'] for row in page]
+            cursor = response.headers.get('x-next-cursor')
+            if cursor is None:
+                break
+        assert seen == [row['client_name'] for row in expected]
+
+
+async def test_invalid_list_parameters(client):
+    assert (await client.get('/api/status', params={'cursor': 'not-a-cursor'})).status_code == 400
+    assert (await client.get('/api/status', params={'fields': 'id,secret'})).status_code == 400
+    assert (await client.get('/api/status', params={'limit': 10 ** 6})).status_code == 422
+
+
+async def test_conditional_get(client):
+    await client.post('/api/status', json={'client_name': 'a'})
+    first = await client.get('/api/status')
+    etag = first.headers['etag']
+    assert first.headers['cache-control'] == 'no-cache'
+
+    for held in (etag, f'W/{etag}', f'"other", {etag}'):
+        response = await client.get('/api/status', headers={'If-None-Match': held})
+        assert response.status_code == 304
+        assert response.headers['etag'] == etag
+        assert response.content == b''
+    # Each page has its own tag
+    assert (await client.get('/api/status', params={'limit': 1})).headers['etag'] != etag
+
+    await client.post('/api/status', json={'client_name': 'b'})
+    changed = await client.get('/api/status', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert [s['client_name'] for s in changed.json()] == ['a', 'b']
+    etag = changed.headers['etag']
+
+    await bulk(client, b'{"client_name": "c"}\n')
+    changed = await client.get('/api/status', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['etag'] != etag
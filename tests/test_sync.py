@@ -0,0 +1,114 @@
+import hashlib
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import sync_log
+
+pytestmark = pytest.mark.anyio
+
+IMAGE = b'\x89PNG' + bytes(range(200))
+SHA256 = hashlib.sha256(IMAGE).hexdigest()
+
+
+async def push(client, *items):
+    response = await client.post('/api/sync/push', json={'items': list(items)})
+    assert response.status_code == 200
+    body = response.json()
+    assert 'checkpoint' not in body
+    return body['results']
+
+
+async def pull(client, since: int = 0, **params):
+    response = await client.get('/api/sync/changes', params={'since': since, **params})
+    assert response.status_code == 200
+    return response.json()
+
+
+async def test_round_trip(client):
+    assert (await client.post('/api/screenshots?id=up', content=IMAGE,
+                              headers={'Content-Type': 'image/png'})).status_code == 201
+    created = await push(
+        client,
+        {'kind': 'session', 'id': 's1', 'data': {'name': 'Trip'}},
+        {'kind': 'screenshot', 'id': 'b', 'data': {'sha256': SHA256, 'session_id': 's1', 'title': 'Beach'}},
+        {'kind': 'screenshot', 'id': 'c', 'data': {'sha256': '0' * 64}},
+    )
+    assert [r['status'] for r in created] == ['applied', 'applied', 'missing_blob']
+
+    first = await pull(client)
+    assert [(c['kind'], c['id']) for c in first['changes']] == [('screenshot', 'up'), ('session', 's1'),
+                                                                 ('screenshot', 'b')]
+    assert first['checkpoint'] == first['changes'][-1]['seq']
+    assert first['has_more'] is False
+    assert first['changes'][2]['data']['title'] == 'Beach'
+
+    updated, stale = await push(
+        client,
+        {'kind': 'session', 'id': 's1', 'base_version': 1, 'data': {'name': 'Holiday'}},
+        {'kind': 'screenshot', 'id': 'b', 'base_version': 2, 'data': {'title': 'Sea'}},
+    )
+    assert (updated['status'], updated['version']) == ('applied', 2)
+    assert stale['status'] == 'conflict'
+    assert stale['current']['version'] == 1
+
+    deleted, = await push(client, {'kind': 'screenshot', 'id': 'b', 'base_version': 1, 'deleted': True})
+    assert deleted['status'] == 'applied'
+
+    second = await pull(client, first['checkpoint'])
+    changes = {(c['kind'], c['id']): c for c in second['changes']}
+    assert set(changes) == {('session', 's1'), ('screenshot', 'b')}
+    assert changes['session', 's1']['data']['name'] == 'Holiday'
+    assert changes['screenshot', 'b']['deleted'] is True
+    assert changes['screenshot', 'b']['seq'] == deleted['seq']
+
+    assert (await pull(client, second['checkpoint']))['changes'] == []
+    assert (await client.get('/api/screenshots/b')).status_code == 404
+    # Deleting again is idempotent
+    again, = await push(client, {'kind': 'screenshot', 'id': 'b', 'base_version': 1, 'deleted': True})
+    assert again['status'] == 'applied'
+
+
+async def test_paging(client):
+    await push(client, *({'kind': 'session', 'id': f's{n}', 'data': {}} for n in range(5)))
+    since, seen = 0, []
+    while True:
+        page = await pull(client, since, limit=2)
+        seen += [c['id'] for c in page['changes']]
+        since = page['checkpoint']
+        if not page['has_more']:
+            break
+    assert seen == [f's{n}' for n in range(5)]
+    assert (await client.get('/api/sync/changes', params={'limit': 10 ** 6})).status_code == 422
+
+
+async def test_changes_wait_for_earlier_writes(app, client):
+    db = app.state.db
+    async with sync_log.change(db) as stamp:
+        # A later change commits while an earlier one is still being written
+        await push(client, {'kind': 'session', 'id': 'late', 'data': {}})
+        held = await pull(client)
+        assert held['changes'] == []
+        assert held['checkpoint'] < stamp['seq']
+        await db.sessions.insert_one({'id': 'early', 'version': 1, **stamp})
+
+    released = await pull(client, held['checkpoint'])
+    assert [c['id'] for c in released['changes']] == ['early', 'late']
+
+
+async def test_writer_that_died_before_numbering_does_not_block_readers(app, client, monkeypatch):
+    monkeypatch.setattr(sync_log, 'PENDING_SEQ_WAIT', timedelta(milliseconds=50))
+    db = app.state.db
+    await push(client, {'kind': 'session', 'id': 'before', 'data': {}})
+    mark = await sync_log.current_seq(db)
+    # Inserted its marker and took a number, then never recorded it
+    await db.sync_pending.insert_one({'_id': 'dead', 'at': datetime.utcnow(), 'after': mark})
+    await sync_log.next_seq(db)
+    await push(client, {'kind': 'session', 'id': 'after', 'data': {}})
+
+    started = time.monotonic()
+    page = await pull(client)
+    assert time.monotonic() - started < 1
+    assert [c['id'] for c in page['changes']] == ['before']
+    assert page['checkpoint'] == mark
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from write_buffer import WriteBehindBuffer
+
+pytestmark = pytest.mark.anyio
+
+
+class FailingCollection:
+    """Passes insert_many through to `collection`, raising the queued errors first."""
+
+    def __init__(self, collection, *errors: Exception):
+        self.collection = collection
+        self.errors = list(errors)
+        self.batches = []
+
+    async def insert_many(self, docs, ordered=True):
+        self.batches.append(len(docs))
+        if self.errors:
+            raise self.errors.pop(0)
+        return await self.collection.insert_many(docs, ordered=ordered)
+
+
+def docs(count: int, start: int = 0) -> list:
+    return [{'n': n} for n in range(start, start + count)]
+
+
+async def eventually(condition, timeout: float = 2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "condition not met in time"
+        await asyncio.sleep(0.005)
+
+
+async def test_flushes_when_a_batch_fills(db):
+    collection = FailingCollection(db.writes)
+    buffer = WriteBehindBuffer(collection, max_batch=3, max_latency_ms=60000)
+    buffer.start()
+    for doc in docs(7):
+        await buffer.put(doc)
+    # Two full batches go out long before the latency bound; the seventh document waits
+    await eventually(lambda: buffer.flushes == 2)
+    assert collection.batches == [3, 3]
+    assert await db.writes.count_documents({}) == 6
+    await buffer.close()
+    assert collection.batches == [3, 3, 1]
+
+
+async def test_flushes_after_the_latency_bound(db):
+    collection = FailingCollection(db.writes)
+    buffer = WriteBehindBuffer(collection, max_batch=500, max_latency_ms=20)
+    buffer.start()
+    for doc in docs(2):
+        await buffer.put(doc)
+    await eventually(lambda: buffer.flushes == 1)
+    assert collection.batches == [2]
+    assert buffer.stats()['written'] == 2
+    await buffer.close()
+
+
+async def test_survives_failing_flushes_and_callbacks(db):
+    collection = FailingCollection(
+        db.writes, ValueError('cannot encode'),
+        BulkWriteError({'writeErrors': [{'index': 0, 'code': 11000}], 'nInserted': 1}))
+    calls = []
+
+    async def on_flush():
+        calls.append(buffer.flushes)
+        raise RuntimeError('callback failed')
+
+    buffer = WriteBehindBuffer(collection, max_batch=2, max_latency_ms=60000, on_flush=on_flush)
+    buffer.start()
+    for doc in docs(6):
+        await buffer.put(doc)
+    await eventually(lambda: buffer.flushes == 3)
+    assert buffer.running
+    stats = buffer.stats()
+    # The first batch is lost whole, the second loses only the document the server rejected
+    assert (stats['written'], stats['failed']) == (3, 3)
+    assert calls == [1, 2, 3]
+    assert await db.writes.count_documents({}) == 2
+
+    await buffer.put({'n': 6})
+    await buffer.close()
+    assert await db.writes.count_documents({}) == 3
+
+
+async def test_close_drains_the_queue(db):
+    buffer = WriteBehindBuffer(db.writes, max_batch=4, max_latency_ms=60000)
+    buffer.start()
+    for doc in docs(10):
+        await buffer.put(doc)
+    await buffer.close()
+    assert not buffer.running
+    assert await db.writes.count_documents({}) == 10
+    assert buffer.stats()['queue_depth'] == 0
+    with pytest.raises(RuntimeError):
+        await buffer.put({'n': 10})
+    # Closing again is a no-op
+    await buffer.close()